@@ -37,6 +37,9 @@ def create_app(config_name=None):
     # テンプレートグローバル関数を登録
     register_template_globals(app)
     
+    # CLIコマンドを登録
+    register_commands(app)
+    
     return app
 
 
@@ -59,8 +62,16 @@ def register_blueprints(app):
     app.register_blueprint(api_v1_bp)
 
 
+def register_commands(app):
+    """CLIコマンドを登録"""
+    from .knowledge.cli import knowledge_cli
+    
+    app.cli.add_command(knowledge_cli)
+
+
 def register_error_handlers(app):
     """エラーハンドラーを登録"""
+    from .auth.passwords import PasswordHasherBusy
     
     @app.errorhandler(404)
     def not_found_error(error):
@@ -69,6 +80,10 @@ def register_error_handlers(app):
     @app.errorhandler(500)
     def internal_error(error):
         return {'error': 'Internal server error'}, 500
+    
+    @app.errorhandler(PasswordHasherBusy)
+    def password_hasher_busy(error):
+        return {'error': str(error)}, 503, {'Retry-After': str(error.retry_after)}
 
 
 def register_main_routes(app):
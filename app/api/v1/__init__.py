@@ -8,4 +8,4 @@ from flask import Blueprint
 api_v1_bp = Blueprint('api_v1', __name__, url_prefix='/api/v1')
 
 # APIルートのインポート
-from . import auth_api, projects_api, knowledge_api
+from . import auth_api, projects_api, knowledge_api, search_api
@@ -6,6 +6,7 @@
 from flask import request, jsonify
 from . import api_v1_bp
 from ...auth.services import AuthService
+from ...auth.passwords import PasswordHasherBusy
 from ...utils.logger import get_logger
 from ...utils.decorators import require_login
 from ...utils.validators import is_valid_email, is_valid_username
@@ -49,6 +50,8 @@ def register():
             'user': user.to_dict(),
             'message': 'ユーザーが作成されました。メール認証を行ってください。'
         }), 201
+    except PasswordHasherBusy:
+        raise  # 503はエラーハンドラーで返す
     except ValueError as e:
         return jsonify({'error': str(e)}), 400
     except Exception as e:
@@ -87,6 +90,8 @@ def login():
             'user': user.to_dict(),
             'message': 'ログインしました'
         })
+    except PasswordHasherBusy:
+        raise  # 503はエラーハンドラーで返す
     except Exception as e:
         logger.error(f"ログインエラー: {str(e)}")
         return jsonify({'error': 'ログインに失敗しました'}), 500
@@ -3,18 +3,27 @@
 ナレッジベース API v1
 """
 
-from flask import request, jsonify
+import json
+from datetime import datetime, timedelta
+from flask import current_app, request, jsonify
 from . import api_v1_bp
 from ...knowledge.services import (
     create_knowledge_base, 
     get_knowledge_base, 
     update_knowledge_base, 
     delete_knowledge_base,
+    bulk_write_knowledge,
     search_knowledge_base,
-    get_project_knowledge_bases
+    get_project_knowledge_bases,
+    SEARCH_MODES
 )
+from ...models.knowledge import KNOWLEDGE_FIELDS, KNOWLEDGE_SUMMARY_FIELDS
+from ...projects.services import ProjectService
+from ...search import FUSION_METHODS
 from ...utils.decorators import require_project_permission, require_login
 from ...utils.logger import get_logger
+from ...utils.pagination import parse_page_args
+from ...utils.validators import parse_fields, validate_tags
 
 logger = get_logger(__name__)
 
@@ -28,9 +37,19 @@ def list_knowledge_bases():
         if not project_id:
             return jsonify({'error': 'project_idが必要です'}), 400
         
-        knowledge_bases = get_project_knowledge_bases(project_id)
+        limit, cursor, error = parse_page_args(request.args)
+        if error:
+            return jsonify({'error': error}), 400
+        fields, error = parse_fields(request.args.get('fields'), KNOWLEDGE_FIELDS, KNOWLEDGE_SUMMARY_FIELDS)
+        if error:
+            return jsonify({'error': error}), 400
+        
+        knowledge_bases, next_cursor = get_project_knowledge_bases(
+            project_id, tag=request.args.get('tag'), limit=limit, cursor=cursor, fields=fields
+        )
         return jsonify({
-            'knowledge_bases': [kb.to_dict() for kb in knowledge_bases]
+            'knowledge_bases': [kb.to_dict(fields) for kb in knowledge_bases],
+            'next_cursor': next_cursor
         })
     except Exception as e:
         logger.error(f"ナレッジベース一覧取得エラー: {str(e)}")
@@ -49,16 +68,22 @@ def create_knowledge():
         content = data.get('content', '')
         project_id = data.get('project_id')
         category = data.get('category')
+        tags = data.get('tags')
         
         if not title or not project_id:
             return jsonify({'error': 'タイトルとプロジェクトIDが必要です'}), 400
         
+        error = validate_tags(tags)
+        if error:
+            return jsonify({'error': error}), 400
+        
         knowledge_base = create_knowledge_base(
             title=title,
             content=content,
             project_id=project_id,
             category=category,
-            created_by_id=current_user.id
+            created_by_id=current_user.id,
+            tags=tags
         )
         
         return jsonify({
@@ -70,6 +95,67 @@ def create_knowledge():
         return jsonify({'error': 'ナレッジベースの作成に失敗しました'}), 500
 
 
+# NDJSON（1行1操作）として読むContent-Type
+NDJSON_MIMETYPES = ('application/x-ndjson', 'application/ndjson', 'application/jsonl')
+
+
+def _read_bulk_operations(max_operations):
+    """本文のJSON配列（または {"operations": [...]}）かNDJSONから操作のリストを取り出す"""
+    if request.mimetype in NDJSON_MIMETYPES:
+        operations = []
+        for number, line in enumerate(request.stream, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            if len(operations) >= max_operations:
+                raise OverflowError(max_operations)
+            try:
+                operations.append(json.loads(line))
+            except ValueError:
+                raise ValueError(f'{number}行目のJSONが不正です')
+        return operations
+    
+    data = request.get_json(silent=True)
+    if isinstance(data, dict):
+        data = data.get('operations')
+    if not isinstance(data, list):
+        raise ValueError('操作の配列が必要です')
+    if len(data) > max_operations:
+        raise OverflowError(max_operations)
+    return data
+
+
+@api_v1_bp.route('/knowledge/bulk', methods=['POST'])
+@require_login()
+def bulk_knowledge():
+    """ナレッジベースの一括作成・更新・削除
+    
+    操作は {"op": "create", "project_id", "title", "content", ...}、{"op": "update", "id", ...}、
+    {"op": "delete", "id"} の形。一部の操作が失敗しても他の操作は反映し、207で操作ごとの結果を返す。
+    """
+    try:
+        from flask_login import current_user
+        
+        max_operations = current_app.config['KNOWLEDGE_BULK_MAX_OPERATIONS']
+        try:
+            operations = _read_bulk_operations(max_operations)
+        except OverflowError:
+            return jsonify({'error': f'操作は{max_operations}件以下にしてください'}), 413
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        results = bulk_write_knowledge(operations, current_user.id)
+        failed = sum(1 for result in results if result['status'] == 'error')
+        return jsonify({
+            'results': results,
+            'succeeded': len(results) - failed,
+            'failed': failed
+        }), 207 if failed else 200
+    except Exception as e:
+        logger.error(f"ナレッジベース一括書き込みエラー: {str(e)}")
+        return jsonify({'error': 'ナレッジベースの一括書き込みに失敗しました'}), 500
+
+
 @api_v1_bp.route('/knowledge/<int:kb_id>', methods=['GET'])
 @require_login()
 def get_knowledge(kb_id):
@@ -91,10 +177,16 @@ def update_knowledge(kb_id):
     """ナレッジベース更新"""
     try:
         data = request.json
+        error = validate_tags(data.get('tags'))
+        if error:
+            return jsonify({'error': error}), 400
+        
         knowledge_base = update_knowledge_base(
             kb_id=kb_id,
-            name=data.get('name'),
-            description=data.get('description')
+            title=data.get('title'),
+            content=data.get('content'),
+            category=data.get('category'),
+            tags=data.get('tags')
         )
         
         if not knowledge_base:
@@ -124,19 +216,108 @@ def delete_knowledge(kb_id):
         return jsonify({'error': 'ナレッジベースの削除に失敗しました'}), 500
 
 
+def _parse_search_filters(data):
+    """検索の絞り込み条件を検証して (filters, エラーメッセージ) を返す
+
+    category・tagは文字列またはその配列、authorは作成者のユーザーIDまたはその配列、
+    created_from・created_toはISO 8601の日時（日付だけのcreated_toはその日の終わりまでを含む）。
+    """
+    raw = data.get('filters') or {}
+    if not isinstance(raw, dict):
+        return None, 'filtersはオブジェクトで指定してください'
+
+    filters = {}
+    for field, value_type, label in (('category', str, '文字列'), ('tag', str, '文字列'), ('author', int, '整数')):
+        values = raw.get(field)
+        if values is None:
+            continue
+        if not isinstance(values, list):
+            values = [values]
+        if not all(isinstance(value, value_type) and not isinstance(value, bool) for value in values):
+            return None, f'filters.{field}は{label}またはその配列で指定してください'
+        filters[field] = values
+
+    for field in ('created_from', 'created_to'):
+        value = raw.get(field)
+        if value is None:
+            continue
+        try:
+            parsed = datetime.fromisoformat(value)
+        except (TypeError, ValueError):
+            return None, f'filters.{field}はISO 8601形式の日時で指定してください'
+        if parsed.tzinfo is not None:
+            parsed = parsed.replace(tzinfo=None) - parsed.utcoffset()
+        if field == 'created_to' and len(value) == 10:
+            parsed += timedelta(days=1)
+        filters[field] = parsed
+    return filters, None
+
+
 @api_v1_bp.route('/knowledge/<int:kb_id>/search', methods=['POST'])
 @require_login()
 def search_knowledge(kb_id):
     """ナレッジベース検索"""
     try:
+        from flask_login import current_user
+        
         data = request.json
         query = data.get('query')
         
         if not query:
             return jsonify({'error': '検索クエリが必要です'}), 400
         
-        results = search_knowledge_base(kb_id, query)
-        return jsonify({'results': results})
+        limit = data.get('limit', current_app.config['SEARCH_DEFAULT_LIMIT'])
+        if not isinstance(limit, int) or isinstance(limit, bool) or limit < 1:
+            return jsonify({'error': 'limitは1以上の整数で指定してください'}), 400
+        limit = min(limit, current_app.config['SEARCH_MAX_LIMIT'])
+        
+        mode = data.get('mode', 'keyword')
+        if mode not in SEARCH_MODES:
+            return jsonify({'error': f"modeは {', '.join(SEARCH_MODES)} のいずれかを指定してください"}), 400
+        
+        depth = data.get('depth')
+        if depth is not None and (not isinstance(depth, int) or isinstance(depth, bool) or depth < 1):
+            return jsonify({'error': 'depthは1以上の整数で指定してください'}), 400
+        if depth is not None:
+            depth = min(depth, current_app.config['SEARCH_MAX_LIMIT'])
+        
+        fusion = data.get('fusion')
+        if fusion is not None and fusion not in FUSION_METHODS:
+            return jsonify({'error': f"fusionは {', '.join(FUSION_METHODS)} のいずれかを指定してください"}), 400
+        
+        fuzzy = data.get('fuzzy', current_app.config['SEARCH_FUZZY_ENABLED'])
+        if not isinstance(fuzzy, bool):
+            return jsonify({'error': 'fuzzyは真偽値で指定してください'}), 400
+        
+        filters, error = _parse_search_filters(data)
+        if error:
+            return jsonify({'error': error}), 400
+        
+        knowledge_base = get_knowledge_base(kb_id)
+        if not knowledge_base:
+            return jsonify({'error': 'ナレッジベースが見つかりません'}), 404
+        
+        if not ProjectService.check_user_permission(knowledge_base.project_id, current_user.id):
+            return jsonify({'error': 'このプロジェクトにアクセスする権限がありません'}), 403
+        
+        response = search_knowledge_base(
+            kb_id, query,
+            user_id=current_user.id,
+            limit=limit,
+            mode=mode,
+            depth=depth,
+            fusion=fusion,
+            fuzzy=fuzzy,
+            filters=filters
+        )
+        if response is None:
+            return jsonify({'error': 'ナレッジベースが見つかりません'}), 404
+        
+        return jsonify({
+            'results': response['results'],
+            'facets': response['facets'],
+            'did_you_mean': response['did_you_mean']
+        })
     except Exception as e:
         logger.error(f"ナレッジベース検索エラー: {str(e)}")
         return jsonify({'error': '検索に失敗しました'}), 500
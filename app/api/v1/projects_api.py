@@ -3,12 +3,14 @@
 プロジェクト API v1
 """
 
-from flask import request, jsonify
+from flask import Response, current_app, request, jsonify, stream_with_context
 from . import api_v1_bp
 from ...models import Project
 from ...projects.services import ProjectService
 from ...utils.decorators import require_project_permission, require_login
 from ...utils.logger import get_logger
+from ...utils.pagination import parse_page_args
+from ...utils.streaming import encode_chunks, gzip_chunks
 from app.models import db  # dbを明示的にインポート
 
 logger = get_logger(__name__)
@@ -20,9 +22,14 @@ def list_projects():
     """プロジェクト一覧取得"""
     try:
         from flask_login import current_user
-        projects = ProjectService.get_user_projects(current_user.id)
+        limit, cursor, error = parse_page_args(request.args)
+        if error:
+            return jsonify({'error': error}), 400
+        
+        projects, next_cursor = ProjectService.get_user_projects(current_user.id, limit, cursor)
         return jsonify({
-            'projects': projects  # すでに辞書形式で返されている
+            'projects': projects,  # すでに辞書形式で返されている
+            'next_cursor': next_cursor
         })
     except Exception as e:
         logger.error(f"プロジェクト一覧取得エラー: {str(e)}")
@@ -70,3 +77,109 @@ def get_project_detail(project_id):
     except Exception as e:
         logger.error(f"プロジェクト詳細取得エラー: {str(e)}")
         return jsonify({'error': 'プロジェクトの取得に失敗しました'}), 500
+
+
+@api_v1_bp.route('/projects/<int:project_id>/search/status', methods=['GET'])
+@require_project_permission('member')
+def get_search_status(project_id):
+    """検索インデックスの鮮度取得"""
+    try:
+        from ...search import get_search_engine, get_query_cache
+        from ...search.generations import read_generation
+        status = get_search_engine().status(project_id)
+        cache = get_query_cache()
+        status['cache'] = dict(cache.stats(), generation=read_generation(project_id)) if cache else None
+        return jsonify({'status': status})
+    except Exception as e:
+        logger.error(f"検索インデックス状態取得エラー: {str(e)}")
+        return jsonify({'error': '検索インデックスの状態取得に失敗しました'}), 500
+
+
+@api_v1_bp.route('/projects/<int:project_id>/suggest', methods=['GET'])
+@require_project_permission('member')
+def suggest(project_id):
+    """検索語の入力補完"""
+    try:
+        from ...search import get_suggest_index, sync_project_indexes
+        
+        prefix = request.args.get('q', '')
+        limit = request.args.get('limit', 10, type=int)
+        if limit < 1:
+            return jsonify({'error': 'limitは1以上の整数で指定してください'}), 400
+        
+        sync_project_indexes(project_id)
+        return jsonify({'suggestions': get_suggest_index().suggest(project_id, prefix, limit)})
+    except Exception as e:
+        logger.error(f"入力補完エラー: {str(e)}")
+        return jsonify({'error': '入力補完に失敗しました'}), 500
+
+
+@api_v1_bp.route('/projects/<int:project_id>/tags', methods=['GET'])
+@require_project_permission('member')
+def get_tag_cloud(project_id):
+    """タグクラウド取得（タグごとのナレッジ件数）"""
+    try:
+        from ...knowledge.services import get_project_tag_cloud
+        
+        limit = request.args.get('limit', 50, type=int)
+        if limit < 1:
+            return jsonify({'error': 'limitは1以上の整数で指定してください'}), 400
+        
+        return jsonify({'tags': get_project_tag_cloud(project_id, min(limit, 500))})
+    except Exception as e:
+        logger.error(f"タグクラウド取得エラー: {str(e)}")
+        return jsonify({'error': 'タグクラウドの取得に失敗しました'}), 500
+
+
+@api_v1_bp.route('/projects/<int:project_id>/export', methods=['GET'])
+@require_project_permission('member')
+def export_project(project_id):
+    """プロジェクトのナレッジをNDJSONまたはCSVでストリーミングしてエクスポート（gzip=trueで圧縮）"""
+    try:
+        from ...knowledge.services import EXPORT_FORMATS, export_project_knowledge
+        
+        fmt = request.args.get('format', 'ndjson')
+        if fmt not in EXPORT_FORMATS:
+            return jsonify({'error': f"formatは {', '.join(EXPORT_FORMATS)} のいずれかで指定してください"}), 400
+        if not db.session.get(Project, project_id):
+            return jsonify({'error': 'プロジェクトが見つかりません'}), 404
+        
+        filename = f'project-{project_id}.{fmt}'
+        mimetype = 'application/x-ndjson' if fmt == 'ndjson' else 'text/csv'
+        chunks = encode_chunks(export_project_knowledge(project_id, fmt))
+        if request.args.get('gzip', 'false').lower() in ('true', '1'):
+            chunks = gzip_chunks(chunks)
+            filename += '.gz'
+            mimetype = 'application/gzip'
+        
+        return Response(
+            stream_with_context(chunks),
+            mimetype=mimetype,
+            headers={'Content-Disposition': f'attachment; filename={filename}'}
+        )
+    except Exception as e:
+        logger.error(f"エクスポートエラー: {str(e)}")
+        return jsonify({'error': 'エクスポートに失敗しました'}), 500
+
+
+@api_v1_bp.route('/projects/<int:project_id>/context', methods=['POST'])
+@require_project_permission('member')
+def build_context(project_id):
+    """LLM向けコンテキスト取得（関連パッセージをトークン予算内に詰めて返す）"""
+    try:
+        from ...knowledge.services import build_project_context
+        
+        data = request.json or {}
+        query = data.get('query')
+        if not query:
+            return jsonify({'error': '検索クエリが必要です'}), 400
+        
+        token_budget = data.get('token_budget', current_app.config['SEARCH_CONTEXT_DEFAULT_TOKENS'])
+        if not isinstance(token_budget, int) or isinstance(token_budget, bool) or token_budget < 1:
+            return jsonify({'error': 'token_budgetは1以上の整数で指定してください'}), 400
+        token_budget = min(token_budget, current_app.config['SEARCH_CONTEXT_MAX_TOKENS'])
+        
+        return jsonify({'context': build_project_context(project_id, query, token_budget)})
+    except Exception as e:
+        logger.error(f"コンテキスト構築エラー: {str(e)}")
+        return jsonify({'error': 'コンテキストの構築に失敗しました'}), 500
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+"""
+プロジェクト横断検索 API v1
+"""
+
+from flask import request, jsonify, current_app
+from flask_login import current_user
+from . import api_v1_bp
+from ...knowledge.services import search_accessible_knowledge
+from ...utils.decorators import require_login
+from ...utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+@api_v1_bp.route('/search', methods=['POST'])
+@require_login()
+def search_all_projects():
+    """参加している全プロジェクトを横断してナレッジを検索"""
+    try:
+        data = request.json or {}
+        query = data.get('query')
+        if not query:
+            return jsonify({'error': '検索クエリが必要です'}), 400
+        
+        limit = data.get('limit', current_app.config['SEARCH_DEFAULT_LIMIT'])
+        if not isinstance(limit, int) or isinstance(limit, bool) or limit < 1:
+            return jsonify({'error': 'limitは1以上の整数で指定してください'}), 400
+        limit = min(limit, current_app.config['SEARCH_MAX_LIMIT'])
+        
+        project_ids = data.get('project_ids')
+        if project_ids is not None and (
+            not isinstance(project_ids, list)
+            or not all(isinstance(project_id, int) and not isinstance(project_id, bool) for project_id in project_ids)
+        ):
+            return jsonify({'error': 'project_idsは整数の配列で指定してください'}), 400
+        
+        results = search_accessible_knowledge(current_user.id, query, limit, project_ids)
+        return jsonify({'results': results})
+    except Exception as e:
+        logger.error(f"横断検索エラー: {str(e)}")
+        return jsonify({'error': '検索に失敗しました'}), 500
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""
+パスワードのハッシュ化サービス
+bcryptの計算をリクエストスレッドではなく上限付きのスレッドプールで行い、待ちが溢れたら受け付けずに断る
+"""
+
+import math
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+import bcrypt
+
+from ..utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+# 自動調整するコストの範囲（bcryptの仕様上の下限は4）
+MIN_COST = 10
+MAX_COST = 16
+
+
+class PasswordHasherBusy(Exception):
+    """ハッシュ計算の待ちが上限に達した（503で Retry-After 秒後の再試行を促す）"""
+
+    def __init__(self, retry_after):
+        super().__init__('パスワード処理が混み合っています')
+        self.retry_after = retry_after
+
+
+def hash_cost(hashed):
+    """bcryptのハッシュ文字列（$2b$12$...）からコストを取り出す（読めなければNone）"""
+    try:
+        return int(hashed.split('$')[2])
+    except (AttributeError, IndexError, ValueError):
+        return None
+
+
+def calibrate_cost(target_ms, min_cost=MIN_COST, max_cost=MAX_COST):
+    """1回のハッシュ計算がtarget_ms程度になるコストを求める
+
+    コストが1増えると計算時間は倍になるため、min_costで1回測って必要な倍数から決める。
+    """
+    started = time.perf_counter()
+    bcrypt.hashpw(b'calibration', bcrypt.gensalt(min_cost))
+    elapsed_ms = max((time.perf_counter() - started) * 1000, 0.001)
+    if elapsed_ms >= target_ms:
+        return min_cost
+    return min(max_cost, min_cost + int(math.log2(target_ms / elapsed_ms)))
+
+
+def load_or_calibrate_cost(path, target_ms):
+    """ファイルに保存したコストを読む（なければ1回だけ調整して保存する）
+
+    同じホストのワーカー・CGIプロセスが同じコストを使うよう、最初に保存された値を全員が使う。
+    書き込みは一時ファイルのハードリンクで行い、同時に調整したプロセスがあっても先に置かれた値に揃える。
+    """
+    try:
+        with open(path, encoding='utf-8') as f:
+            return int(f.read())
+    except (OSError, ValueError):
+        pass
+
+    cost = calibrate_cost(target_ms)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f'{path}.{os.getpid()}.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        f.write(str(cost))
+    try:
+        os.link(temp_path, path)
+        logger.info(f"bcryptのコストを{cost}に調整して保存しました: {path}")
+    except FileExistsError:
+        with open(path, encoding='utf-8') as f:
+            cost = int(f.read())
+    finally:
+        os.remove(temp_path)
+    return cost
+
+
+class PasswordHasher:
+    """bcryptのハッシュ化と検証をスレッドプールで行う
+
+    bcryptは計算中にGILを解放するため、スレッドでもCPUコア数まで並列に計算できる。
+    実行中と待ちの合計がworkers + max_pendingを超える呼び出しは、積み上げずに
+    PasswordHasherBusy で即座に断る。
+    costがNoneの場合は初めてハッシュ化する時に cost_file から読む（なければ調整して保存）。
+    """
+
+    def __init__(self, cost=12, workers=4, max_pending=64, retry_after=1, cost_file=None, target_ms=250):
+        self._cost = cost
+        self._cost_file = cost_file
+        self._target_ms = target_ms
+        self._cost_lock = threading.Lock()
+        self.retry_after = retry_after
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password-hasher')
+        self._slots = threading.BoundedSemaphore(workers + max_pending)
+
+    @property
+    def cost(self):
+        """新しく作るハッシュのコスト"""
+        if self._cost is None:
+            with self._cost_lock:
+                if self._cost is None:
+                    self._cost = load_or_calibrate_cost(self._cost_file, self._target_ms)
+        return self._cost
+
+    def _run(self, func, *args):
+        if not self._slots.acquire(blocking=False):
+            raise PasswordHasherBusy(self.retry_after)
+        try:
+            future = self._executor.submit(func, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future.result()
+
+    def hash(self, password):
+        """パスワードを現在のコストでハッシュ化"""
+        salt = bcrypt.gensalt(self.cost)
+        return self._run(bcrypt.hashpw, password.encode('utf-8'), salt).decode('utf-8')
+
+    def verify(self, password, hashed):
+        """パスワードがハッシュと一致するか検証"""
+        return self._run(bcrypt.checkpw, password.encode('utf-8'), hashed.encode('utf-8'))
+
+    def needs_rehash(self, hashed):
+        """保存されたハッシュのコストが現在のコストより低いか（高いハッシュは下げない）"""
+        cost = hash_cost(hashed)
+        return cost is not None and cost < self.cost
+
+
+def init_password_hasher(app):
+    """パスワードのハッシュ化サービスを初期化
+
+    コスト未指定の場合も起動時には調整せず、初めてハッシュ化する時にインスタンスディレクトリの
+    保存値を使う（create_app() やimportだけでbcryptを計算しない）。
+    """
+    hasher = PasswordHasher(
+        cost=app.config.get('PASSWORD_HASH_COST'),
+        workers=app.config.get('PASSWORD_HASH_WORKERS') or os.cpu_count() or 1,
+        max_pending=app.config.get('PASSWORD_HASH_MAX_PENDING', 64),
+        retry_after=app.config.get('PASSWORD_HASH_RETRY_AFTER', 1),
+        cost_file=os.path.join(app.instance_path, 'password_hash_cost'),
+        target_ms=app.config.get('PASSWORD_HASH_TARGET_MS', 250)
+    )
+    app.extensions['password_hasher'] = hasher
+    return hasher
+
+
+def get_password_hasher():
+    """現在のアプリケーションのパスワードハッシュ化サービスを取得"""
+    return current_app.extensions['password_hasher']
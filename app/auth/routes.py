@@ -188,10 +188,11 @@ def resend_verification():
     if current_user.email_verified:
         return jsonify({'error': 'メールアドレスは既に認証済みです'}), 400
     
-    token = AuthService.generate_email_verification_token(current_user.email)
-    current_user.email_verification_token = token
+    user = current_user.load()
+    token = AuthService.generate_email_verification_token(user.email)
+    user.email_verification_token = token
     db.session.commit()
     
-    AuthService.send_verification_email(current_user, token)
+    AuthService.send_verification_email(user, token)
     
     return jsonify({'message': '認証メールを再送信しました'}), 200
@@ -14,6 +14,10 @@ from flask_mail import Message
 from itsdangerous import URLSafeTimedSerializer, SignatureExpired, BadSignature
 from ..models import db, User, ProjectInvitation
 from ..email.services import mail
+from ..utils.logger import get_logger
+from .passwords import PasswordHasherBusy, get_password_hasher
+
+logger = get_logger(__name__)
 
 class AuthService:
     """認証サービスクラス"""
@@ -132,6 +136,14 @@ class AuthService:
         if not user.is_active:
             return None, "アカウントが無効化されています"
         
+        # コストが変わった古いハッシュはログイン成功時に平文から作り直す
+        if get_password_hasher().needs_rehash(user.password_hash):
+            try:
+                user.set_password(password)
+                db.session.commit()
+            except PasswordHasherBusy:
+                logger.info(f"混雑のためパスワードの再ハッシュを見送りました: user_id={user.id}")
+        
         return user, None
     
     @staticmethod
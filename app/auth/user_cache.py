@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+"""
+ログインユーザーのキャッシュ
+Flask-Loginのuser_loaderが毎リクエストusersテーブルを引かないよう、ユーザーの不変なスナップショットを保持する
+"""
+
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from flask import current_app, has_app_context
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+
+from ..models import db, User
+
+# コミット待ちの変更されたユーザーIDを置くsession.infoのキー
+_PENDING_KEY = 'changed_user_ids'
+
+
+class UserSnapshot(namedtuple('UserSnapshot', [
+    'id', 'username', 'email', 'email_verified', 'is_active', 'created_at', 'updated_at', 'version'
+])):
+    """current_userとして使うユーザーの不変なスナップショット
+
+    Flask-Loginのユーザーとして振る舞い、to_dict()はUser.to_dict()と同じ形を返す。
+    ユーザーを変更する場合は load() でDBの行を取得して使う。
+    """
+    __slots__ = ()
+
+    @classmethod
+    def from_user(cls, user, version=0):
+        return cls(
+            id=user.id,
+            username=user.username,
+            email=user.email,
+            email_verified=bool(user.email_verified),
+            is_active=user.is_active is not False,
+            created_at=user.created_at,
+            updated_at=user.updated_at,
+            version=version
+        )
+
+    @property
+    def is_authenticated(self):
+        return True
+
+    @property
+    def is_anonymous(self):
+        return False
+
+    def get_id(self):
+        return str(self.id)
+
+    def load(self):
+        """DB上のユーザーの行を取得"""
+        return db.session.get(User, self.id)
+
+    def to_dict(self):
+        """辞書形式で返す"""
+        return {
+            'id': self.id,
+            'username': self.username,
+            'email': self.email,
+            'email_verified': self.email_verified,
+            'is_active': self.is_active,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+        }
+
+
+class UserCache:
+    """ユーザーIDをキーにスナップショットを保持するLRU
+
+    usersの行が更新・削除されるとコミット時にそのユーザーのエントリを無効化する。
+    無効化のたびにバージョンを進め、読み込み中に無効化があったスナップショットは保存しない。
+    キャッシュはプロセスごとのため、他のワーカーでの変更は最大でTTL秒遅れて反映される。
+    """
+
+    def __init__(self, max_entries=10000, ttl=60):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()  # ユーザーID -> (期限, スナップショット)
+        self._version = 0
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        """ユーザーのスナップショットを返す（キャッシュになければDBから読む。存在しなければNone）"""
+        snapshot = self._cached(user_id)
+        if snapshot is not None:
+            return snapshot
+
+        version = self._version
+        user = db.session.get(User, user_id)
+        if user is None:
+            return None
+        snapshot = UserSnapshot.from_user(user, version)
+        self._store(snapshot)
+        return snapshot
+
+    def _cached(self, user_id):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            expires_at, snapshot = entry
+            if expires_at <= time.monotonic():
+                del self._entries[user_id]
+                return None
+            self._entries.move_to_end(user_id)
+            return snapshot
+
+    def _store(self, snapshot):
+        with self._lock:
+            if snapshot.version != self._version or self.ttl <= 0:
+                return
+            self._entries[snapshot.id] = (time.monotonic() + self.ttl, snapshot)
+            self._entries.move_to_end(snapshot.id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        """ユーザーのエントリを無効化"""
+        with self._lock:
+            self._version += 1
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        """すべてのエントリを破棄"""
+        with self._lock:
+            self._version += 1
+            self._entries.clear()
+
+
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def _record_user_change(mapper, connection, target):
+    """パスワード変更・メール認証・無効化などでusersの行が変わったユーザーを記録"""
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault(_PENDING_KEY, set()).add(target.id)
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_changed_users(session):
+    user_ids = session.info.pop(_PENDING_KEY, None)
+    if not user_ids or not has_app_context():
+        return
+    cache = current_app.extensions.get('user_cache')
+    if cache is not None:
+        for user_id in user_ids:
+            cache.invalidate(user_id)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_changed_users(session):
+    session.info.pop(_PENDING_KEY, None)
+
+
+def init_user_cache(app):
+    """ログインユーザーのキャッシュを初期化"""
+    cache = UserCache(
+        max_entries=app.config.get('USER_CACHE_MAX_ENTRIES', 10000),
+        ttl=app.config.get('USER_CACHE_TTL', 60)
+    )
+    app.extensions['user_cache'] = cache
+    return cache
+
+
+def get_user_cache():
+    """現在のアプリケーションのユーザーキャッシュを取得"""
+    return current_app.extensions['user_cache']
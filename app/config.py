@@ -12,6 +12,99 @@ class Config:
         if os.path.exists('.env'):
             load_dotenv('.env')
     
+    # 検索設定
+    SEARCH_BACKEND = os.environ.get('SEARCH_BACKEND') or 'index'  # index, fulltext
+    SEARCH_FULLTEXT_MAX_MATCHES = 10000  # fulltextで絞り込み・ファセットの件数に使う一致行の上限
+    SEARCH_BM25_K1 = 1.2
+    SEARCH_BM25_B = 0.75
+    SEARCH_BUILD_BATCH_SIZE = 1000
+    SEARCH_TOKENIZER = os.environ.get('SEARCH_TOKENIZER') or 'ngram'  # ngram, morph, auto, word
+    SEARCH_NGRAM_SIZES = (2, 3)
+    SEARCH_COMPACTION_RATIO = 0.2
+    SEARCH_COMPACTION_MIN_TOMBSTONES = 100
+    # 指定するとインデックスをディスクセグメントとして永続化（未指定ならメモリのみ）
+    # メモリのみの索引は他のワーカーの書き込みを検出するたびにDBから構築し直すため、
+    # 書き込みの多い複数ワーカー構成では指定する（同じファイルシステムを共有するワーカー間で追従する）
+    SEARCH_INDEX_DIR = os.environ.get('SEARCH_INDEX_DIR')
+    SEARCH_FLUSH_THRESHOLD = 1
+    SEARCH_MERGE_FACTOR = 8
+    # ベクトル検索（'hashing' 以外は sentence-transformers のローカルモデル名）
+    SEARCH_VECTOR_ENCODER = os.environ.get('SEARCH_VECTOR_ENCODER') or 'hashing'
+    SEARCH_VECTOR_DIM = 256
+    SEARCH_VECTOR_QUANTIZE = False  # Trueでint8量子化
+    SEARCH_VECTOR_NPROBE = 8
+    SEARCH_VECTOR_MIN_TRAIN_SIZE = 1024
+    SEARCH_VECTOR_BATCH_SIZE = 256
+    # チャンク分割とパッセージ検索
+    SEARCH_CHUNK_MAX_TOKENS = 256
+    SEARCH_CHUNK_OVERLAP_TOKENS = 32
+    SEARCH_PASSAGE_DEPTH = 100  # 文書にまとめる前に取得するチャンク数
+    SEARCH_PASSAGES_PER_RESULT = 3
+    SEARCH_SNIPPET_LENGTH = 160  # スニペットの文字数
+    SEARCH_HIGHLIGHT_MAX = 10  # 1件あたりのハイライト数の上限
+    # 検索結果キャッシュ（memory: プロセス内, sqlite: 同一ホストのワーカー間で共有, none: 無効）
+    # どちらもキーにDB上の索引の世代番号を含めるため、他のワーカーの書き込みで即座に無効になる
+    SEARCH_CACHE_BACKEND = os.environ.get('SEARCH_CACHE_BACKEND', 'memory')
+    SEARCH_CACHE_PATH = os.environ.get('SEARCH_CACHE_PATH')
+    SEARCH_CACHE_MAX_ENTRIES = 1024
+    SEARCH_CACHE_TTL = 300  # 秒
+    # 入力補完（タイトル・タグ・結果のあった検索クエリの件数に掛ける係数）
+    SEARCH_SUGGEST_TOP_K = 10
+    SEARCH_SUGGEST_QUERY_DAYS = 90
+    SEARCH_SUGGEST_MAX_QUERIES = 1000
+    SEARCH_SUGGEST_WEIGHTS = {'title': 1.0, 'tag': 1.0, 'query': 1.0}
+    # あいまい検索（語彙辞書にない語を編集距離の近い語に展開）
+    SEARCH_FUZZY_ENABLED = True
+    SEARCH_FUZZY_MAX_DISTANCE = 2
+    SEARCH_FUZZY_PREFIX_LENGTH = 7
+    SEARCH_FUZZY_MAX_EXPANSIONS = 3  # 1語あたりの展開数の上限
+    SEARCH_FUZZY_PENALTY = 0.5  # 展開語の重み（編集距離ごとに掛ける）
+    # ファセット（絞り込みと件数）
+    SEARCH_FACET_SIZE = 10  # フィールドごとに返す値の数
+    # LLM向けコンテキスト構築
+    SEARCH_CONTEXT_DEPTH = 50
+    SEARCH_CONTEXT_DEFAULT_TOKENS = 2000
+    SEARCH_CONTEXT_MAX_TOKENS = 16000
+    # ハイブリッド検索（rrf: Reciprocal Rank Fusion, weighted: 正規化スコアの重み付き和）
+    SEARCH_HYBRID_FUSION = 'rrf'
+    SEARCH_HYBRID_RRF_K = 60
+    SEARCH_HYBRID_DEPTH = 50  # リトリーバごとの候補数
+    SEARCH_HYBRID_WEIGHTS = {'keyword': 1.0, 'semantic': 1.0}
+    SEARCH_HYBRID_WORKERS = 4
+    SEARCH_DEFAULT_LIMIT = 10
+    SEARCH_MAX_LIMIT = 100
+    
+    # プロジェクトのメンバーシップキャッシュ（他のワーカーでの変更はTTL秒まで遅れて反映）
+    MEMBERSHIP_CACHE_TTL = 30
+    MEMBERSHIP_CACHE_MAX_USERS = 10000
+    
+    # ログインユーザーのキャッシュ（他のワーカーでの変更はTTL秒まで遅れて反映）
+    USER_CACHE_TTL = 60
+    USER_CACHE_MAX_ENTRIES = 10000
+    
+    # パスワードのハッシュ化（bcrypt）
+    # Noneなら1回あたりTARGET_MS程度になるよう1度だけ調整し、instance/password_hash_cost に保存して全プロセスで使う
+    # （性能の違う複数ホストで動かす場合は環境変数で固定する）
+    PASSWORD_HASH_COST = int(os.environ['PASSWORD_HASH_COST']) if os.environ.get('PASSWORD_HASH_COST') else None
+    PASSWORD_HASH_TARGET_MS = 250
+    PASSWORD_HASH_WORKERS = None  # 既定はCPU数
+    PASSWORD_HASH_MAX_PENDING = 64  # 実行中以外に待たせる数（超えたら503）
+    PASSWORD_HASH_RETRY_AFTER = 1  # 503で返すRetry-After秒
+    
+    # 一覧APIのページネーション（カーソル方式）
+    PAGINATION_DEFAULT_LIMIT = 50
+    PAGINATION_MAX_LIMIT = 200
+    
+    # ナレッジの一括書き込みAPI
+    KNOWLEDGE_BULK_MAX_OPERATIONS = 10000  # 1リクエストあたりの操作数の上限
+    KNOWLEDGE_BULK_CHUNK_SIZE = 500  # 1トランザクションで書き込む操作数
+    # flask knowledge import（ワーカー数の既定はCPU数）
+    KNOWLEDGE_IMPORT_WORKERS = None
+    KNOWLEDGE_IMPORT_BATCH_SIZE = 500
+    
+    # プロジェクトのエクスポート（サーバーサイドカーソルで1回に読む行数）
+    EXPORT_BATCH_SIZE = 500
+    
     @staticmethod
     def init_app(app):
         pass
@@ -88,6 +181,9 @@ class TestingConfig(Config):
     # メール送信を無効化
     MAIL_SUPPRESS_SEND = True
     MAIL_DEFAULT_SENDER = 'test@example.com'
+    
+    # テストを速くするためbcryptは最小コスト
+    PASSWORD_HASH_COST = 4
 
 # 環境設定の辞書
 config = {
@@ -15,9 +15,13 @@ oauth = OAuth()
 
 def init_extensions(app):
     """Flask拡張機能を初期化"""
-    from app.models import db, User
+    from app.models import db
     from app.email import init_mail
     from app.inertia_config import init_inertia
+    from app.projects.membership import init_membership_cache
+    from app.auth.user_cache import init_user_cache, get_user_cache
+    from app.auth.passwords import init_password_hasher
+    from app.search import init_search, init_vector_search, init_chunk_search, init_hybrid_search, init_query_cache, init_suggest, init_fuzzy, init_facets, init_cross_project_search, init_index_generations
     
     # データベース初期化
     db.init_app(app)
@@ -33,14 +37,35 @@ def init_extensions(app):
     login_manager.login_view = 'auth.login'
     login_manager.login_message = 'ログインが必要です'
     
+    # ログインユーザーのキャッシュ初期化
+    init_user_cache(app)
+    
+    # パスワードのハッシュ化サービス初期化
+    init_password_hasher(app)
+    
     @login_manager.user_loader
     def load_user(user_id):
-        from app.models import db
-        return db.session.get(User, int(user_id))
+        # usersの行ではなくキャッシュしたスナップショットを返す（変更時はsnapshot.load()で行を取得）
+        return get_user_cache().get(int(user_id))
     
     # メールサービス初期化
     init_mail(app)
     
+    # プロジェクトのメンバーシップキャッシュ初期化
+    init_membership_cache(app)
+    
+    # 検索エンジン初期化
+    init_search(app)
+    init_vector_search(app)
+    init_chunk_search(app)
+    init_cross_project_search(app)
+    init_hybrid_search(app)
+    init_query_cache(app)
+    init_suggest(app)
+    init_fuzzy(app)
+    init_facets(app)
+    init_index_generations(app)
+    
     # OAuth初期化
     oauth.init_app(app)
     
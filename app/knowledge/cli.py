@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+"""
+ナレッジ関連のCLIコマンド（flask knowledge ...）
+"""
+
+import click
+from flask.cli import AppGroup
+
+from ..models import db, Project, User
+
+knowledge_cli = AppGroup('knowledge', help='ナレッジの管理コマンド')
+
+
+@knowledge_cli.command('import')
+@click.argument('directory', type=click.Path(exists=True, file_okay=False))
+@click.option('--project-id', type=int, required=True, help='取り込み先のプロジェクトID')
+@click.option('--user-id', type=int, required=True, help='作成者として記録するユーザーID')
+@click.option('--workers', type=int, default=None, help='解析に使うプロセス数（既定: CPU数）')
+@click.option('--batch-size', type=int, default=None, help='1トランザクションで挿入する件数')
+@click.option('--checkpoint', type=click.Path(dir_okay=False), default=None,
+              help='取り込み済みファイルの記録先（既定: .knowledge-import-<project_id>.json）')
+@click.option('--no-resume', is_flag=True, help='チェックポイントを無視して最初から取り込む')
+def import_command(directory, project_id, user_id, workers, batch_size, checkpoint, no_resume):
+    """DIRECTORY以下のMarkdown・JSONファイルをナレッジとして一括で取り込む"""
+    from .importer import import_directory
+    
+    if not db.session.get(Project, project_id):
+        raise click.ClickException(f'プロジェクトが見つかりません: {project_id}')
+    if not db.session.get(User, user_id):
+        raise click.ClickException(f'ユーザーが見つかりません: {user_id}')
+    
+    def progress(stats):
+        click.echo(f"  {stats['imported']}件取り込み済み（{stats['docs_per_second']:.1f} docs/s）")
+    
+    stats = import_directory(
+        directory, project_id, user_id,
+        workers=workers,
+        batch_size=batch_size,
+        checkpoint=checkpoint or f'.knowledge-import-{project_id}.json',
+        resume=not no_resume,
+        progress=progress
+    )
+    
+    if stats['resumed']:
+        click.echo(f"チェックポイントから再開: {stats['resumed']}ファイルをスキップ")
+    for relpath, error in stats['errors']:
+        click.echo(f'エラー: {relpath}: {error}', err=True)
+    click.echo(
+        f"完了: {stats['imported']}件を取り込み（重複 {stats['duplicates']}件, エラー {len(stats['errors'])}件, "
+        f"{stats['elapsed']:.1f}秒, {stats['docs_per_second']:.1f} docs/s）"
+    )
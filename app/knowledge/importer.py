@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+"""
+ディレクトリからのナレッジ一括インポート
+Markdown・JSONのファイルをワーカープロセスで解析・チャンク分割し、一括挿入の経路でバッチごとに書き込む
+"""
+
+import json
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from flask import current_app
+from sqlalchemy.exc import SQLAlchemyError
+
+from ..models import db
+from ..models.knowledge import KnowledgeBase
+from ..search import rebuild_project_indexes
+from ..utils.logger import get_logger
+from .services import insert_knowledge_rows, split_chunk_rows, summary_values
+
+logger = get_logger(__name__)
+
+# インポート対象の拡張子（.jsonl / .ndjson は1行1件）
+MARKDOWN_EXTENSIONS = ('.md', '.markdown')
+JSON_EXTENSIONS = ('.json', '.jsonl', '.ndjson')
+
+_MARKDOWN_TITLE = re.compile(r'^#[ \t]+(.+?)[ \t#]*$', re.MULTILINE)
+
+
+def iter_import_files(root):
+    """root以下のインポート対象ファイルをrootからの相対パスで名前順に返す"""
+    paths = []
+    for directory, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            if filename.lower().endswith(MARKDOWN_EXTENSIONS + JSON_EXTENSIONS):
+                paths.append(os.path.relpath(os.path.join(directory, filename), root))
+    return paths
+
+
+def _document(record, default_title):
+    """ファイルの1件分を検証し、列の値の辞書にする"""
+    if not isinstance(record, dict):
+        raise ValueError('1件はオブジェクトで指定してください')
+    title = record.get('title') or default_title
+    content = record.get('content') or ''
+    if not isinstance(title, str) or not isinstance(content, str):
+        raise ValueError('titleとcontentは文字列で指定してください')
+    category = record.get('category')
+    tags = record.get('tags')
+    return {
+        'title': title.strip()[:200],
+        'content': content,
+        'category': category[:50] if isinstance(category, str) else None,
+        'tags': tags if isinstance(tags, list) else None
+    }
+
+
+def parse_file(root, relpath, max_tokens=256, overlap_tokens=32):
+    """ファイルを読み、(相対パス, [(列の値, チャンク)], エラーメッセージ) を返す
+    
+    Markdownは最初の # 見出し（なければファイル名）をタイトルにする。
+    JSONはオブジェクトかその配列、.jsonl / .ndjson は1行1オブジェクト。
+    ワーカープロセスで実行するため、アプリケーションコンテキストやDBは使わない。
+    """
+    stem = os.path.splitext(os.path.basename(relpath))[0]
+    try:
+        with open(os.path.join(root, relpath), encoding='utf-8') as f:
+            text = f.read()
+        
+        extension = os.path.splitext(relpath)[1].lower()
+        if extension in MARKDOWN_EXTENSIONS:
+            heading = _MARKDOWN_TITLE.search(text)
+            records = [{'title': heading.group(1) if heading else stem, 'content': text}]
+        elif extension == '.json':
+            data = json.loads(text)
+            records = data if isinstance(data, list) else [data]
+        else:
+            records = [json.loads(line) for line in text.splitlines() if line.strip()]
+        
+        documents = []
+        for record in records:
+            values = summary_values(_document(record, stem))
+            documents.append((values, split_chunk_rows(values['content'], max_tokens, overlap_tokens)))
+        return relpath, documents, None
+    except (OSError, ValueError) as e:
+        return relpath, [], str(e)
+
+
+def _load_checkpoint(path):
+    if not path or not os.path.exists(path):
+        return set()
+    with open(path, encoding='utf-8') as f:
+        return set(json.load(f).get('files', []))
+
+
+def _save_checkpoint(path, files):
+    """取り込み済みファイルの一覧を書き出す（途中で中断しても壊れないよう置き換えで書く）"""
+    temporary = f'{path}.tmp'
+    with open(temporary, 'w', encoding='utf-8') as f:
+        json.dump({'files': sorted(files)}, f, ensure_ascii=False)
+    os.replace(temporary, path)
+
+
+def import_directory(root, project_id, user_id, workers=None, batch_size=None, checkpoint=None,
+                     resume=True, progress=None):
+    """root以下のファイルをプロジェクトに取り込み、集計を辞書で返す
+    
+    ファイルの解析とチャンク分割はworkers個のプロセスで並列に行い、本文のハッシュで
+    既存のナレッジやファイル間の重複を除いてから、batch_size件ずつ1トランザクションで挿入する。
+    コミットのたびにcheckpointへ取り込み済みのファイルを記録し、resumeなら次回はそれを飛ばす。
+    検索索引は毎行ではなく最後に1回だけ構築し直す。progressはバッチごとに集計を受け取る。
+    """
+    workers = workers or current_app.config['KNOWLEDGE_IMPORT_WORKERS'] or os.cpu_count() or 1
+    batch_size = batch_size or current_app.config['KNOWLEDGE_IMPORT_BATCH_SIZE']
+    max_tokens = current_app.config['SEARCH_CHUNK_MAX_TOKENS']
+    overlap_tokens = current_app.config['SEARCH_CHUNK_OVERLAP_TOKENS']
+    
+    # チェックポイントが取り込むディレクトリの中にあっても取り込まない
+    files = [
+        path for path in iter_import_files(root)
+        if not checkpoint or os.path.abspath(os.path.join(root, path)) != os.path.abspath(checkpoint)
+    ]
+    done = _load_checkpoint(checkpoint) if resume else set()
+    pending = [path for path in files if path not in done]
+    seen = {
+        digest for digest, in db.session.query(KnowledgeBase.content_hash).filter(
+            KnowledgeBase.project_id == project_id,
+            KnowledgeBase.content_hash.isnot(None)
+        )
+    }
+    stats = {
+        'files': len(files),
+        'resumed': len(files) - len(pending),
+        'imported': 0,
+        'duplicates': 0,
+        'errors': [],
+        'elapsed': 0.0,
+        'docs_per_second': 0.0
+    }
+    started = time.monotonic()
+    rows, chunks, batch_files = [], [], []
+    
+    def flush():
+        if rows:
+            try:
+                insert_knowledge_rows(rows, chunks)
+                db.session.commit()
+            except SQLAlchemyError:
+                db.session.rollback()
+                raise
+            stats['imported'] += len(rows)
+        done.update(batch_files)
+        if checkpoint and batch_files:
+            _save_checkpoint(checkpoint, done)
+        rows.clear()
+        chunks.clear()
+        batch_files.clear()
+        stats['elapsed'] = time.monotonic() - started
+        stats['docs_per_second'] = stats['imported'] / stats['elapsed'] if stats['elapsed'] else 0.0
+        if progress:
+            progress(stats)
+    
+    executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 and len(pending) > 1 else None
+    parsed = None
+    try:
+        arguments = (repeat(root), pending, repeat(max_tokens), repeat(overlap_tokens))
+        if executor:
+            parsed = executor.map(parse_file, *arguments, chunksize=max(1, min(64, len(pending) // (workers * 4))))
+        else:
+            parsed = map(parse_file, *arguments)
+        
+        for relpath, documents, error in parsed:
+            if error:
+                stats['errors'].append((relpath, error))
+                continue
+            for values, document_chunks in documents:
+                if values['content_hash'] in seen:
+                    stats['duplicates'] += 1
+                    continue
+                seen.add(values['content_hash'])
+                rows.append(dict(values, project_id=project_id, created_by_id=user_id))
+                chunks.append(document_chunks)
+            # 1ファイル分の文書は同じバッチに入れ、チェックポイントをファイル単位に保つ
+            batch_files.append(relpath)
+            if len(rows) >= batch_size:
+                flush()
+        flush()
+    finally:
+        if executor:
+            # shutdown(cancel_futures=True) はPython 3.9以降のため、mapの結果を閉じて未着手の解析を取り消す
+            if parsed is not None:
+                parsed.close()
+            executor.shutdown()
+    
+    if stats['imported']:
+        rebuild_project_indexes(project_id)
+    if checkpoint and os.path.exists(checkpoint):
+        os.remove(checkpoint)
+    logger.info(
+        f"ナレッジインポート: プロジェクト {project_id} ({stats['imported']}件, 重複 {stats['duplicates']}件, "
+        f"エラー {len(stats['errors'])}件, {stats['docs_per_second']:.1f} docs/s)"
+    )
+    return stats
@@ -3,16 +3,50 @@
 ナレッジベースサービス
 """
 
-from sqlalchemy.exc import SQLAlchemyError
+import csv
+import io
+import json
+from flask import current_app
+from sqlalchemy import delete, func, insert, tuple_, update
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
 from ..models import db
-from ..models.knowledge import KnowledgeBase
+from ..models.knowledge import KNOWLEDGE_SUMMARY_FIELDS, KnowledgeBase, KnowledgeChunk, make_excerpt
 from ..models.search_log import SearchLog
+from ..models.tag import Tag, KnowledgeTag
+from ..models.user import User
+from ..search import (
+    get_search_backend,
+    get_vector_search,
+    get_chunk_search,
+    get_cross_project_search,
+    get_hybrid_search,
+    get_query_cache,
+    get_suggest_index,
+    get_fuzzy_index,
+    get_facet_index,
+    make_cache_key,
+    chunk_text,
+    content_hash,
+    count_tokens,
+    split_chunk_key,
+    highlight_terms,
+    find_matches,
+    build_snippet,
+    index_knowledge,
+    unindex_knowledge,
+    index_knowledge_batch,
+    unindex_knowledge_batch,
+    sync_project_indexes,
+    sync_cross_project_index
+)
 from ..utils.logger import get_logger
+from ..utils.pagination import keyset_paginate
+from ..utils.validators import validate_tags
 
 logger = get_logger(__name__)
 
 
-def create_knowledge_base(title, content, project_id, category=None, created_by_id=None):
+def create_knowledge_base(title, content, project_id, category=None, created_by_id=None, tags=None):
     """ナレッジベースを作成"""
     try:
         knowledge_base = KnowledgeBase(
@@ -20,10 +54,14 @@ def create_knowledge_base(title, content, project_id, category=None, created_by_
             content=content,
             project_id=project_id,
             category=category,
+            tags=tags,
             created_by_id=created_by_id
         )
         db.session.add(knowledge_base)
+        sync_chunks(knowledge_base)
+        sync_tags(knowledge_base)
         db.session.commit()
+        index_knowledge(knowledge_base)
         logger.info(f"ナレッジベース作成: {title} (ID: {knowledge_base.id})")
         return knowledge_base
     except SQLAlchemyError as e:
@@ -37,12 +75,43 @@ def get_knowledge_base(kb_id):
     return db.session.get(KnowledgeBase, kb_id)
 
 
-def get_project_knowledge_bases(project_id):
-    """プロジェクトのナレッジベース一覧を取得"""
-    return KnowledgeBase.query.filter_by(project_id=project_id).all()
+def get_project_knowledge_bases(project_id, tag=None, limit=None, cursor=None, fields=KNOWLEDGE_SUMMARY_FIELDS):
+    """プロジェクトのナレッジベース一覧を新しい順に1ページ分取得
+    
+    tagを指定するとそのタグの付いたものだけ。fieldsはto_dict()で使うフィールドで、
+    本文を含まない場合は本文の列を読まない。(ナレッジのリスト, 次ページのカーソル) を返す。
+    """
+    query = KnowledgeBase.query.options(*KnowledgeBase.list_options(fields)).filter_by(project_id=project_id)
+    if tag:
+        # knowledge_tags の (project_id, tag_id) 索引で引く
+        query = query.join(
+            KnowledgeTag, KnowledgeTag.knowledge_base_id == KnowledgeBase.id
+        ).join(
+            Tag, Tag.id == KnowledgeTag.tag_id
+        ).filter(
+            KnowledgeTag.project_id == project_id,
+            Tag.project_id == project_id,
+            func.lower(Tag.name) == tag.strip().lower()
+        )
+    return keyset_paginate(query, KnowledgeBase.created_at, KnowledgeBase.id, limit, cursor)
+
 
+def get_project_tag_cloud(project_id, limit=50):
+    """プロジェクトのタグを付いているナレッジの件数の多い順に返す"""
+    count = func.count(KnowledgeTag.knowledge_base_id)
+    rows = db.session.query(Tag.name, count).join(
+        KnowledgeTag, KnowledgeTag.tag_id == Tag.id
+    ).filter(
+        KnowledgeTag.project_id == project_id
+    ).group_by(
+        Tag.id, Tag.name
+    ).order_by(
+        count.desc(), Tag.name
+    ).limit(limit)
+    return [{'name': name, 'count': tag_count} for name, tag_count in rows]
 
-def update_knowledge_base(kb_id, title=None, content=None, category=None):
+
+def update_knowledge_base(kb_id, title=None, content=None, category=None, tags=None):
     """ナレッジベースを更新"""
     try:
         knowledge_base = db.session.get(KnowledgeBase, kb_id)
@@ -55,8 +124,14 @@ def update_knowledge_base(kb_id, title=None, content=None, category=None):
             knowledge_base.content = content
         if category is not None:
             knowledge_base.category = category
+        if tags is not None:
+            knowledge_base.tags = tags
         
+        sync_chunks(knowledge_base)
+        if tags is not None:
+            sync_tags(knowledge_base)
         db.session.commit()
+        index_knowledge(knowledge_base)
         logger.info(f"ナレッジベース更新: {knowledge_base.title} (ID: {kb_id})")
         return knowledge_base
     except SQLAlchemyError as e:
@@ -65,6 +140,117 @@ def update_knowledge_base(kb_id, title=None, content=None, category=None):
         raise
 
 
+def sync_chunks(knowledge_base):
+    """本文のハッシュが変わっていればチャンクを作り直す（コミット前に呼ぶ）
+    
+    作り直した場合はTrueを返す。
+    """
+    digest = content_hash(knowledge_base.content)
+    if knowledge_base.content_hash == digest:
+        return False
+    
+    if knowledge_base.id is None:
+        db.session.flush()
+    else:
+        KnowledgeChunk.query.filter_by(
+            knowledge_base_id=knowledge_base.id
+        ).delete(synchronize_session=False)
+    
+    db.session.add_all([
+        KnowledgeChunk(**row) for row in _chunk_rows(knowledge_base.id, knowledge_base.content)
+    ])
+    knowledge_base.content_hash = digest
+    return True
+
+
+def _chunk_rows(kb_id, content):
+    """本文をチャンクに分割し、knowledge_chunks の行（辞書）のリストを返す"""
+    return [
+        dict(row, knowledge_base_id=kb_id)
+        for row in split_chunk_rows(
+            content,
+            max_tokens=current_app.config['SEARCH_CHUNK_MAX_TOKENS'],
+            overlap_tokens=current_app.config['SEARCH_CHUNK_OVERLAP_TOKENS']
+        )
+    ]
+
+
+def split_chunk_rows(content, max_tokens=256, overlap_tokens=32):
+    """本文をチャンクに分割し、ナレッジIDを除いた knowledge_chunks の行を返す
+    
+    アプリケーションコンテキストを使わないため、インポート時のワーカープロセスからも呼べる。
+    """
+    chunks = chunk_text(content, max_tokens=max_tokens, overlap_tokens=overlap_tokens)
+    return [
+        {
+            'position': chunk.position,
+            'heading': chunk.heading[:200] if chunk.heading else None,
+            'content': content[chunk.start:chunk.end],
+            'start_offset': chunk.start,
+            'end_offset': chunk.end,
+            'token_count': chunk.token_count
+        }
+        for chunk in chunks
+    ]
+
+
+def normalize_tag_names(tags):
+    """タグ名の前後の空白を除き、重複（大文字小文字の違いを含む）を除いて返す"""
+    names = {}
+    for tag in tags or []:
+        if isinstance(tag, str) and tag.strip():
+            name = tag.strip()[:50]
+            names.setdefault(name.casefold(), name)
+    return list(names.values())
+
+
+def sync_tags(knowledge_base):
+    """JSONのタグを tags / knowledge_tags に反映する（コミット前に呼ぶ）"""
+    if knowledge_base.id is None:
+        db.session.flush()
+    else:
+        KnowledgeTag.query.filter_by(knowledge_base_id=knowledge_base.id).delete()
+    
+    names = normalize_tag_names(knowledge_base.tags)
+    if not names:
+        return
+    
+    project_id = knowledge_base.project_id
+    existing = {}
+    for tag in _find_tags(project_id, names):
+        existing.setdefault(tag.name.casefold(), tag)
+    tags = []
+    for name in names:
+        tag = existing.get(name.casefold())
+        if tag is None:
+            tag = existing[name.casefold()] = _create_tag(project_id, name)
+        tags.append(tag)
+    db.session.add_all([
+        KnowledgeTag(knowledge_base_id=knowledge_base.id, tag_id=tag.id, project_id=project_id)
+        for tag in tags
+    ])
+
+
+def _find_tags(project_id, names):
+    """プロジェクトのタグを大文字小文字を区別せずに引く（SQLiteの比較は大文字小文字を区別するため）"""
+    return Tag.query.filter(
+        Tag.project_id == project_id,
+        func.lower(Tag.name).in_([name.lower() for name in names])
+    ).order_by(Tag.id)
+
+
+def _create_tag(project_id, name):
+    """タグを作成（他のリクエストが同時に同じタグを作成していればそのタグを返す）"""
+    try:
+        with db.session.begin_nested():
+            tag = Tag(project_id=project_id, name=name)
+            db.session.add(tag)
+        return tag
+    except IntegrityError:
+        # REPEATABLE READでも他のトランザクションがコミットした行が見えるようロック付きで読む
+        return _find_tags(project_id, [name]).with_for_update().first()
+
+
 def delete_knowledge_base(kb_id):
     """ナレッジベースを削除"""
     try:
@@ -72,8 +258,10 @@ def delete_knowledge_base(kb_id):
         if not knowledge_base:
             return False
         
+        project_id = knowledge_base.project_id
         db.session.delete(knowledge_base)
         db.session.commit()
+        unindex_knowledge(project_id, kb_id)
         logger.info(f"ナレッジベース削除: ID {kb_id}")
         return True
     except SQLAlchemyError as e:
@@ -82,26 +270,778 @@ def delete_knowledge_base(kb_id):
         raise
 
 
-def search_knowledge_base(kb_id, query, user_id=None):
-    """ナレッジベース内を検索"""
+BULK_OPERATIONS = ('create', 'update', 'delete')
+_BULK_STATUSES = {'create': 'created', 'update': 'updated', 'delete': 'deleted'}
+
+
+def _bulk_values(operation, require_title):
+    """作成・更新の値を検証して列の値の辞書を返す（不正ならValueError）"""
+    values = {}
+    title = operation.get('title')
+    if title is not None or require_title:
+        if not isinstance(title, str) or not title.strip():
+            raise ValueError('タイトルが必要です')
+        if len(title) > 200:
+            raise ValueError('タイトルは200文字以下である必要があります')
+        values['title'] = title
+    content = operation.get('content', '' if require_title else None)
+    if content is not None:
+        if not isinstance(content, str):
+            raise ValueError('contentは文字列で指定してください')
+        values['content'] = content
+    if 'category' in operation:
+        category = operation['category']
+        if category is not None and (not isinstance(category, str) or len(category) > 50):
+            raise ValueError('categoryは50文字以下の文字列で指定してください')
+        values['category'] = category
+    if operation.get('tags') is not None:
+        error = validate_tags(operation['tags'])
+        if error:
+            raise ValueError(error)
+        values['tags'] = operation['tags']
+    return values
+
+
+def _validate_bulk_operations(operations, user_id):
+    """一括操作をすべて検証し、(操作ごとの結果のリスト, 実行する操作のリスト) を返す
+    
+    結果は入力と同じ順で、検証に失敗した操作の位置にはエラーを入れておく。
+    """
+    from ..projects.services import ProjectService
+    
+    results = [None] * len(operations)
+    pending = []
+    for position, operation in enumerate(operations):
+        try:
+            if not isinstance(operation, dict):
+                raise ValueError('操作はオブジェクトで指定してください')
+            op = operation.get('op')
+            if op not in BULK_OPERATIONS:
+                raise ValueError(f"opは {', '.join(BULK_OPERATIONS)} のいずれかで指定してください")
+            if op == 'create':
+                project_id = operation.get('project_id')
+                if not isinstance(project_id, int) or isinstance(project_id, bool):
+                    raise ValueError('project_idが必要です')
+                pending.append({'index': position, 'op': op, 'project_id': project_id,
+                                'values': _bulk_values(operation, require_title=True)})
+            else:
+                kb_id = operation.get('id')
+                if not isinstance(kb_id, int) or isinstance(kb_id, bool):
+                    raise ValueError('idが必要です')
+                values = _bulk_values(operation, require_title=False) if op == 'update' else {}
+                pending.append({'index': position, 'op': op, 'id': kb_id, 'values': values})
+        except ValueError as e:
+            results[position] = {'index': position, 'status': 'error', 'error': str(e)}
+    
+    # 更新・削除の対象は1回のクエリでまとめて引く
+    targets = {}
+    kb_ids = [operation['id'] for operation in pending if operation['op'] != 'create']
+    if kb_ids:
+        targets = {
+            kb_id: (project_id, digest)
+            for kb_id, project_id, digest in db.session.query(
+                KnowledgeBase.id, KnowledgeBase.project_id, KnowledgeBase.content_hash
+            ).filter(KnowledgeBase.id.in_(set(kb_ids)))
+        }
+    
+    accessible = ProjectService.get_user_project_ids(user_id)
+    seen = set()
+    valid = []
+    for operation in pending:
+        error = None
+        if operation['op'] == 'create':
+            if operation['project_id'] not in accessible:
+                error = 'このプロジェクトにアクセスする権限がありません'
+        elif operation['id'] not in targets:
+            error = 'ナレッジベースが見つかりません'
+        elif operation['id'] in seen:
+            error = '同じナレッジベースへの操作が重複しています'
+        else:
+            seen.add(operation['id'])
+            operation['project_id'], operation['content_hash'] = targets[operation['id']]
+            if operation['project_id'] not in accessible:
+                error = 'このプロジェクトにアクセスする権限がありません'
+        if error:
+            results[operation['index']] = {'index': operation['index'], 'op': operation['op'],
+                                           'status': 'error', 'error': error}
+        else:
+            valid.append(operation)
+    return results, valid
+
+
+def summary_values(values):
+    """本文から抜粋・文字数・ハッシュを計算して値に加える（一括書き込みは@validatesを通らないため）"""
+    if 'content' in values:
+        values['excerpt'] = make_excerpt(values['content'])
+        values['content_length'] = len(values['content'])
+        values['content_hash'] = content_hash(values['content'])
+    return values
+
+
+def _insert_ids(model, rows):
+    """行を挿入し、採番されたIDのリストを行と同じ順で返す
+    
+    executemanyのRETURNINGを入力順で使える方言（SQLite・MariaDBなど）は1回の文でまとめて挿入する。
+    使えない方言（MySQL）は1行ずつ挿入してlastrowidを読む。複数行INSERTの先頭IDから
+    連番を仮定する方法は innodb_autoinc_lock_mode=2（MySQL 8の既定）で成り立たないため使わない。
+    """
+    if db.session.get_bind().dialect.insert_executemany_returning_sort_by_parameter_order:
+        return db.session.scalars(insert(model).returning(model.id, sort_by_parameter_order=True), rows).all()
+    statement = model.__table__.insert()
+    return [db.session.execute(statement, row).inserted_primary_key[0] for row in rows]
+
+
+def _sync_tags_batch(documents, replace_ids):
+    """(ナレッジID, プロジェクトID, タグ) のタグを tags / knowledge_tags にまとめて反映"""
+    if replace_ids:
+        db.session.execute(
+            delete(KnowledgeTag).where(KnowledgeTag.knowledge_base_id.in_(replace_ids)),
+            execution_options={'synchronize_session': False}
+        )
+    
+    wanted = {}  # プロジェクトID -> {正規化したタグ名: タグ名}
+    links = []
+    for kb_id, project_id, tags in documents:
+        names = normalize_tag_names(tags)
+        for name in names:
+            wanted.setdefault(project_id, {}).setdefault(name.casefold(), name)
+        links.append((kb_id, project_id, names))
+    
+    tag_ids = {}
+    for project_id, names in wanted.items():
+        existing = {}
+        for tag in _find_tags(project_id, list(names.values())):
+            existing.setdefault(tag.name.casefold(), tag.id)
+        missing = [{'project_id': project_id, 'name': name} for key, name in names.items() if key not in existing]
+        if missing:
+            try:
+                with db.session.begin_nested():
+                    inserted = _insert_ids(Tag, missing)
+            except IntegrityError:
+                # 他のリクエストが同時に作成したタグがあれば、1件ずつ作成または取得する
+                inserted = [_create_tag(project_id, row['name']).id for row in missing]
+            existing.update((row['name'].casefold(), tag_id) for row, tag_id in zip(missing, inserted))
+        for key, tag_id in existing.items():
+            tag_ids[(project_id, key)] = tag_id
+    
+    rows = [
+        {'knowledge_base_id': kb_id, 'tag_id': tag_ids[(project_id, name.casefold())], 'project_id': project_id}
+        for kb_id, project_id, names in links
+        for name in names
+    ]
+    if rows:
+        db.session.execute(insert(KnowledgeTag), rows)
+
+
+def insert_knowledge_rows(rows, chunks):
+    """ナレッジの行をまとめて挿入し、IDのリストを行と同じ順で返す（コミットは呼び出し側）
+    
+    rowsは summary_values() 済みの列の値、chunksは行ごとの split_chunk_rows() の結果。
+    チャンクと正規化したタグも同じトランザクションでまとめて書き込む。
+    """
+    kb_ids = _insert_ids(KnowledgeBase, rows)
+    chunk_rows = [
+        dict(chunk, knowledge_base_id=kb_id)
+        for kb_id, row_chunks in zip(kb_ids, chunks)
+        for chunk in row_chunks
+    ]
+    if chunk_rows:
+        db.session.execute(insert(KnowledgeChunk), chunk_rows)
+    tagged = [(kb_id, row['project_id'], row['tags']) for kb_id, row in zip(kb_ids, rows) if row.get('tags')]
+    if tagged:
+        _sync_tags_batch(tagged, [])
+    return kb_ids
+
+
+def _write_bulk_batch(batch, user_id):
+    """検証済みの操作1チャンク分を書き込む（コミットは呼び出し側）"""
+    creates = [operation for operation in batch if operation['op'] == 'create']
+    updates = [operation for operation in batch if operation['op'] == 'update']
+    deletes = [operation['id'] for operation in batch if operation['op'] == 'delete']
+    
+    if creates:
+        rows = [
+            summary_values({'category': None, 'tags': None, **operation['values'],
+                            'project_id': operation['project_id'], 'created_by_id': user_id})
+            for operation in creates
+        ]
+        kb_ids = insert_knowledge_rows(rows, [
+            split_chunk_rows(
+                row['content'],
+                max_tokens=current_app.config['SEARCH_CHUNK_MAX_TOKENS'],
+                overlap_tokens=current_app.config['SEARCH_CHUNK_OVERLAP_TOKENS']
+            )
+            for row in rows
+        ])
+        for operation, kb_id in zip(creates, kb_ids):
+            operation['id'] = kb_id
+    
+    chunk_rows = []
+    tagged = []
+    rechunked = []
+    retagged = []
+    rows = []
+    for operation in updates:
+        values = summary_values(dict(operation['values']))
+        if 'content_hash' in values:
+            if values['content_hash'] != operation['content_hash']:
+                rechunked.append(operation['id'])
+                chunk_rows.extend(_chunk_rows(operation['id'], values['content']))
+            else:
+                values.pop('content_hash')
+        if 'tags' in values:
+            retagged.append(operation['id'])
+            tagged.append((operation['id'], operation['project_id'], values['tags']))
+        if values:
+            rows.append({'id': operation['id'], **values})
+    if rows:
+        db.session.execute(update(KnowledgeBase), rows)
+    
+    # 子テーブルは一括DELETEのカスケードに頼らず明示的に消す
+    if rechunked or deletes:
+        db.session.execute(
+            delete(KnowledgeChunk).where(KnowledgeChunk.knowledge_base_id.in_(rechunked + deletes)),
+            execution_options={'synchronize_session': False}
+        )
+    if deletes:
+        db.session.execute(
+            delete(KnowledgeTag).where(KnowledgeTag.knowledge_base_id.in_(deletes)),
+            execution_options={'synchronize_session': False}
+        )
+        db.session.execute(
+            delete(KnowledgeBase).where(KnowledgeBase.id.in_(deletes)),
+            execution_options={'synchronize_session': False}
+        )
+    if chunk_rows:
+        db.session.execute(insert(KnowledgeChunk), chunk_rows)
+    if tagged or retagged:
+        _sync_tags_batch(tagged, retagged)
+
+
+def bulk_write_knowledge(operations, user_id, chunk_size=None):
+    """ナレッジの作成・更新・削除をまとめて実行し、操作ごとの結果を入力と同じ順で返す
+    
+    すべての操作を先に検証してから、通ったものをchunk_size件ずつのトランザクションで
+    executemanyで書き込む。失敗したトランザクションの操作だけがエラーになり、
+    それ以外の操作は反映される（部分失敗）。検索索引への反映もチャンクごとにまとめて行う。
+    """
+    chunk_size = chunk_size or current_app.config['KNOWLEDGE_BULK_CHUNK_SIZE']
+    results, valid = _validate_bulk_operations(operations, user_id)
+    
+    for start in range(0, len(valid), chunk_size):
+        batch = valid[start:start + chunk_size]
+        try:
+            _write_bulk_batch(batch, user_id)
+            db.session.commit()
+        except SQLAlchemyError as e:
+            db.session.rollback()
+            logger.error(f"ナレッジ一括書き込みエラー: {str(e)}")
+            for operation in batch:
+                results[operation['index']] = {'index': operation['index'], 'op': operation['op'],
+                                               'status': 'error', 'error': '書き込みに失敗しました'}
+            continue
+        
+        for operation in batch:
+            results[operation['index']] = {'index': operation['index'], 'op': operation['op'],
+                                           'id': operation['id'], 'status': _BULK_STATUSES[operation['op']]}
+        unindex_knowledge_batch([
+            (operation['project_id'], operation['id']) for operation in batch if operation['op'] == 'delete'
+        ])
+        written = [operation['id'] for operation in batch if operation['op'] != 'delete']
+        if written:
+            index_knowledge_batch(KnowledgeBase.query.filter(KnowledgeBase.id.in_(written)).all())
+    
+    failed = sum(1 for result in results if result['status'] == 'error')
+    logger.info(f"ナレッジ一括書き込み: {len(results) - failed}件成功 / {failed}件失敗")
+    return results
+
+
+EXPORT_FORMATS = ('ndjson', 'csv')
+EXPORT_FIELDS = (
+    'id', 'title', 'content', 'category', 'tags',
+    'created_by_id', 'created_by', 'created_at', 'updated_at'
+)
+
+
+def _export_rows(project_id, batch_size):
+    """プロジェクトのナレッジをID順にサーバーサイドカーソルで読み、batch_size行ずつ返す
+    
+    ORMオブジェクトを作らず列の値だけを読むため、セッションに行が溜まらない。
+    """
+    result = db.session.execute(
+        db.select(
+            KnowledgeBase.id,
+            KnowledgeBase.title,
+            KnowledgeBase.content,
+            KnowledgeBase.category,
+            KnowledgeBase.tags,
+            KnowledgeBase.created_by_id,
+            User.username,
+            KnowledgeBase.created_at,
+            KnowledgeBase.updated_at
+        ).outerjoin(
+            User, User.id == KnowledgeBase.created_by_id
+        ).where(
+            KnowledgeBase.project_id == project_id
+        ).order_by(
+            KnowledgeBase.id
+        ).execution_options(yield_per=batch_size)
+    )
+    for partition in result.partitions():
+        yield [
+            dict(zip(EXPORT_FIELDS, row[:7]), created_at=_isoformat(row[7]), updated_at=_isoformat(row[8]))
+            for row in partition
+        ]
+
+
+def _isoformat(value):
+    return value.isoformat() if value else None
+
+
+def export_project_knowledge(project_id, fmt='ndjson', batch_size=None):
+    """プロジェクトのナレッジをNDJSONまたはCSVの文字列チャンクとして順に返す
+    
+    1チャンクはbatch_size行分で、メモリ使用量はプロジェクトの件数によらない。
+    CSVのtagsはJSON文字列にする。
+    """
+    batch_size = batch_size or current_app.config['EXPORT_BATCH_SIZE']
+    count = 0
+    if fmt == 'csv':
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS, lineterminator='\n')
+        writer.writeheader()
+        for rows in _export_rows(project_id, batch_size):
+            for row in rows:
+                writer.writerow(dict(row, tags=json.dumps(row['tags'], ensure_ascii=False) if row['tags'] else ''))
+            count += len(rows)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue()
+    else:
+        for rows in _export_rows(project_id, batch_size):
+            count += len(rows)
+            yield ''.join(json.dumps(row, ensure_ascii=False) + '\n' for row in rows)
+    logger.info(f"ナレッジエクスポート: プロジェクト {project_id} ({count}件, {fmt})")
+
+
+SEARCH_MODES = ('keyword', 'semantic', 'hybrid', 'passage')
+
+
+def _search_result(knowledge_base, score):
+    """検索結果1件分の辞書（本文は含めない）"""
+    return {
+        'id': knowledge_base.id,
+        'title': knowledge_base.title,
+        'category': knowledge_base.category,
+        'tags': knowledge_base.tags,
+        'project_id': knowledge_base.project_id,
+        'updated_at': knowledge_base.updated_at.isoformat() if knowledge_base.updated_at else None,
+        'score': round(score, 4)
+    }
+
+
+def search_project_passages(project_id, query, limit=10, depth=None, doc_filter=None):
+    """チャンク単位で検索し、ナレッジごとに一致したパッセージをまとめて返す
+    
+    ナレッジのスコアは最もスコアの高いチャンクのスコアとする。
+    depthは文書にまとめる前に取得するチャンク数。
+    (結果, 一致したチャンクを含むナレッジIDのリスト) を返す。
+    """
+    per_result = current_app.config['SEARCH_PASSAGES_PER_RESULT']
+    max_highlights = current_app.config['SEARCH_HIGHLIGHT_MAX']
+    terms = highlight_terms(query)
+    depth = max(depth or current_app.config['SEARCH_PASSAGE_DEPTH'], limit)
+    chunk_filter = None
+    if doc_filter is not None:
+        chunk_filter = lambda key: doc_filter(split_chunk_key(key)[0])
+    hits = get_chunk_search().search(project_id, query, depth, doc_filter=chunk_filter)
+    
+    # チャンクのスコア順を保ったままナレッジごとにまとめる
+    grouped = {}
+    matched = {}
+    for hit in hits:
+        kb_id, position = split_chunk_key(hit.doc_id)
+        matched[kb_id] = None
+        passages = grouped.get(kb_id)
+        if passages is None:
+            if len(grouped) >= limit:
+                continue
+            passages = grouped[kb_id] = []
+        if len(passages) < per_result:
+            passages.append((position, hit.score))
+    if not grouped:
+        return [], []
+    
+    items = {
+        kb.id: kb
+        for kb in KnowledgeBase.query.filter(KnowledgeBase.id.in_(list(grouped)))
+    }
+    chunks = {
+        (chunk.knowledge_base_id, chunk.position): chunk
+        for chunk in KnowledgeChunk.query.filter(
+            tuple_(KnowledgeChunk.knowledge_base_id, KnowledgeChunk.position).in_([
+                (kb_id, position)
+                for kb_id, passages in grouped.items()
+                for position, _ in passages
+            ])
+        )
+    }
+    
+    results = []
+    for kb_id, passages in grouped.items():
+        knowledge_base = items.get(kb_id)
+        if knowledge_base is None:
+            continue
+        result = _search_result(knowledge_base, passages[0][1])
+        result['passages'] = []
+        for position, score in passages:
+            chunk = chunks.get((kb_id, position))
+            if chunk is None:
+                continue
+            result['passages'].append({
+                'chunk_id': chunk.id,
+                'position': chunk.position,
+                'heading': chunk.heading,
+                'start_offset': chunk.start_offset,
+                'end_offset': chunk.end_offset,
+                'text': chunk.content,
+                'highlights': [
+                    {'start': chunk.start_offset + start, 'end': chunk.start_offset + end}
+                    for start, end in find_matches(chunk.content, terms)[:max_highlights]
+                ],
+                'score': round(score, 4)
+            })
+        results.append(result)
+    return results, list(matched)
+
+
+def search_project_knowledge(project_id, query, limit=10, mode='keyword', depth=None, fusion=None, fuzzy=False,
+                             filters=None):
+    """プロジェクト内のナレッジをスコア順に検索し、{'results', 'facets'} を返す
+    
+    keyword: SEARCH_BACKENDで選択したキーワード検索（fuzzyなら語彙辞書にない語を近い語に展開）
+    semantic: ベクトル検索
+    hybrid: 両方を並列に実行して融合（depthは各リトリーバの候補数）
+    passage: チャンク単位で検索し、一致したパッセージを返す
+    
+    filters（カテゴリ・タグ・作成者・作成日時の範囲）は検索中に適用する。
+    facetsは絞り込み後の一致文書についての値ごとの件数。keywordではクエリの語を含む文書、
+    passageでは取得したチャンクを含む文書、semantic・hybridでは（すべての文書が候補になるため）
+    絞り込み条件に一致する文書を数える。件数のために検索の取得件数は増やさない。
+    fulltextバックエンドでは、検索と同じ1回のMATCHで受け取った上位SEARCH_FULLTEXT_MAX_MATCHES件から数える。
+    """
+    facet_index = get_facet_index()
+    doc_filter = facet_index.filter(project_id, filters)
+    if doc_filter is not None and not len(doc_filter):
+        return {'results': [], 'facets': facet_index.counts(project_id, [])}
+    
+    if mode == 'passage':
+        results, matched = search_project_passages(project_id, query, limit, depth, doc_filter)
+        return {'results': results, 'facets': _facet_counts(project_id, matched)}
+    
+    expansions = None
+    matched = None
+    if mode == 'semantic':
+        hits = get_vector_search().search(project_id, query, limit, doc_filter=doc_filter)
+    elif mode == 'hybrid':
+        hits = get_hybrid_search().search(
+            project_id, query, limit, depth=depth, fusion=fusion, doc_filter=doc_filter
+        )
+    else:
+        expansions = get_fuzzy_index().expand(project_id, query) if fuzzy else None
+        backend = get_search_backend()
+        hits, matched = backend.search_with_matches(
+            project_id, query, limit, expansions or None, doc_filter=doc_filter
+        )
+    facets = _facet_counts(project_id, matched, doc_filter)
+    if not hits:
+        return {'results': [], 'facets': facets}
+    
+    # 上位の文書だけをまとめて取得
+    items = {
+        kb.id: kb
+        for kb in KnowledgeBase.query.filter(KnowledgeBase.id.in_([hit.doc_id for hit in hits]))
+    }
+    
+    results = []
+    for hit in hits:
+        knowledge_base = items.get(hit.doc_id)
+        if knowledge_base is None:
+            continue
+        results.append(_search_result(knowledge_base, hit.score))
+        if mode == 'hybrid':
+            results[-1]['score_breakdown'] = hit.breakdown
+    _attach_snippets(project_id, query, results, expansions)
+    return {'results': results, 'facets': facets}
+
+
+def _facet_counts(project_id, kb_ids, doc_filter=None):
+    """ファセットの件数を集計し、作成者には表示名を付ける（kb_idsがNoneなら絞り込み条件に一致する全文書）"""
+    facets = get_facet_index().counts(project_id, kb_ids, doc_filter=doc_filter)
+    authors = facets.get('author')
+    if authors:
+        names = dict(db.session.query(User.id, User.username).filter(
+            User.id.in_([entry['value'] for entry in authors])
+        ))
+        for entry in authors:
+            entry['label'] = names.get(entry['value'])
+    return facets
+
+
+def _filters_key(filters):
+    """キャッシュキー用に絞り込み条件を並び順に依存しない形にする"""
+    key = []
+    for field, value in sorted((filters or {}).items()):
+        if value is None or value == []:
+            continue
+        if isinstance(value, (list, tuple, set)):
+            value = sorted(value, key=str)
+        elif hasattr(value, 'isoformat'):
+            value = value.isoformat()
+        key.append([field, value])
+    return key
+
+
+def _attach_snippets(project_id, query, results, expansions=None):
+    """各結果に、最も一致したチャンクから切り出したスニペットとハイライトを付ける
+    
+    本文全体は読まず、チャンク1つ分（トークン数の上限あり）だけを走査する。
+    一致するチャンクがない結果（ベクトル検索のみの一致など）は先頭のチャンクを使う。
+    """
+    if not results:
+        return
+    
+    best = {}
+    for hit in get_chunk_search().search(
+        project_id, query, current_app.config['SEARCH_PASSAGE_DEPTH'], expansions or None
+    ):
+        kb_id, position = split_chunk_key(hit.doc_id)
+        best.setdefault(kb_id, position)
+    
+    pairs = [(result['id'], best.get(result['id'], 0)) for result in results]
+    chunks = {
+        (chunk.knowledge_base_id, chunk.position): chunk
+        for chunk in KnowledgeChunk.query.filter(
+            tuple_(KnowledgeChunk.knowledge_base_id, KnowledgeChunk.position).in_(pairs)
+        )
+    }
+    
+    terms = highlight_terms(query, expansions)
+    for result, pair in zip(results, pairs):
+        chunk = chunks.get(pair)
+        if chunk is None:
+            result['snippet'] = None
+            result['highlights'] = []
+            continue
+        result.update(build_snippet(
+            chunk.content,
+            chunk.start_offset,
+            terms,
+            window=current_app.config['SEARCH_SNIPPET_LENGTH'],
+            max_highlights=current_app.config['SEARCH_HIGHLIGHT_MAX']
+        ))
+
+
+def _uncovered_span(start, end, covered):
+    """covered（選択済みの範囲）と重ならない部分を返す（端の重なりだけを削る）"""
+    for covered_start, covered_end in covered:
+        if covered_end <= start or end <= covered_start:
+            continue
+        if covered_start <= start:
+            start = max(start, covered_end)
+        elif end <= covered_end:
+            end = covered_start
+        else:
+            # 選択済みの範囲を内側に含む場合は重複が大きいとみなす
+            return start, start
+        if start >= end:
+            break
+    return start, end
+
+
+def build_project_context(project_id, query, token_budget, depth=None):
+    """クエリに関連するパッセージをトークン予算内に詰めて返す
+    
+    チャンク単位で候補を取得し、スコアの高い順に貪欲に詰める。
+    同じナレッジ内で既に選んだ範囲と重なる部分は削り、半分以上重なるチャンクと
+    本文が同一のチャンクは除外する。
+    """
+    depth = depth or current_app.config['SEARCH_CONTEXT_DEPTH']
+    sync_project_indexes(project_id)
+    hits = get_chunk_search().search(project_id, query, depth)
+    
+    scores = {}
+    for hit in hits:
+        scores[split_chunk_key(hit.doc_id)] = hit.score
+    chunks = {}
+    titles = {}
+    if scores:
+        for chunk, title in db.session.query(KnowledgeChunk, KnowledgeBase.title).join(
+            KnowledgeBase, KnowledgeBase.id == KnowledgeChunk.knowledge_base_id
+        ).filter(
+            tuple_(KnowledgeChunk.knowledge_base_id, KnowledgeChunk.position).in_(list(scores))
+        ):
+            chunks[(chunk.knowledge_base_id, chunk.position)] = chunk
+            titles[chunk.knowledge_base_id] = title
+    
+    passages = []
+    covered = {}
+    seen_texts = set()
+    used_tokens = 0
+    for key, score in sorted(scores.items(), key=lambda item: -item[1]):
+        chunk = chunks.get(key)
+        if chunk is None:
+            continue
+        
+        kb_covered = covered.setdefault(chunk.knowledge_base_id, [])
+        start, end = _uncovered_span(chunk.start_offset, chunk.end_offset, kb_covered)
+        if (end - start) * 2 < chunk.end_offset - chunk.start_offset:
+            continue
+        text = chunk.content[start - chunk.start_offset:end - chunk.start_offset]
+        if text in seen_texts:
+            continue
+        
+        tokens = count_tokens(text)
+        if used_tokens + tokens > token_budget:
+            continue
+        
+        used_tokens += tokens
+        kb_covered.append((start, end))
+        seen_texts.add(text)
+        passages.append({
+            'knowledge_base_id': chunk.knowledge_base_id,
+            'chunk_id': chunk.id,
+            'title': titles[chunk.knowledge_base_id],
+            'heading': chunk.heading,
+            'start_offset': start,
+            'end_offset': end,
+            'text': text,
+            'token_count': tokens,
+            'score': round(score, 4)
+        })
+        if used_tokens >= token_budget:
+            break
+    
+    logger.info(
+        f"コンテキスト構築: プロジェクト {project_id}, クエリ: {query}, "
+        f"パッセージ: {len(passages)}件, トークン: {used_tokens}/{token_budget}"
+    )
+    return {
+        'query': query,
+        'token_budget': token_budget,
+        'used_tokens': used_tokens,
+        'passages': passages,
+        'sources': sorted({passage['knowledge_base_id'] for passage in passages})
+    }
+
+
+def cached_search_project_knowledge(project_id, query, limit=10, mode='keyword', depth=None, fusion=None,
+                                    fuzzy=False, filters=None):
+    """search_project_knowledge() の結果をキャッシュ経由で返す
+    
+    キーにDB上の索引の世代番号を含めるため、どのワーカーでの書き込みでも暗黙に無効化される。
+    他のワーカーで書き込まれていれば、先にこのプロセスのメモリ上の索引を破棄する。
+    """
+    generation = sync_project_indexes(project_id)
+    cache = get_query_cache()
+    if cache is None:
+        return search_project_knowledge(project_id, query, limit, mode, depth, fusion, fuzzy, filters)
+    
+    key = make_cache_key(
+        project_id, query, mode, generation,
+        limit, depth, fusion, fuzzy, _filters_key(filters)
+    )
+    response = cache.get(key)
+    if response is None:
+        response = search_project_knowledge(project_id, query, limit, mode, depth, fusion, fuzzy, filters)
+        cache.set(key, response)
+    return response
+
+
+def search_knowledge_base(kb_id, query, user_id=None, limit=10, mode='keyword', depth=None, fusion=None,
+                          fuzzy=False, filters=None):
+    """ナレッジベース内を検索し、{'results', 'facets', 'did_you_mean'} を返す
+    
+    kb_id のナレッジが属するプロジェクト全体を検索対象とする。
+    ナレッジが存在しない場合はNoneを返す。
+    """
     try:
-        # 検索ロジックをここに実装
-        # 実際の検索実装は要件に応じて変更
-        results = []
+        knowledge_base = db.session.get(KnowledgeBase, kb_id)
+        if not knowledge_base:
+            return None
+        
+        response = cached_search_project_knowledge(
+            knowledge_base.project_id, query, limit, mode, depth, fusion, fuzzy, filters
+        )
+        results = response['results']
+        did_you_mean = get_did_you_mean(knowledge_base.project_id, query)
         
         # 検索ログを記録
         if user_id:
             search_log = SearchLog(
                 user_id=user_id,
-                knowledge_base_id=kb_id,
-                query=query
+                project_id=knowledge_base.project_id,
+                query_text=query[:500],
+                results_count=len(results)
             )
             db.session.add(search_log)
             db.session.commit()
+            # 綴り間違いのクエリ（あいまい検索で結果が出たものを含む）は履歴として使わない
+            if results and did_you_mean is None:
+                get_suggest_index().record_query(knowledge_base.project_id, query[:500])
+                get_fuzzy_index().record_query(knowledge_base.project_id, query[:500])
         
-        logger.info(f"ナレッジベース検索: KB {kb_id}, クエリ: {query}")
-        return results
+        logger.info(f"ナレッジベース検索: KB {kb_id}, クエリ: {query}, モード: {mode}, 件数: {len(results)}")
+        # キャッシュした結果は書き換えずにコピーへ足す
+        return dict(response, did_you_mean=did_you_mean)
     except SQLAlchemyError as e:
         db.session.rollback()
         logger.error(f"ナレッジベース検索エラー: {str(e)}")
         raise
+
+
+def search_accessible_knowledge(user_id, query, limit=10, project_ids=None):
+    """ユーザーが参加している全プロジェクトを横断して検索
+    
+    参加プロジェクトのIDは1回のクエリで集合として求め、横断索引の検索中の絞り込みに使う。
+    project_idsを指定した場合は参加プロジェクトとの共通部分だけを対象にする。
+    """
+    from ..projects.services import ProjectService
+    
+    try:
+        accessible = ProjectService.get_user_project_ids(user_id)
+        if project_ids is not None:
+            accessible &= set(project_ids)
+        
+        sync_cross_project_index()
+        hits = get_cross_project_search().search_projects(accessible, query, limit)
+        items = {}
+        if hits:
+            items = {
+                kb.id: kb
+                for kb in KnowledgeBase.query.filter(KnowledgeBase.id.in_([hit.doc_id for hit in hits]))
+            }
+        results = [
+            _search_result(items[hit.doc_id], hit.score)
+            for hit in hits
+            if hit.doc_id in items
+        ]
+        
+        db.session.add(SearchLog(user_id=user_id, query_text=query[:500], results_count=len(results)))
+        db.session.commit()
+        
+        logger.info(
+            f"横断検索: ユーザー {user_id}, クエリ: {query}, プロジェクト: {len(accessible)}件, 件数: {len(results)}"
+        )
+        return results
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        logger.error(f"横断検索エラー: {str(e)}")
+        raise
+
+
+def get_did_you_mean(project_id, query):
+    """「もしかして」の修正候補（なければNone）"""
+    return get_fuzzy_index().did_you_mean(project_id, query)
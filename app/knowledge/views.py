@@ -3,7 +3,7 @@
 ナレッジベース関連ビュー（Webページ）
 """
 
-from flask import Blueprint
+from flask import Blueprint, request
 from app.inertia_config import render
 
 
@@ -13,7 +13,7 @@ knowledge_bp = Blueprint('knowledge', __name__, url_prefix='/knowledge')
 @knowledge_bp.route('/')
 def index():
     """ナレッジベース一覧ページ"""
-    return render('knowledge/Index')
+    return render('knowledge/Index', {'projectId': request.args.get('project_id', type=int)})
 
 
 @knowledge_bp.route('/<int:kb_id>')
@@ -11,8 +11,10 @@ db = SQLAlchemy()
 # モデルをインポート
 from .user import User
 from .project import Project, ProjectInvitation, project_members
-from .knowledge import KnowledgeBase
+from .knowledge import KnowledgeBase, KnowledgeChunk
 from .search_log import SearchLog
+from .search_generation import SearchGeneration
+from .tag import Tag, KnowledgeTag
 
 __all__ = [
     'db',
@@ -21,5 +23,9 @@ __all__ = [
     'ProjectInvitation', 
     'project_members',
     'KnowledgeBase',
-    'SearchLog'
+    'KnowledgeChunk',
+    'SearchLog',
+    'SearchGeneration',
+    'Tag',
+    'KnowledgeTag'
 ]
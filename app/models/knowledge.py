@@ -3,12 +3,35 @@
 ナレッジベースモデル
 """
 
+import re
 from datetime import datetime
-from sqlalchemy import JSON, Text, Index
+from sqlalchemy import JSON, Text, Index, UniqueConstraint, DDL, event
+from sqlalchemy.orm import defer, joinedload, validates
 from sqlalchemy.sql import func
 
 from . import db
 
+# 一覧に載せる本文の抜粋の文字数
+EXCERPT_LENGTH = 200
+
+_WHITESPACE = re.compile(r'\s+')
+
+
+def make_excerpt(content, length=EXCERPT_LENGTH):
+    """本文の先頭から空白をまとめた抜粋を作る（長い場合は末尾に…を付ける）"""
+    text = _WHITESPACE.sub(' ', content or '').strip()
+    if len(text) <= length:
+        return text
+    return text[:length - 1].rstrip() + '…'
+
+
+# to_dict() で返せるフィールドと、一覧で既定にする本文抜きのフィールド
+KNOWLEDGE_FIELDS = (
+    'id', 'title', 'content', 'excerpt', 'content_length', 'category', 'tags',
+    'project_id', 'project_name', 'created_by_id', 'created_by', 'created_at', 'updated_at'
+)
+KNOWLEDGE_SUMMARY_FIELDS = tuple(field for field in KNOWLEDGE_FIELDS if field != 'content')
+
 
 class KnowledgeBase(db.Model):
     """ナレッジベースモデル"""
@@ -19,6 +42,9 @@ class KnowledgeBase(db.Model):
     content = db.Column(Text, nullable=False)
     category = db.Column(db.String(50))
     tags = db.Column(JSON)
+    content_hash = db.Column(db.String(64))  # チャンク分割時の本文ハッシュ
+    excerpt = db.Column(db.String(EXCERPT_LENGTH))  # 一覧用の本文抜粋（本文の書き込み時に更新）
+    content_length = db.Column(db.Integer)  # 本文の文字数（本文の書き込み時に更新）
     project_id = db.Column(db.Integer, db.ForeignKey('projects.id'), nullable=False)
     created_by_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     created_at = db.Column(db.DateTime, default=func.current_timestamp())
@@ -32,23 +58,132 @@ class KnowledgeBase(db.Model):
         Index('idx_project_id', 'project_id'),
         Index('idx_category', 'category'),
         Index('idx_knowledge_created_at', 'created_at'),
+        Index('idx_knowledge_project_created_at', 'project_id', 'created_at', 'id'),
     )
     
     def __repr__(self):
         return f'<KnowledgeBase {self.title}>'
     
+    @validates('content')
+    def _update_summary(self, key, content):
+        """本文の書き込みに合わせて抜粋と文字数を更新"""
+        self.excerpt = make_excerpt(content)
+        self.content_length = len(content or '')
+        return content
+    
+    @staticmethod
+    def list_options(fields=KNOWLEDGE_SUMMARY_FIELDS):
+        """一覧でfieldsをto_dict()する際のローダーオプション
+        
+        本文を含まない場合は本文の列を読まず、必要な関連だけを同じSELECTで読み込む。
+        """
+        options = []
+        if 'content' not in fields:
+            options.append(defer(KnowledgeBase.content))
+        if 'project_name' in fields:
+            options.append(joinedload(KnowledgeBase.project))
+        if 'created_by' in fields:
+            options.append(joinedload(KnowledgeBase.created_by))
+        return tuple(options)
+    
+    def to_dict(self, fields=None):
+        """辞書形式で返す（fieldsを指定するとそのフィールドだけ）"""
+        return {field: _SERIALIZERS[field](self) for field in fields or KNOWLEDGE_FIELDS}
+
+
+_SERIALIZERS = {
+    'id': lambda kb: kb.id,
+    'title': lambda kb: kb.title,
+    'content': lambda kb: kb.content,
+    'excerpt': lambda kb: kb.excerpt,
+    'content_length': lambda kb: kb.content_length,
+    'category': lambda kb: kb.category,
+    'tags': lambda kb: kb.tags,
+    'project_id': lambda kb: kb.project_id,
+    'project_name': lambda kb: kb.project.name if kb.project else None,
+    'created_by_id': lambda kb: kb.created_by_id,
+    'created_by': lambda kb: kb.created_by.username if kb.created_by else None,
+    'created_at': lambda kb: kb.created_at.isoformat() if kb.created_at else None,
+    'updated_at': lambda kb: kb.updated_at.isoformat() if kb.updated_at else None,
+}
+
+
+class KnowledgeChunk(db.Model):
+    """ナレッジ本文のチャンク（検索・パッセージ取得の単位）"""
+    __tablename__ = 'knowledge_chunks'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    knowledge_base_id = db.Column(
+        db.Integer,
+        db.ForeignKey('knowledge_base.id', ondelete='CASCADE'),
+        nullable=False
+    )
+    position = db.Column(db.Integer, nullable=False)
+    heading = db.Column(db.String(200))
+    content = db.Column(Text, nullable=False)
+    start_offset = db.Column(db.Integer, nullable=False)
+    end_offset = db.Column(db.Integer, nullable=False)
+    token_count = db.Column(db.Integer, nullable=False)
+    
+    # リレーションシップ
+    knowledge_base = db.relationship(
+        'KnowledgeBase',
+        backref=db.backref('chunks', lazy='dynamic', cascade='all, delete-orphan')
+    )
+    
+    # インデックス
+    __table_args__ = (
+        UniqueConstraint('knowledge_base_id', 'position', name='uq_knowledge_chunk_position'),
+    )
+    
+    def __repr__(self):
+        return f'<KnowledgeChunk {self.knowledge_base_id}:{self.position}>'
+    
     def to_dict(self):
         """辞書形式で返す"""
         return {
             'id': self.id,
-            'title': self.title,
+            'knowledge_base_id': self.knowledge_base_id,
+            'position': self.position,
+            'heading': self.heading,
             'content': self.content,
-            'category': self.category,
-            'tags': self.tags,
-            'project_id': self.project_id,
-            'project_name': self.project.name if self.project else None,
-            'created_by_id': self.created_by_id,
-            'created_by': self.created_by.username if self.created_by else None,
-            'created_at': self.created_at.isoformat() if self.created_at else None,
-            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+            'start_offset': self.start_offset,
+            'end_offset': self.end_offset,
+            'token_count': self.token_count
         }
+
+
+# 全文検索用のスキーマ（db.create_all() でも作成されるようテーブル作成イベントに登録）
+# MySQL: ngramパーサのFULLTEXT索引
+# SQLite: FTS5の影テーブルと同期用トリガー
+_FULLTEXT_DDL = {
+    'mysql': [
+        'ALTER TABLE knowledge_base ADD FULLTEXT INDEX ft_knowledge_title_content (title, content) WITH PARSER ngram',
+    ],
+    'sqlite': [
+        "CREATE VIRTUAL TABLE IF NOT EXISTS knowledge_base_fts USING fts5("
+        "title, content, content='knowledge_base', content_rowid='id', tokenize='trigram')",
+        "CREATE TRIGGER IF NOT EXISTS knowledge_base_fts_ai AFTER INSERT ON knowledge_base BEGIN "
+        "INSERT INTO knowledge_base_fts(rowid, title, content) VALUES (new.id, new.title, new.content); "
+        "END",
+        "CREATE TRIGGER IF NOT EXISTS knowledge_base_fts_ad AFTER DELETE ON knowledge_base BEGIN "
+        "INSERT INTO knowledge_base_fts(knowledge_base_fts, rowid, title, content) "
+        "VALUES ('delete', old.id, old.title, old.content); "
+        "END",
+        "CREATE TRIGGER IF NOT EXISTS knowledge_base_fts_au AFTER UPDATE ON knowledge_base BEGIN "
+        "INSERT INTO knowledge_base_fts(knowledge_base_fts, rowid, title, content) "
+        "VALUES ('delete', old.id, old.title, old.content); "
+        "INSERT INTO knowledge_base_fts(rowid, title, content) VALUES (new.id, new.title, new.content); "
+        "END",
+    ],
+}
+
+for _dialect, _statements in _FULLTEXT_DDL.items():
+    for _statement in _statements:
+        event.listen(KnowledgeBase.__table__, 'after_create', DDL(_statement).execute_if(dialect=_dialect))
+
+event.listen(
+    KnowledgeBase.__table__,
+    'before_drop',
+    DDL('DROP TABLE IF EXISTS knowledge_base_fts').execute_if(dialect='sqlite')
+)
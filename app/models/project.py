@@ -4,7 +4,8 @@
 """
 
 from datetime import datetime
-from sqlalchemy import JSON, Text, Index, Table
+from sqlalchemy import JSON, Text, Index, Table, select
+from sqlalchemy.orm import column_property, joinedload, undefer
 from sqlalchemy.sql import func
 
 from . import db
@@ -39,6 +40,14 @@ class Project(db.Model):
     knowledge_items = db.relationship('KnowledgeBase', backref='project', lazy=True, cascade='all, delete-orphan')
     invitations = db.relationship('ProjectInvitation', backref='project', lazy=True, cascade='all, delete-orphan')
     
+    # メンバー数（membersを読み込まずに集計サブクエリで数える。一覧では undefer して同じSELECTで取得）
+    member_count = column_property(
+        select(func.count(project_members.c.user_id)).where(
+            project_members.c.project_id == id
+        ).correlate_except(project_members).scalar_subquery(),
+        deferred=True
+    )
+    
     # インデックス
     __table_args__ = (
         Index('idx_owner_id', 'owner_id'),
@@ -48,6 +57,11 @@ class Project(db.Model):
     def __repr__(self):
         return f'<Project {self.name}>'
     
+    @staticmethod
+    def list_options():
+        """一覧でto_dict()する際に追加のクエリを発行しないためのローダーオプション"""
+        return (joinedload(Project.owner), undefer(Project.member_count))
+    
     def to_dict(self):
         """辞書形式で返す"""
         return {
@@ -57,7 +71,7 @@ class Project(db.Model):
             'owner_id': self.owner_id,
             'owner': self.owner.username if self.owner else None,
             'is_private': self.is_private,
-            'member_count': len(self.members),
+            'member_count': self.member_count,
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'updated_at': self.updated_at.isoformat() if self.updated_at else None
         }
@@ -84,11 +98,17 @@ class ProjectInvitation(db.Model):
         Index('idx_email', 'email'),
         Index('idx_token', 'token'),
         Index('idx_expires_at', 'expires_at'),
+        Index('idx_invitations_project_created_at', 'project_id', 'created_at', 'id'),
     )
     
     def __repr__(self):
         return f'<ProjectInvitation {self.email} to {self.project.name}>'
     
+    @staticmethod
+    def list_options():
+        """一覧でto_dict()する際に追加のクエリを発行しないためのローダーオプション"""
+        return (joinedload(ProjectInvitation.project), joinedload(ProjectInvitation.invited_by))
+    
     def to_dict(self):
         """辞書形式で返す"""
         return {
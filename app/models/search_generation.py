@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+"""
+検索索引の世代番号モデル
+"""
+
+from . import db
+
+
+class SearchGeneration(db.Model):
+    """プロジェクトの検索索引の世代番号
+
+    ナレッジを書き込むたびに進める。各ワーカーはメモリ上の索引を構築した時点の世代と比べて、
+    他のワーカーでの書き込みを検出する。プロジェクト削除後も行は残す（横断索引の世代の合計に使うため）。
+    """
+    __tablename__ = 'search_generations'
+
+    project_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    generation = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<SearchGeneration {self.project_id}: {self.generation}>'
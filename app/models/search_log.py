@@ -17,12 +17,14 @@ class SearchLog(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     query_text = db.Column(db.String(500), nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)
+    project_id = db.Column(db.Integer, db.ForeignKey('projects.id', ondelete='SET NULL'), nullable=True)
     results_count = db.Column(db.Integer, default=0)
     created_at = db.Column(db.DateTime, default=func.current_timestamp())
     
     # インデックス
     __table_args__ = (
         Index('idx_search_logs_created_at', 'created_at'),
+        Index('idx_search_logs_project_created_at', 'project_id', 'created_at'),
     )
     
     def __repr__(self):
@@ -34,6 +36,7 @@ class SearchLog(db.Model):
             'id': self.id,
             'query_text': self.query_text,
             'user_id': self.user_id,
+            'project_id': self.project_id,
             'results_count': self.results_count,
             'created_at': self.created_at.isoformat() if self.created_at else None
         }
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""
+タグモデル
+knowledge_base.tags（JSON）を正規化したもの。JSON列は表示用の複製として残す
+"""
+
+from sqlalchemy import Index, UniqueConstraint
+from sqlalchemy.sql import func
+
+from . import db
+
+
+class Tag(db.Model):
+    """プロジェクト内のタグ"""
+    __tablename__ = 'tags'
+
+    id = db.Column(db.Integer, primary_key=True)
+    project_id = db.Column(db.Integer, db.ForeignKey('projects.id', ondelete='CASCADE'), nullable=False)
+    name = db.Column(db.String(50), nullable=False)
+    created_at = db.Column(db.DateTime, default=func.current_timestamp())
+
+    # リレーションシップ
+    project = db.relationship(
+        'Project',
+        backref=db.backref('tags', lazy='dynamic', cascade='all, delete-orphan')
+    )
+
+    # インデックス
+    __table_args__ = (
+        UniqueConstraint('project_id', 'name', name='uq_tag_project_name'),
+    )
+
+    def __repr__(self):
+        return f'<Tag {self.name}>'
+
+    def to_dict(self):
+        """辞書形式で返す"""
+        return {
+            'id': self.id,
+            'project_id': self.project_id,
+            'name': self.name
+        }
+
+
+class KnowledgeTag(db.Model):
+    """ナレッジとタグの対応（プロジェクト内のタグ絞り込み用にproject_idを複製して持つ）"""
+    __tablename__ = 'knowledge_tags'
+
+    knowledge_base_id = db.Column(
+        db.Integer,
+        db.ForeignKey('knowledge_base.id', ondelete='CASCADE'),
+        primary_key=True
+    )
+    tag_id = db.Column(db.Integer, db.ForeignKey('tags.id', ondelete='CASCADE'), primary_key=True)
+    project_id = db.Column(db.Integer, db.ForeignKey('projects.id', ondelete='CASCADE'), nullable=False)
+
+    # リレーションシップ
+    knowledge_base = db.relationship(
+        'KnowledgeBase',
+        backref=db.backref('tag_links', lazy='dynamic', cascade='all, delete-orphan')
+    )
+    tag = db.relationship(
+        'Tag',
+        backref=db.backref('knowledge_links', lazy='dynamic', cascade='all, delete-orphan')
+    )
+
+    # インデックス
+    __table_args__ = (
+        Index('idx_knowledge_tags_project_tag', 'project_id', 'tag_id', 'knowledge_base_id'),
+    )
+
+    def __repr__(self):
+        return f'<KnowledgeTag {self.knowledge_base_id}:{self.tag_id}>'
@@ -7,8 +7,6 @@ from datetime import datetime
 from flask_login import UserMixin
 from sqlalchemy import JSON, Text, Index, Table
 from sqlalchemy.sql import func
-import bcrypt
-
 from . import db
 
 
@@ -34,14 +32,16 @@ class User(UserMixin, db.Model):
         return f'<User {self.username}>'
     
     def set_password(self, password):
-        """パスワードをハッシュ化して保存"""
-        self.password_hash = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+        """パスワードをハッシュ化して保存（混雑時は PasswordHasherBusy）"""
+        from ..auth.passwords import get_password_hasher
+        self.password_hash = get_password_hasher().hash(password)
     
     def check_password(self, password):
-        """パスワードを検証"""
+        """パスワードを検証（混雑時は PasswordHasherBusy）"""
+        from ..auth.passwords import get_password_hasher
         if not self.password_hash:
             return False
-        return bcrypt.checkpw(password.encode('utf-8'), self.password_hash.encode('utf-8'))
+        return get_password_hasher().verify(password, self.password_hash)
     
     def to_dict(self):
         """辞書形式で返す"""
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""
+プロジェクトのメンバーシップキャッシュ
+ユーザーごとの {プロジェクトID: ロール} を、リクエスト内のメモとプロセス内の短いTTLのキャッシュの2段で持つ
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from flask import current_app, has_request_context, request
+
+from ..models import db, project_members
+
+# リクエスト内のメモを置くWSGI環境変数のキー
+_MEMO_KEY = 'app.project_roles'
+
+
+def _request_memo():
+    """リクエスト内のメモ（リクエスト外ではNone）"""
+    if not has_request_context():
+        return None
+    return request.environ.setdefault(_MEMO_KEY, {})
+
+
+class MembershipCache:
+    """ユーザーごとの {プロジェクトID: ロール} を短いTTLで保持するキャッシュ
+
+    ユーザー1人分の所属は1回のクエリでまとめて読み込み、同じリクエスト内では再利用する。
+    メンバーの追加・削除とプロジェクトの削除で該当するエントリを無効化する。
+    キャッシュはプロセスごとのため、他のワーカーでの変更は最大でTTL秒遅れて反映される。
+    """
+
+    def __init__(self, ttl=30, max_users=10000):
+        self.ttl = ttl
+        self.max_users = max_users
+        self._entries = OrderedDict()  # ユーザーID -> (期限, {プロジェクトID: ロール})
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def roles(self, user_id):
+        """ユーザーの {プロジェクトID: ロール} を返す（呼び出し側で変更しないこと）"""
+        memo = _request_memo()
+        if memo is not None and user_id in memo:
+            return memo[user_id]
+
+        roles = self._cached(user_id)
+        if roles is None:
+            generation = self._generation
+            roles = self._load(user_id)
+            self._store(user_id, roles, generation)
+        if memo is not None:
+            memo[user_id] = roles
+        return roles
+
+    def role(self, user_id, project_id):
+        """プロジェクトでのロール（メンバーでなければNone）"""
+        return self.roles(user_id).get(project_id)
+
+    def _cached(self, user_id):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            expires_at, roles = entry
+            if expires_at <= time.monotonic():
+                del self._entries[user_id]
+                return None
+            self._entries.move_to_end(user_id)
+            return roles
+
+    @staticmethod
+    def _load(user_id):
+        rows = db.session.execute(
+            db.select(project_members.c.project_id, project_members.c.role).where(
+                project_members.c.user_id == user_id
+            )
+        )
+        return {project_id: role for project_id, role in rows}
+
+    def _store(self, user_id, roles, generation):
+        with self._lock:
+            # 読み込み中に無効化があった場合は古い可能性があるので保存しない
+            if generation != self._generation or self.ttl <= 0:
+                return
+            self._entries[user_id] = (time.monotonic() + self.ttl, roles)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_users:
+                self._entries.popitem(last=False)
+
+    def invalidate_user(self, user_id):
+        """ユーザーのエントリを無効化（メンバーの追加・削除時）"""
+        with self._lock:
+            self._generation += 1
+            self._entries.pop(user_id, None)
+        memo = _request_memo()
+        if memo is not None:
+            memo.pop(user_id, None)
+
+    def invalidate_project(self, project_id):
+        """プロジェクトに所属するユーザーのエントリをすべて無効化（プロジェクト削除時）"""
+        with self._lock:
+            self._generation += 1
+            for user_id in [user_id for user_id, (_, roles) in self._entries.items() if project_id in roles]:
+                del self._entries[user_id]
+        memo = _request_memo()
+        if memo is not None:
+            for user_id in [user_id for user_id, roles in memo.items() if project_id in roles]:
+                del memo[user_id]
+
+    def clear(self):
+        """すべてのエントリを破棄"""
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+        memo = _request_memo()
+        if memo is not None:
+            memo.clear()
+
+
+def init_membership_cache(app):
+    """メンバーシップキャッシュを初期化"""
+    cache = MembershipCache(
+        ttl=app.config.get('MEMBERSHIP_CACHE_TTL', 30),
+        max_users=app.config.get('MEMBERSHIP_CACHE_MAX_USERS', 10000)
+    )
+    app.extensions['membership_cache'] = cache
+    return cache
+
+
+def get_membership_cache():
+    """現在のアプリケーションのメンバーシップキャッシュを取得"""
+    return current_app.extensions['membership_cache']
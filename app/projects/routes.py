@@ -8,7 +8,10 @@
 
 from flask import Blueprint, request, jsonify
 from flask_login import login_required, current_user
-from ..models import db, Project, ProjectInvitation, KnowledgeBase, project_members
+from ..models import db, Project, project_members
+from ..models.knowledge import KNOWLEDGE_FIELDS, KNOWLEDGE_SUMMARY_FIELDS
+from ..utils.pagination import parse_page_args
+from ..utils.validators import parse_fields
 from .services import ProjectService
 
 project_bp = Blueprint('project', __name__, url_prefix='/projects')
@@ -17,8 +20,12 @@ project_bp = Blueprint('project', __name__, url_prefix='/projects')
 @login_required
 def get_projects():
     """ユーザーのプロジェクト一覧を取得"""
-    projects = ProjectService.get_user_projects(current_user.id)
-    return jsonify({'projects': projects}), 200
+    limit, cursor, error = parse_page_args(request.args)
+    if error:
+        return jsonify({'error': error}), 400
+    
+    projects, next_cursor = ProjectService.get_user_projects(current_user.id, limit, cursor)
+    return jsonify({'projects': projects, 'next_cursor': next_cursor}), 200
 
 @project_bp.route('', methods=['POST'])
 @login_required
@@ -97,8 +104,7 @@ def delete_project(project_id):
     if project.owner_id != current_user.id:
         return jsonify({'error': 'プロジェクトを削除する権限がありません'}), 403
     
-    db.session.delete(project)
-    db.session.commit()
+    ProjectService.delete_project(project_id)
     
     return jsonify({'message': 'プロジェクトが削除されました'}), 200
 
@@ -183,10 +189,21 @@ def get_project_knowledge(project_id):
     if not ProjectService.check_user_permission(project_id, current_user.id):
         return jsonify({'error': 'このプロジェクトにアクセスする権限がありません'}), 403
     
-    knowledge_items = KnowledgeBase.query.filter_by(project_id=project_id).all()
+    limit, cursor, error = parse_page_args(request.args)
+    if error:
+        return jsonify({'error': error}), 400
+    fields, error = parse_fields(request.args.get('fields'), KNOWLEDGE_FIELDS, KNOWLEDGE_SUMMARY_FIELDS)
+    if error:
+        return jsonify({'error': error}), 400
+    
+    from ..knowledge.services import get_project_knowledge_bases
+    knowledge_items, next_cursor = get_project_knowledge_bases(
+        project_id, tag=request.args.get('tag'), limit=limit, cursor=cursor, fields=fields
+    )
     
     return jsonify({
-        'knowledge_items': [item.to_dict() for item in knowledge_items]
+        'knowledge_items': [item.to_dict(fields) for item in knowledge_items],
+        'next_cursor': next_cursor
     }), 200
 
 @project_bp.route('/<int:project_id>/invitations')
@@ -196,8 +213,13 @@ def get_project_invitations(project_id):
     if not ProjectService.check_user_permission(project_id, current_user.id, 'admin'):
         return jsonify({'error': '招待を確認する権限がありません'}), 403
     
-    invitations = ProjectInvitation.query.filter_by(project_id=project_id).all()
+    limit, cursor, error = parse_page_args(request.args)
+    if error:
+        return jsonify({'error': error}), 400
+    
+    invitations, next_cursor = ProjectService.get_project_invitations(project_id, limit, cursor)
     
     return jsonify({
-        'invitations': [inv.to_dict() for inv in invitations]
+        'invitations': [inv.to_dict() for inv in invitations],
+        'next_cursor': next_cursor
     }), 200
@@ -12,6 +12,8 @@ from flask import current_app, url_for
 from flask_mail import Message
 from ..models import db, Project, User, ProjectInvitation, project_members
 from ..email.services import mail
+from ..utils.pagination import keyset_paginate
+from .membership import get_membership_cache
 
 class ProjectService:
     """プロジェクトサービスクラス"""
@@ -58,6 +60,7 @@ class ProjectService:
             )
         )
         db.session.commit()
+        get_membership_cache().invalidate_user(user_id)
         return True, "メンバーが追加されました"
     
     @staticmethod
@@ -155,21 +158,28 @@ class ProjectService:
         if not success:
             return False, message
         
-        # 招待のステータスを更新
+        # 招待のステータスを更新（所属のキャッシュはadd_memberで無効化済み）
         invitation.status = 'accepted'
         db.session.commit()
         
         return True, "プロジェクトに参加しました"
     
     @staticmethod
-    def get_user_projects(user_id):
-        """ユーザーが参加しているプロジェクト一覧を取得"""
-        projects = db.session.query(Project, project_members.c.role).join(
+    def get_user_projects(user_id, limit=None, cursor=None):
+        """ユーザーが参加しているプロジェクト一覧を新しい順に1ページ分取得
+        
+        (プロジェクトの辞書のリスト, 次ページのカーソル) を返す。
+        """
+        query = db.session.query(Project, project_members.c.role).options(*Project.list_options()).join(
             project_members,
             Project.id == project_members.c.project_id
         ).filter(
             project_members.c.user_id == user_id
-        ).all()
+        )
+        projects, next_cursor = keyset_paginate(
+            query, Project.created_at, Project.id, limit, cursor,
+            key=lambda row: (row[0].created_at, row[0].id)
+        )
         
         return [
             {
@@ -177,27 +187,53 @@ class ProjectService:
                 'user_role': role
             }
             for project, role in projects
-        ]
+        ], next_cursor
+    
+    @staticmethod
+    def get_project_invitations(project_id, limit=None, cursor=None):
+        """プロジェクトの招待一覧を新しい順に1ページ分取得（(招待のリスト, 次ページのカーソル) を返す）"""
+        query = ProjectInvitation.query.options(*ProjectInvitation.list_options()).filter_by(project_id=project_id)
+        return keyset_paginate(query, ProjectInvitation.created_at, ProjectInvitation.id, limit, cursor)
+    
+    @staticmethod
+    def get_user_project_ids(user_id):
+        """ユーザーが参加しているプロジェクトIDの集合を取得（メンバーシップキャッシュから）"""
+        return set(get_membership_cache().roles(user_id))
     
     @staticmethod
     def check_user_permission(project_id, user_id, required_role='member'):
-        """ユーザーのプロジェクト権限をチェック"""
-        membership = db.session.execute(
-            project_members.select().where(
-                (project_members.c.project_id == project_id) &
-                (project_members.c.user_id == user_id)
-            )
-        ).first()
+        """ユーザーのプロジェクト権限をチェック
+        
+        所属はメンバーシップキャッシュから引くため、同じリクエスト内やTTL内の再確認ではDBを参照しない。
+        """
+        role = get_membership_cache().role(user_id, project_id)
         
-        if not membership:
+        if not role:
             return False
         
         role_hierarchy = {'member': 1, 'admin': 2, 'owner': 3}
-        user_level = role_hierarchy.get(membership.role, 0)
+        user_level = role_hierarchy.get(role, 0)
         required_level = role_hierarchy.get(required_role, 1)
         
         return user_level >= required_level
     
+    @staticmethod
+    def delete_project(project_id):
+        """プロジェクトを削除（ナレッジ・招待もカスケード削除）"""
+        from ..search import drop_project_indexes
+        
+        project = db.session.get(Project, project_id)
+        if not project:
+            return False
+        
+        db.session.delete(project)
+        db.session.commit()
+        get_membership_cache().invalidate_project(project_id)
+        
+        # カスケード削除されたナレッジの検索インデックスを破棄
+        drop_project_indexes(project_id)
+        return True
+    
     @staticmethod
     def remove_member(project_id, user_id, removed_by_id):
         """プロジェクトからメンバーを削除"""
@@ -221,5 +257,6 @@ class ProjectService:
             )
         )
         db.session.commit()
+        get_membership_cache().invalidate_user(user_id)
         
         return True, "メンバーが削除されました"
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""
+検索モジュール
+"""
+
+from .tokenizer import (
+    Tokenizer,
+    WordTokenizer,
+    NGramTokenizer,
+    MorphologicalTokenizer,
+    get_tokenizer,
+    normalize,
+    tokenize
+)
+from .index import InvertedIndex, SearchHit
+from .fulltext import FullTextSearchBackend
+from .engine import SearchEngine, init_search, get_search_engine, get_search_backend
+from .vector import (
+    HashingEncoder,
+    VectorIndex,
+    VectorSearchEngine,
+    get_encoder,
+    init_vector_search,
+    get_vector_search
+)
+from .chunker import Chunk, chunk_text, content_hash, count_tokens
+from .chunks import ChunkSearchEngine, chunk_key, split_chunk_key, init_chunk_search, get_chunk_search
+from .cache import (
+    QueryCache,
+    MemoryQueryCache,
+    SQLiteQueryCache,
+    make_cache_key,
+    normalize_query,
+    init_query_cache,
+    get_query_cache
+)
+from .suggest import PrefixTrie, SuggestIndex, suggest_key, init_suggest, get_suggest_index
+from .fuzzy import FuzzyIndex, SymSpellIndex, edit_distance, init_fuzzy, get_fuzzy_index
+from .crossproject import CrossProjectSearchEngine, init_cross_project_search, get_cross_project_search
+from .facets import FacetIndex, DocumentFilter, FACET_FIELDS, init_facets, get_facet_index
+from .highlight import highlight_terms, find_matches, densest_window, build_snippet
+from .hybrid import HybridSearcher, HybridHit, FUSION_METHODS, init_hybrid_search, get_hybrid_search
+from .generations import IndexGenerations, init_index_generations, get_index_generations
+from .hooks import (
+    index_knowledge,
+    unindex_knowledge,
+    index_knowledge_batch,
+    unindex_knowledge_batch,
+    drop_project_indexes,
+    rebuild_project_indexes,
+    sync_project_indexes,
+    sync_cross_project_index
+)
+
+__all__ = [
+    'InvertedIndex',
+    'SearchHit',
+    'Tokenizer',
+    'WordTokenizer',
+    'NGramTokenizer',
+    'MorphologicalTokenizer',
+    'get_tokenizer',
+    'normalize',
+    'tokenize',
+    'SearchEngine',
+    'init_search',
+    'FullTextSearchBackend',
+    'get_search_engine',
+    'get_search_backend',
+    'HashingEncoder',
+    'VectorIndex',
+    'VectorSearchEngine',
+    'get_encoder',
+    'init_vector_search',
+    'get_vector_search',
+    'Chunk',
+    'chunk_text',
+    'content_hash',
+    'count_tokens',
+    'ChunkSearchEngine',
+    'chunk_key',
+    'split_chunk_key',
+    'init_chunk_search',
+    'get_chunk_search',
+    'QueryCache',
+    'MemoryQueryCache',
+    'SQLiteQueryCache',
+    'make_cache_key',
+    'normalize_query',
+    'init_query_cache',
+    'get_query_cache',
+    'PrefixTrie',
+    'SuggestIndex',
+    'suggest_key',
+    'init_suggest',
+    'get_suggest_index',
+    'FuzzyIndex',
+    'SymSpellIndex',
+    'edit_distance',
+    'init_fuzzy',
+    'get_fuzzy_index',
+    'CrossProjectSearchEngine',
+    'init_cross_project_search',
+    'get_cross_project_search',
+    'FacetIndex',
+    'DocumentFilter',
+    'FACET_FIELDS',
+    'init_facets',
+    'get_facet_index',
+    'highlight_terms',
+    'find_matches',
+    'densest_window',
+    'build_snippet',
+    'HybridSearcher',
+    'HybridHit',
+    'FUSION_METHODS',
+    'init_hybrid_search',
+    'get_hybrid_search',
+    'IndexGenerations',
+    'init_index_generations',
+    'get_index_generations',
+    'index_knowledge',
+    'unindex_knowledge',
+    'index_knowledge_batch',
+    'unindex_knowledge_batch',
+    'drop_project_indexes',
+    'rebuild_project_indexes',
+    'sync_project_indexes',
+    'sync_cross_project_index'
+]
@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+"""
+検索結果キャッシュ
+(プロジェクト, 正規化したクエリ, モード, DB上の索引の世代) をキーに検索結果を保持する
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from flask import current_app
+
+from .tokenizer import normalize
+
+
+def normalize_query(query):
+    """キャッシュキー用にクエリを正規化（空白の連続も1つにまとめる）"""
+    return ' '.join(normalize(query).split())
+
+
+def make_cache_key(project_id, query, mode, generation, *options):
+    """キャッシュキーを作る（optionsにはlimitなど結果に影響する引数を渡す）"""
+    return json.dumps(
+        [project_id, normalize_query(query), mode, generation, *options],
+        ensure_ascii=False,
+        separators=(',', ':')
+    )
+
+
+class QueryCache:
+    """検索結果キャッシュの基底クラス
+
+    キーにはDB上のプロジェクトの世代番号（search_generations）を含める。どのワーカーで
+    書き込んでも世代が進むため、古い世代のエントリは全ワーカーで参照されなくなり、
+    LRUまたはTTLで追い出される。
+    """
+    name = None
+
+    def __init__(self, max_entries=1024, ttl=300):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._stats_lock = threading.Lock()
+
+    def get(self, key):
+        """キャッシュ済みの値（なければNone）"""
+        raise NotImplementedError
+
+    def set(self, key, value):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def __len__(self):
+        raise NotImplementedError
+
+    def _count(self, hits=0, misses=0, evictions=0):
+        with self._stats_lock:
+            self.hits += hits
+            self.misses += misses
+            self.evictions += evictions
+
+    def stats(self):
+        """ヒット・ミス・追い出しの件数（このワーカーでの集計）"""
+        lookups = self.hits + self.misses
+        return {
+            'backend': self.name,
+            'entries': len(self),
+            'max_entries': self.max_entries,
+            'ttl': self.ttl,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_ratio': round(self.hits / lookups, 4) if lookups else None
+        }
+
+
+class MemoryQueryCache(QueryCache):
+    """プロセス内のLRU/TTLキャッシュ（エントリはワーカーごとに持つ）"""
+    name = 'memory'
+
+    def __init__(self, max_entries=1024, ttl=300):
+        super().__init__(max_entries, ttl)
+        self._entries = OrderedDict()   # キー -> (有効期限, 値)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= now:
+                del self._entries[key]
+                entry = None
+                self._count(evictions=1)
+            if entry is None:
+                self._count(misses=1)
+                return None
+            self._entries.move_to_end(key)
+        self._count(hits=1)
+        return entry[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            evicted = 0
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                evicted += 1
+        if evicted:
+            self._count(evictions=evicted)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SQLiteQueryCache(QueryCache):
+    """ローカルのSQLiteファイルを共有するキャッシュ（同一ホストの複数ワーカーでエントリを共有する）"""
+    name = 'sqlite'
+
+    def __init__(self, path, max_entries=1024, ttl=300):
+        super().__init__(max_entries, ttl)
+        self.path = path
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as connection:
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS entries ('
+                'key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL, accessed_at REAL NOT NULL)'
+            )
+            connection.execute('CREATE INDEX IF NOT EXISTS idx_entries_accessed_at ON entries (accessed_at)')
+
+    def _connect(self):
+        """スレッドごとに接続を持つ"""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+        return connection
+
+    def get(self, key):
+        connection = self._connect()
+        now = time.time()
+        row = connection.execute('SELECT value, expires_at FROM entries WHERE key = ?', (key,)).fetchone()
+        if row is not None and row[1] <= now:
+            connection.execute('DELETE FROM entries WHERE key = ?', (key,))
+            row = None
+            self._count(evictions=1)
+        if row is None:
+            self._count(misses=1)
+            return None
+        connection.execute('UPDATE entries SET accessed_at = ? WHERE key = ?', (now, key))
+        self._count(hits=1)
+        return json.loads(row[0])
+
+    def set(self, key, value):
+        connection = self._connect()
+        now = time.time()
+        with connection:
+            connection.execute('BEGIN IMMEDIATE')
+            connection.execute(
+                'INSERT OR REPLACE INTO entries (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)',
+                (key, json.dumps(value, ensure_ascii=False), now + self.ttl, now)
+            )
+            overflow = connection.execute('SELECT COUNT(*) FROM entries').fetchone()[0] - self.max_entries
+            if overflow > 0:
+                connection.execute(
+                    'DELETE FROM entries WHERE key IN (SELECT key FROM entries ORDER BY accessed_at LIMIT ?)',
+                    (overflow,)
+                )
+                self._count(evictions=overflow)
+
+    def clear(self):
+        self._connect().execute('DELETE FROM entries')
+
+    def __len__(self):
+        return self._connect().execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+
+
+def init_query_cache(app):
+    """検索結果キャッシュを初期化（SEARCH_CACHE_BACKEND: memory / sqlite / none）"""
+    backend = app.config.get('SEARCH_CACHE_BACKEND', 'memory')
+    options = dict(
+        max_entries=app.config.get('SEARCH_CACHE_MAX_ENTRIES', 1024),
+        ttl=app.config.get('SEARCH_CACHE_TTL', 300)
+    )
+    if backend == 'memory':
+        cache = MemoryQueryCache(**options)
+    elif backend == 'sqlite':
+        path = app.config.get('SEARCH_CACHE_PATH') or os.path.join(app.instance_path, 'search_cache.sqlite3')
+        cache = SQLiteQueryCache(path, **options)
+    elif backend == 'none':
+        cache = None
+    else:
+        raise ValueError(f'不明な検索キャッシュです: {backend}')
+    app.extensions['query_cache'] = cache
+    return cache
+
+
+def get_query_cache():
+    """現在のアプリケーションの検索結果キャッシュを取得（無効ならNone）"""
+    return current_app.extensions.get('query_cache')
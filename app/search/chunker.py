@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""
+ナレッジ本文のチャンク分割
+見出しと段落の境界を優先し、トークン数の上限と重なりを指定して分割する
+"""
+
+import hashlib
+import re
+from collections import namedtuple
+
+# チャンク1つ分（start/endは本文中の文字オフセット）
+Chunk = namedtuple('Chunk', ['position', 'heading', 'start', 'end', 'token_count'])
+
+# Markdownの見出し行
+_HEADING_PATTERN = re.compile(r'^[ \t]*(#{1,6})[ \t]+(.+?)[ \t#]*$', re.MULTILINE)
+
+# 空行で区切られた段落
+_PARAGRAPH_BREAK = re.compile(r'\n[ \t]*\n')
+
+# 文末（句点・感嘆符・疑問符・改行）
+_SENTENCE_END = re.compile(r'[。．.!?！？]+[」』）)]*\s*|\n')
+
+# トークン数の見積もり：英数字は単語ごと、それ以外（日本語など）は1文字ごと
+_TOKEN_PATTERN = re.compile(r'[A-Za-z0-9_]+|[^\sA-Za-z0-9_]')
+
+
+def count_tokens(text):
+    """トークン数の概算"""
+    return len(_TOKEN_PATTERN.findall(text)) if text else 0
+
+
+def content_hash(content):
+    """本文のハッシュ（再チャンクが必要かの判定に使う）"""
+    return hashlib.sha256((content or '').encode('utf-8')).hexdigest()
+
+
+def _strip_span(text, start, end):
+    """前後の空白を除いた範囲を返す"""
+    while start < end and text[start].isspace():
+        start += 1
+    while end > start and text[end - 1].isspace():
+        end -= 1
+    return start, end
+
+
+def _sections(text):
+    """見出しごとの (見出し, 開始, 終了) を返す（見出し行自体は本文に含める）"""
+    headings = list(_HEADING_PATTERN.finditer(text))
+    if not headings or headings[0].start() > 0:
+        first = headings[0].start() if headings else len(text)
+        yield None, 0, first
+    for number, match in enumerate(headings):
+        end = headings[number + 1].start() if number + 1 < len(headings) else len(text)
+        yield match.group(2).strip(), match.start(), end
+
+
+def _split_spans(text, start, end, pattern):
+    """patternの直後で区切った部分範囲を返す"""
+    position = start
+    for match in pattern.finditer(text, start, end):
+        if match.end() > position:
+            yield position, match.end()
+            position = match.end()
+    if position < end:
+        yield position, end
+
+
+def _units(text, start, end, max_tokens):
+    """上限に収まる最小単位（段落→文→固定長）の (開始, 終了, トークン数) を返す"""
+    for paragraph_start, paragraph_end in _split_spans(text, start, end, _PARAGRAPH_BREAK):
+        paragraph_start, paragraph_end = _strip_span(text, paragraph_start, paragraph_end)
+        if paragraph_start == paragraph_end:
+            continue
+        tokens = count_tokens(text[paragraph_start:paragraph_end])
+        if tokens <= max_tokens:
+            yield paragraph_start, paragraph_end, tokens
+            continue
+
+        for sentence_start, sentence_end in _split_spans(text, paragraph_start, paragraph_end, _SENTENCE_END):
+            sentence_start, sentence_end = _strip_span(text, sentence_start, sentence_end)
+            if sentence_start == sentence_end:
+                continue
+            tokens = count_tokens(text[sentence_start:sentence_end])
+            if tokens <= max_tokens:
+                yield sentence_start, sentence_end, tokens
+                continue
+
+            # 1文が上限を超える場合はトークン境界で機械的に切る
+            matches = list(_TOKEN_PATTERN.finditer(text, sentence_start, sentence_end))
+            for offset in range(0, len(matches), max_tokens):
+                window = matches[offset:offset + max_tokens]
+                yield window[0].start(), window[-1].end(), len(window)
+
+
+def chunk_text(text, max_tokens=256, overlap_tokens=32):
+    """本文をチャンクに分割してChunkのリストを返す
+
+    見出しをまたいでチャンクを作らず、見出しの中では段落（長ければ文）単位で
+    max_tokensまで詰める。次のチャンクは直前のチャンク末尾のoverlap_tokens分の単位から始める。
+    """
+    if not text or not text.strip():
+        return []
+    if max_tokens < 1:
+        raise ValueError('max_tokensは1以上で指定してください')
+    overlap_tokens = min(max(overlap_tokens, 0), max_tokens - 1)
+
+    chunks = []
+    for heading, section_start, section_end in _sections(text):
+        units = list(_units(text, section_start, section_end, max_tokens))
+        first = 0
+        while first < len(units):
+            last = first
+            tokens = units[first][2]
+            while last + 1 < len(units) and tokens + units[last + 1][2] <= max_tokens:
+                last += 1
+                tokens += units[last][2]
+
+            chunks.append(Chunk(len(chunks), heading, units[first][0], units[last][1], tokens))
+            if last + 1 >= len(units):
+                break
+
+            # 重なり分だけ戻って次のチャンクを始める（必ず1単位以上は進める）
+            next_first = last + 1
+            overlap = 0
+            while next_first - 1 > first and overlap + units[next_first - 1][2] <= overlap_tokens:
+                next_first -= 1
+                overlap += units[next_first][2]
+            first = next_first
+    return chunks
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""
+チャンク単位の検索索引
+ナレッジ本文のチャンク（knowledge_chunks）をBM25で検索し、パッセージ取得に使う
+"""
+
+import os
+from flask import current_app
+from sqlalchemy import func
+
+from ..models import db
+from ..models.knowledge import KnowledgeBase, KnowledgeChunk
+from .engine import SearchEngine
+
+# 索引上の文書IDは (ナレッジID, チャンク番号) を1つの整数に詰めたもの
+CHUNK_KEY_BITS = 20
+_POSITION_MASK = (1 << CHUNK_KEY_BITS) - 1
+
+
+def chunk_key(kb_id, position):
+    """(ナレッジID, チャンク番号) から索引上の文書IDを作る"""
+    return (kb_id << CHUNK_KEY_BITS) | position
+
+
+def split_chunk_key(key):
+    """索引上の文書IDを (ナレッジID, チャンク番号) に戻す"""
+    return key >> CHUNK_KEY_BITS, key & _POSITION_MASK
+
+
+def _chunk_title(title, heading):
+    return f'{title} {heading}' if heading else title
+
+
+class ChunkSearchEngine(SearchEngine):
+    """チャンクを文書として扱う検索エンジン
+
+    タイトルにはナレッジのタイトルとチャンクの見出しを、本文にはチャンク本文を使う。
+    ナレッジ1件の更新は、そのナレッジの既存チャンクをすべて外してから載せ直す。
+    """
+
+    def _iter_documents(self, project_id):
+        rows = db.session.query(
+            KnowledgeChunk.knowledge_base_id,
+            KnowledgeChunk.position,
+            KnowledgeChunk.heading,
+            KnowledgeChunk.content,
+            KnowledgeBase.title,
+            KnowledgeBase.tags
+        ).join(
+            KnowledgeBase, KnowledgeBase.id == KnowledgeChunk.knowledge_base_id
+        ).filter(
+            KnowledgeBase.project_id == project_id
+        ).yield_per(self.build_batch_size)
+
+        for kb_id, position, heading, content, title, tags in rows:
+            yield chunk_key(kb_id, position), _chunk_title(title, heading), content, tags
+
+    def _count_documents(self, project_id):
+        return db.session.query(func.count(KnowledgeChunk.id)).join(
+            KnowledgeBase, KnowledgeBase.id == KnowledgeChunk.knowledge_base_id
+        ).filter(
+            KnowledgeBase.project_id == project_id
+        ).scalar()
+
+    def _replace(self, index, knowledge_base):
+        with index.batch():
+            self._remove_from(index, knowledge_base.id)
+            for chunk in knowledge_base.chunks.order_by(KnowledgeChunk.position):
+                index.add_document(
+                    chunk_key(knowledge_base.id, chunk.position),
+                    title=_chunk_title(knowledge_base.title, chunk.heading),
+                    content=chunk.content,
+                    tags=knowledge_base.tags
+                )
+
+    def _remove_from(self, index, kb_id):
+        # チャンク番号は0からの連番なので、見つからなくなるまで外す
+        removed = False
+        with index.batch():
+            position = 0
+            while chunk_key(kb_id, position) in index:
+                index.remove_document(chunk_key(kb_id, position))
+                removed = True
+                position += 1
+        return removed
+
+    def _project_dir(self, project_id):
+        return os.path.join(self.index_dir, 'chunks', f'project_{project_id}')
+
+
+def init_chunk_search(app):
+    """チャンク検索エンジンを初期化（本文検索と同じ索引設定を使う）"""
+    engine = ChunkSearchEngine(
+        k1=app.config.get('SEARCH_BM25_K1', 1.2),
+        b=app.config.get('SEARCH_BM25_B', 0.75),
+        build_batch_size=app.config.get('SEARCH_BUILD_BATCH_SIZE', 1000),
+        tokenizer=app.extensions['search_engine'].tokenizer,
+        compaction_ratio=app.config.get('SEARCH_COMPACTION_RATIO', 0.2),
+        compaction_min_tombstones=app.config.get('SEARCH_COMPACTION_MIN_TOMBSTONES', 100),
+        index_dir=app.config.get('SEARCH_INDEX_DIR'),
+        flush_threshold=app.config.get('SEARCH_FLUSH_THRESHOLD', 1),
+        merge_factor=app.config.get('SEARCH_MERGE_FACTOR', 8)
+    )
+    app.extensions['chunk_search'] = engine
+    return engine
+
+
+def get_chunk_search():
+    """現在のアプリケーションのチャンク検索エンジンを取得"""
+    return current_app.extensions['chunk_search']
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""
+プロジェクト横断検索
+全プロジェクトのナレッジを1つの索引に載せ、アクセスできるプロジェクトの集合で絞り込む
+"""
+
+import os
+from flask import current_app
+from sqlalchemy import func
+
+from ..models import db
+from ..models.knowledge import KnowledgeBase
+from ..utils.logger import get_logger
+from .engine import SearchEngine
+
+logger = get_logger(__name__)
+
+# 全プロジェクト分の索引のキー
+ALL_PROJECTS = 'all'
+# 永続化する索引のディレクトリ（プロジェクトの語を持たない以前の形式 all/ とは分ける）
+INDEX_DIRNAME = 'all_projects'
+
+
+def project_key(project_id):
+    """文書のプロジェクトを表す索引上の語（トークナイザが作らない \\x00 で始める）"""
+    return f'\x00project:{project_id}'
+
+
+class CrossProjectSearchEngine(SearchEngine):
+    """全プロジェクトのナレッジを1つの索引で持つ検索エンジン
+
+    各文書にプロジェクトを表す語（project_key()）を併せて載せ、検索ではアクセスできるプロジェクトの
+    語のポスティングを候補としてから、その文書だけをスコア計算する。プロジェクトの対応は索引自体に
+    入っているため、ディスクセグメントを開き直した後や他のワーカーの書き込みでも失われない。
+    ユーザーが何プロジェクトに所属していても、索引の走査は1回で済む。
+    """
+
+    def _iter_documents(self, project_id):
+        rows = db.session.query(
+            KnowledgeBase.id,
+            KnowledgeBase.title,
+            KnowledgeBase.content,
+            KnowledgeBase.tags,
+            KnowledgeBase.project_id
+        ).yield_per(self.build_batch_size)
+        for kb_id, title, content, tags, owner in rows:
+            yield kb_id, title, content, tags, (project_key(owner),)
+
+    def _count_documents(self, project_id):
+        return db.session.query(func.count(KnowledgeBase.id)).scalar()
+
+    def _project_dir(self, project_id):
+        return os.path.join(self.index_dir, INDEX_DIRNAME)
+
+    def _index_key(self, project_id):
+        return ALL_PROJECTS
+
+    def _replace(self, index, knowledge_base):
+        index.add_document(
+            knowledge_base.id,
+            title=knowledge_base.title,
+            content=knowledge_base.content,
+            tags=knowledge_base.tags,
+            keys=(project_key(knowledge_base.project_id),)
+        )
+
+    def search_projects(self, project_ids, query, limit=10, expansions=None):
+        """project_ids（集合）のいずれかに属するナレッジを横断検索してSearchHitのリストを返す"""
+        if not project_ids:
+            return []
+        index = self.get_index(ALL_PROJECTS)
+        return index.search(
+            query, limit, expansions,
+            within=[project_key(project_id) for project_id in set(project_ids)]
+        )
+
+    def drop_project(self, project_id):
+        """プロジェクト削除時にそのプロジェクトの文書だけを索引から外す"""
+        with self._lock:
+            index = self._get_index_for_write(ALL_PROJECTS)
+            if index is not None:
+                with index.batch():
+                    for kb_id in index.key_documents([project_key(project_id)]):
+                        self._remove_from(index, kb_id)
+            self._touch(ALL_PROJECTS)
+        if index is not None:
+            self._maybe_compact(ALL_PROJECTS, index)
+
+
+def init_cross_project_search(app):
+    """プロジェクト横断検索を初期化（本文検索と同じ索引設定を使う）"""
+    engine = CrossProjectSearchEngine(
+        k1=app.config.get('SEARCH_BM25_K1', 1.2),
+        b=app.config.get('SEARCH_BM25_B', 0.75),
+        build_batch_size=app.config.get('SEARCH_BUILD_BATCH_SIZE', 1000),
+        tokenizer=app.extensions['search_engine'].tokenizer,
+        compaction_ratio=app.config.get('SEARCH_COMPACTION_RATIO', 0.2),
+        compaction_min_tombstones=app.config.get('SEARCH_COMPACTION_MIN_TOMBSTONES', 100),
+        index_dir=app.config.get('SEARCH_INDEX_DIR'),
+        flush_threshold=app.config.get('SEARCH_FLUSH_THRESHOLD', 1),
+        merge_factor=app.config.get('SEARCH_MERGE_FACTOR', 8)
+    )
+    app.extensions['cross_project_search'] = engine
+    return engine
+
+
+def get_cross_project_search():
+    """現在のアプリケーションのプロジェクト横断検索エンジンを取得"""
+    return current_app.extensions['cross_project_search']
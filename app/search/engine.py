@@ -0,0 +1,343 @@
+# -*- coding: utf-8 -*-
+"""
+検索エンジン
+プロジェクト単位の転置インデックスを管理する
+"""
+
+import os
+import shutil
+import threading
+from datetime import datetime
+from flask import current_app
+from sqlalchemy import func
+
+from ..models import db
+from ..models.knowledge import KnowledgeBase
+from ..utils.logger import get_logger
+from .fulltext import FullTextSearchBackend
+from .index import InvertedIndex
+from .store import SegmentedIndex
+from .tokenizer import get_tokenizer
+
+logger = get_logger(__name__)
+
+
+class SearchEngine:
+    """プロジェクトごとの検索インデックスを保持するレジストリ
+
+    ナレッジの作成・更新・削除は該当文書のポスティングだけを差分反映する。
+    墓標が閾値を超えたインデックスはバックグラウンドで圧縮して差し替える。
+    index_dir を指定するとプロジェクトごとにディスクセグメントとして永続化し、
+    再起動後や他のワーカーはDBから再構築せずにセグメントを開くだけで済む。
+    メモリのみの索引はこのプロセスの書き込みしか反映しないため、検索の前に
+    sync_project_indexes() でDB上の世代番号を確認し、他のワーカーの書き込みがあれば
+    破棄して次の検索でDBから構築し直す。
+    """
+
+    def __init__(self, k1=1.2, b=0.75, build_batch_size=1000, tokenizer=None,
+                 compaction_ratio=0.2, compaction_min_tombstones=100,
+                 index_dir=None, flush_threshold=1, merge_factor=8):
+        self.k1 = k1
+        self.b = b
+        self.build_batch_size = build_batch_size
+        # 全プロジェクトで共有し、正規化キャッシュを使い回す
+        self.tokenizer = tokenizer or get_tokenizer()
+        self.compaction_ratio = compaction_ratio
+        self.compaction_min_tombstones = compaction_min_tombstones
+        self.index_dir = index_dir
+        self.flush_threshold = flush_threshold
+        self.merge_factor = merge_factor
+        self._indexes = {}
+        self._revisions = {}
+        self._indexed_at = {}
+        self._compacting = set()
+        self._lock = threading.RLock()
+
+    def get_index(self, project_id):
+        """プロジェクトのインデックスを取得（未構築ならDBから構築）"""
+        index = self._indexes.get(project_id)
+        if index is not None:
+            return index
+
+        with self._lock:
+            index = self._indexes.get(project_id)
+            if index is None:
+                index = self._build_index(project_id)
+                self._indexes[project_id] = index
+                self._indexed_at[project_id] = datetime.utcnow()
+            return index
+
+    def _iter_documents(self, project_id):
+        """プロジェクトの (ID, タイトル, 本文, タグ) をバッチで読み出す"""
+        return db.session.query(
+            KnowledgeBase.id,
+            KnowledgeBase.title,
+            KnowledgeBase.content,
+            KnowledgeBase.tags
+        ).filter(
+            KnowledgeBase.project_id == project_id
+        ).yield_per(self.build_batch_size)
+
+    def _count_documents(self, project_id):
+        """DB上の文書数（ディスクセグメントとの整合性確認に使う）"""
+        return db.session.query(func.count(KnowledgeBase.id)).filter(
+            KnowledgeBase.project_id == project_id
+        ).scalar()
+
+    def _replace(self, index, knowledge_base):
+        """ナレッジ1件分の文書を追加または置き換え"""
+        index.add_document(
+            knowledge_base.id,
+            title=knowledge_base.title,
+            content=knowledge_base.content,
+            tags=knowledge_base.tags
+        )
+
+    def _remove_from(self, index, kb_id):
+        """ナレッジ1件分の文書を索引から外す"""
+        return index.remove_document(kb_id)
+
+    def _project_dir(self, project_id):
+        return os.path.join(self.index_dir, f'project_{project_id}')
+
+    def _build_index(self, project_id):
+        """インデックスを開く（ディスクになければDBから構築）"""
+        if self.index_dir:
+            return self._open_segmented_index(project_id)
+
+        index = InvertedIndex(k1=self.k1, b=self.b, tokenizer=self.tokenizer)
+        for document in self._iter_documents(project_id):
+            index.add_document(*document)
+
+        logger.info(f"検索インデックス構築: プロジェクト {project_id} ({len(index)}件)")
+        return index
+
+    def _segment_options(self):
+        return dict(
+            k1=self.k1, b=self.b, tokenizer=self.tokenizer,
+            flush_threshold=self.flush_threshold, merge_factor=self.merge_factor
+        )
+
+    def _open_segmented_index(self, project_id):
+        """ディスクセグメントを開く。件数がDBと食い違う場合だけ再構築する"""
+        directory = self._project_dir(project_id)
+        options = self._segment_options()
+
+        if SegmentedIndex.exists(directory):
+            index = SegmentedIndex.open(directory, **options)
+            if len(index) == self._count_documents(project_id):
+                logger.info(f"検索インデックス読込: プロジェクト {project_id} (セグメント {len(index.segments)}個)")
+                return index
+            logger.warning(f"検索インデックスがDBと一致しないため再構築します: プロジェクト {project_id}")
+        else:
+            index = SegmentedIndex(directory, **options)
+
+        index.rebuild(self._iter_documents(project_id))
+        logger.info(f"検索インデックス構築: プロジェクト {project_id} ({len(index)}件)")
+        return index
+
+    def search(self, project_id, query, limit=10, expansions=None, doc_filter=None):
+        """プロジェクト内を検索してSearchHitのリストを返す
+
+        expansionsは {展開語: 重み}（あいまい検索で加える語）。
+        doc_filterは文書IDを受け取る述語（ファセットの絞り込み）。
+        """
+        return self.get_index(project_id).search(query, limit, expansions, doc_filter)
+
+    def matching_documents(self, project_id, query, expansions=None):
+        """クエリの語をどれか含むナレッジIDの集合（ファセットの件数用。スコアは計算しない）"""
+        return self.get_index(project_id).matching_documents(query, expansions)
+
+    def search_with_matches(self, project_id, query, limit=10, expansions=None, doc_filter=None):
+        """search() の結果と、クエリの語をどれか含むナレッジIDの集合（ファセットの件数用）を返す"""
+        hits = self.search(project_id, query, limit, expansions, doc_filter)
+        return hits, self.matching_documents(project_id, query, expansions)
+
+    def _index_key(self, project_id):
+        """ナレッジの書き込み先インデックスのキー（プロジェクトごとの索引ではプロジェクトID）"""
+        return project_id
+
+    def index_document(self, knowledge_base):
+        """ナレッジ1件のポスティングを追加または置き換え"""
+        project_id = self._index_key(knowledge_base.project_id)
+        with self._lock:
+            index = self._get_index_for_write(project_id)
+            if index is not None:
+                self._replace(index, knowledge_base)
+            self._touch(project_id)
+        if index is not None:
+            self._maybe_compact(project_id, index)
+
+    def remove_document(self, project_id, kb_id):
+        """ナレッジ1件を墓標化"""
+        project_id = self._index_key(project_id)
+        with self._lock:
+            index = self._get_index_for_write(project_id)
+            if index is not None:
+                self._remove_from(index, kb_id)
+            self._touch(project_id)
+        if index is not None:
+            self._maybe_compact(project_id, index)
+
+    def index_documents(self, knowledge_bases):
+        """複数のナレッジをまとめて反映（インデックスごとに1回のバッチで書き込む）"""
+        groups = {}
+        for knowledge_base in knowledge_bases:
+            groups.setdefault(self._index_key(knowledge_base.project_id), []).append(knowledge_base)
+        for project_id, documents in groups.items():
+            with self._lock:
+                index = self._get_index_for_write(project_id)
+                if index is not None:
+                    with index.batch():
+                        for knowledge_base in documents:
+                            self._replace(index, knowledge_base)
+                self._touch(project_id)
+            if index is not None:
+                self._maybe_compact(project_id, index)
+
+    def remove_documents(self, documents):
+        """複数のナレッジ（(プロジェクトID, ナレッジID) の組）をまとめて墓標化"""
+        groups = {}
+        for project_id, kb_id in documents:
+            groups.setdefault(self._index_key(project_id), []).append(kb_id)
+        for project_id, kb_ids in groups.items():
+            with self._lock:
+                index = self._get_index_for_write(project_id)
+                if index is not None:
+                    with index.batch():
+                        for kb_id in kb_ids:
+                            self._remove_from(index, kb_id)
+                self._touch(project_id)
+            if index is not None:
+                self._maybe_compact(project_id, index)
+
+    def _get_index_for_write(self, project_id):
+        """書き込み対象のインデックス（ロック内で呼ぶ）
+
+        メモリのみの場合、未構築のプロジェクトは次回検索時にDBから構築されるため何もしない。
+        永続化している場合はディスク上のセグメントにも反映する必要があるため開く。
+        """
+        index = self._indexes.get(project_id)
+        if index is not None or not self.index_dir:
+            return index
+
+        # 直後の書き込みで件数が揃うため、既存セグメントは件数検証なしで開く
+        directory = self._project_dir(project_id)
+        if SegmentedIndex.exists(directory):
+            index = SegmentedIndex.open(directory, **self._segment_options())
+            self._indexes[project_id] = index
+            return index
+        return self.get_index(project_id)
+
+    def drop_project(self, project_id):
+        """プロジェクト削除時にインデックスを破棄"""
+        with self._lock:
+            self._indexes.pop(project_id, None)
+            if self.index_dir:
+                shutil.rmtree(self._project_dir(project_id), ignore_errors=True)
+            self._touch(project_id)
+
+    def _touch(self, project_id):
+        """リビジョンを進める（ロック内で呼ぶ）"""
+        self._revisions[project_id] = self._revisions.get(project_id, 0) + 1
+        self._indexed_at[project_id] = datetime.utcnow()
+
+    def _maybe_compact(self, project_id, index):
+        """墓標が閾値を超えたらバックグラウンドで圧縮"""
+        if index.tombstone_count < self.compaction_min_tombstones:
+            return
+        if index.tombstone_ratio < self.compaction_ratio:
+            return
+
+        with self._lock:
+            if project_id in self._compacting:
+                return
+            self._compacting.add(project_id)
+
+        thread = threading.Thread(
+            target=self.compact,
+            args=(project_id,),
+            name=f'search-compaction-{project_id}',
+            daemon=True
+        )
+        thread.start()
+
+    def compact(self, project_id):
+        """インデックスを圧縮して差し替える
+
+        圧縮中の書き込みはロックで待たせ、検索は差し替え前のインデックスで続行する。
+        """
+        try:
+            with self._lock:
+                index = self._indexes.get(project_id)
+                if index is None:
+                    return
+                tombstones = index.tombstone_count
+                self._indexes[project_id] = index.compacted()
+            logger.info(f"検索インデックス圧縮: プロジェクト {project_id} (墓標 {tombstones}件を除去)")
+        finally:
+            with self._lock:
+                self._compacting.discard(project_id)
+
+    def status(self, project_id):
+        """インデックスの鮮度情報を返す"""
+        index = self._indexes.get(project_id)
+        indexed_at = self._indexed_at.get(project_id)
+        return {
+            'project_id': project_id,
+            'loaded': index is not None,
+            'revision': self._revisions.get(project_id, 0),
+            'documents': len(index) if index is not None else None,
+            'tombstones': index.tombstone_count if index is not None else None,
+            'segments': len(index.segments) if isinstance(index, SegmentedIndex) else None,
+            'last_indexed_at': indexed_at.isoformat() if indexed_at else None
+        }
+
+    def invalidate(self, project_id=None):
+        """インデックスを破棄（project_id省略時はすべて）"""
+        with self._lock:
+            if project_id is None:
+                self._indexes.clear()
+            else:
+                self._indexes.pop(project_id, None)
+
+
+def init_search(app):
+    """検索エンジンを初期化"""
+    engine = SearchEngine(
+        k1=app.config.get('SEARCH_BM25_K1', 1.2),
+        b=app.config.get('SEARCH_BM25_B', 0.75),
+        build_batch_size=app.config.get('SEARCH_BUILD_BATCH_SIZE', 1000),
+        tokenizer=get_tokenizer(
+            app.config.get('SEARCH_TOKENIZER', 'ngram'),
+            app.config.get('SEARCH_NGRAM_SIZES', (2, 3))
+        ),
+        compaction_ratio=app.config.get('SEARCH_COMPACTION_RATIO', 0.2),
+        compaction_min_tombstones=app.config.get('SEARCH_COMPACTION_MIN_TOMBSTONES', 100),
+        index_dir=app.config.get('SEARCH_INDEX_DIR'),
+        flush_threshold=app.config.get('SEARCH_FLUSH_THRESHOLD', 1),
+        merge_factor=app.config.get('SEARCH_MERGE_FACTOR', 8)
+    )
+    app.extensions['search_engine'] = engine
+
+    # 検索に使うバックエンド（インプロセスの転置インデックスまたはDBの全文検索）
+    backend_name = app.config.get('SEARCH_BACKEND', 'index')
+    if backend_name == 'index':
+        app.extensions['search_backend'] = engine
+    elif backend_name == 'fulltext':
+        app.extensions['search_backend'] = FullTextSearchBackend(
+            max_matches=app.config.get('SEARCH_FULLTEXT_MAX_MATCHES', 10000)
+        )
+    else:
+        raise ValueError(f'不明な検索バックエンドです: {backend_name}')
+    return engine
+
+
+def get_search_engine():
+    """現在のアプリケーションの検索エンジンを取得"""
+    return current_app.extensions['search_engine']
+
+
+def get_search_backend():
+    """設定で選択された検索バックエンドを取得"""
+    return current_app.extensions['search_backend']
@@ -0,0 +1,271 @@
+# -*- coding: utf-8 -*-
+"""
+ファセット（絞り込みと件数）
+カテゴリ・タグ・作成者・作成月ごとに、該当するナレッジの集合をビット集合で保持する
+"""
+
+import threading
+from datetime import datetime
+from flask import current_app
+
+from ..models import db
+from ..models.knowledge import KnowledgeBase
+from ..utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+# 絞り込み・件数集計に使うフィールド
+FACET_FIELDS = ('category', 'tag', 'author', 'created_month')
+
+
+def _month(value):
+    return value.strftime('%Y-%m') if value else None
+
+
+def popcount(bits):
+    """ビット集合の要素数（int.bit_count() はPython 3.10以降のため使わない）"""
+    return bin(bits).count('1')
+
+
+def iter_bits(bits):
+    """ビット集合の立っている位置を小さい順に返す"""
+    while bits:
+        lowest = bits & -bits
+        yield lowest.bit_length() - 1
+        bits ^= lowest
+
+
+class _ProjectFacets:
+    """プロジェクト1つ分のファセット
+
+    ナレッジIDをプロジェクト内の連番（ordinal）に割り当て、値ごとの集合をPythonの整数のビット集合で持つ。
+    削除で空いた連番は再利用するため、ビット集合の幅は文書数程度に収まる。
+    タグは大文字・小文字を区別せずcasefold()した値をキーにし、最初に現れた表記を表示に使う。
+    """
+
+    def __init__(self):
+        self.ordinals = {}      # ナレッジID -> ordinal
+        self.doc_ids = []       # ordinal -> ナレッジID（空きはNone）
+        self.free = []          # 再利用できるordinal
+        self.created = {}       # ordinal -> 作成日時
+        self.values = {field: {} for field in FACET_FIELDS}   # フィールド -> {値: ビット集合}
+        self.contributions = {}  # ナレッジID -> [(フィールド, 値)]
+        self.tag_labels = {}    # casefold()したタグ -> 表示する表記
+        self.live = 0
+
+    def add(self, kb_id, category, tags, author_id, created_at):
+        self.remove(kb_id)
+        ordinal = self.free.pop() if self.free else len(self.doc_ids)
+        if ordinal == len(self.doc_ids):
+            self.doc_ids.append(kb_id)
+        else:
+            self.doc_ids[ordinal] = kb_id
+        self.ordinals[kb_id] = ordinal
+        self.created[ordinal] = created_at
+        self.live |= 1 << ordinal
+
+        entries = [('category', category), ('author', author_id), ('created_month', _month(created_at))]
+        tags = [tag for tag in tags or [] if isinstance(tag, str) and tag]
+        entries.extend(('tag', tag) for tag in dict.fromkeys(tag.casefold() for tag in tags))
+        entries = [(field, value) for field, value in entries if value is not None and value != '']
+        for tag in tags:
+            self.tag_labels.setdefault(tag.casefold(), tag)
+        for field, value in entries:
+            values = self.values[field]
+            values[value] = values.get(value, 0) | (1 << ordinal)
+        self.contributions[kb_id] = entries
+
+    def remove(self, kb_id):
+        ordinal = self.ordinals.pop(kb_id, None)
+        if ordinal is None:
+            return
+        mask = ~(1 << ordinal)
+        for field, value in self.contributions.pop(kb_id, []):
+            values = self.values[field]
+            bits = values.get(value, 0) & mask
+            if bits:
+                values[value] = bits
+            else:
+                values.pop(value, None)
+                if field == 'tag':
+                    self.tag_labels.pop(value, None)
+        self.live &= mask
+        self.created.pop(ordinal, None)
+        self.doc_ids[ordinal] = None
+        self.free.append(ordinal)
+
+    def bits_for(self, kb_ids):
+        bits = 0
+        for kb_id in kb_ids:
+            ordinal = self.ordinals.get(kb_id)
+            if ordinal is not None:
+                bits |= 1 << ordinal
+        return bits
+
+    def date_bits(self, start=None, end=None):
+        """作成日時が [start, end) に入る文書の集合
+
+        範囲に完全に含まれる月は月ごとの集合をそのまま使い、端の月だけ文書ごとに日時を比べる。
+        """
+        first, last = _month(start), _month(end)
+        bits = 0
+        for month, month_bits in self.values['created_month'].items():
+            if (first and month < first) or (last and month > last):
+                continue
+            if month != first and month != last:
+                bits |= month_bits
+                continue
+            for ordinal in iter_bits(month_bits):
+                created = self.created[ordinal]
+                if (start is None or created >= start) and (end is None or created < end):
+                    bits |= 1 << ordinal
+        return bits
+
+
+class DocumentFilter:
+    """絞り込み条件に一致するナレッジの集合（検索中の判定に使う）"""
+
+    def __init__(self, facets, bits):
+        self._ordinals = facets.ordinals
+        self.bits = bits
+
+    def __call__(self, kb_id):
+        ordinal = self._ordinals.get(kb_id)
+        return ordinal is not None and (self.bits >> ordinal) & 1 == 1
+
+    def __len__(self):
+        return popcount(self.bits)
+
+
+class FacetIndex:
+    """プロジェクトごとのファセットを保持するレジストリ
+
+    件数はリクエストごとにDBでGROUP BYせず、一致した文書の集合と値ごとの集合の
+    論理積の立っているビット数で数える。
+    """
+
+    def __init__(self, size=10):
+        self.size = size
+        self._projects = {}
+        self._lock = threading.RLock()
+
+    def get_facets(self, project_id):
+        """プロジェクトのファセットを取得（未構築ならDBから構築）"""
+        facets = self._projects.get(project_id)
+        if facets is not None:
+            return facets
+
+        with self._lock:
+            facets = self._projects.get(project_id)
+            if facets is None:
+                facets = self._build(project_id)
+                self._projects[project_id] = facets
+            return facets
+
+    def _build(self, project_id):
+        facets = _ProjectFacets()
+        rows = db.session.query(
+            KnowledgeBase.id,
+            KnowledgeBase.category,
+            KnowledgeBase.tags,
+            KnowledgeBase.created_by_id,
+            KnowledgeBase.created_at
+        ).filter(
+            KnowledgeBase.project_id == project_id
+        ).order_by(
+            KnowledgeBase.id
+        ).yield_per(1000)
+        for kb_id, category, tags, author_id, created_at in rows:
+            facets.add(kb_id, category, tags, author_id, created_at)
+        logger.info(f"ファセット構築: プロジェクト {project_id} ({len(facets.ordinals)}件)")
+        return facets
+
+    def filter(self, project_id, filters):
+        """絞り込み条件からDocumentFilterを作る（条件がなければNone）
+
+        filtersは {'category': [...], 'tag': [...], 'author': [...], 'created_from': datetime, 'created_to': datetime}。
+        同じフィールド内の値はOR、フィールド間はANDで組み合わせる。created_toは含まない。
+        タグは大文字・小文字を区別しない。
+        """
+        if not filters or not any(value is not None and value != [] for value in filters.values()):
+            return None
+
+        facets = self.get_facets(project_id)
+        with self._lock:
+            bits = facets.live
+            for field in ('category', 'tag', 'author'):
+                values = filters.get(field)
+                if not values:
+                    continue
+                field_bits = 0
+                for value in values:
+                    if field == 'tag' and isinstance(value, str):
+                        value = value.casefold()
+                    field_bits |= facets.values[field].get(value, 0)
+                bits &= field_bits
+            start, end = filters.get('created_from'), filters.get('created_to')
+            if start is not None or end is not None:
+                bits &= facets.date_bits(start, end)
+            return DocumentFilter(facets, bits)
+
+    def counts(self, project_id, kb_ids=None, size=None, doc_filter=None):
+        """一致した文書についてフィールドごとの値と件数を件数の多い順に返す
+
+        kb_idsを省略するとプロジェクトの全文書を対象にし、doc_filterを渡すとその集合に限る。
+        """
+        size = size or self.size
+        facets = self.get_facets(project_id)
+        with self._lock:
+            matched = facets.live if kb_ids is None else facets.bits_for(kb_ids)
+            if doc_filter is not None:
+                matched &= doc_filter.bits
+            counts = {}
+            for field in FACET_FIELDS:
+                entries = []
+                if matched:
+                    for value, bits in facets.values[field].items():
+                        count = popcount(matched & bits)
+                        if count:
+                            if field == 'tag':
+                                value = facets.tag_labels.get(value, value)
+                            entries.append((value, count))
+                entries.sort(key=lambda entry: (-entry[1], str(entry[0])))
+                counts[field] = [{'value': value, 'count': count} for value, count in entries[:size]]
+            return counts
+
+    def index_document(self, knowledge_base):
+        """ナレッジの作成・更新を反映（未構築のプロジェクトは次回構築時に読み込む）"""
+        with self._lock:
+            facets = self._projects.get(knowledge_base.project_id)
+            if facets is not None:
+                facets.add(
+                    knowledge_base.id,
+                    knowledge_base.category,
+                    knowledge_base.tags,
+                    knowledge_base.created_by_id,
+                    knowledge_base.created_at or datetime.utcnow()
+                )
+
+    def remove_document(self, project_id, kb_id):
+        """ナレッジの削除を反映"""
+        with self._lock:
+            facets = self._projects.get(project_id)
+            if facets is not None:
+                facets.remove(kb_id)
+
+    def drop_project(self, project_id):
+        """プロジェクト削除時にファセットを破棄"""
+        with self._lock:
+            self._projects.pop(project_id, None)
+
+
+def init_facets(app):
+    """ファセットを初期化"""
+    index = FacetIndex(size=app.config.get('SEARCH_FACET_SIZE', 10))
+    app.extensions['facet_index'] = index
+    return index
+
+
+def get_facet_index():
+    """現在のアプリケーションのファセットインデックスを取得"""
+    return current_app.extensions['facet_index']
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""
+DB側の全文検索バックエンド
+MySQLはngramパーサのFULLTEXT索引、SQLiteはFTS5の影テーブルを使う
+"""
+
+from sqlalchemy import text
+
+from ..models import db
+from .index import SearchHit
+
+# MATCH ... AGAINST は自然言語モードで使う（演算子を解釈しないのでエスケープ不要）
+_MYSQL_QUERY = text(
+    'SELECT id, MATCH(title, content) AGAINST(:query IN NATURAL LANGUAGE MODE) AS score '
+    'FROM knowledge_base '
+    'WHERE project_id = :project_id '
+    'AND MATCH(title, content) AGAINST(:query IN NATURAL LANGUAGE MODE) '
+    'ORDER BY score DESC LIMIT :limit'
+)
+
+# bm25() は小さいほど良いスコアなので符号を反転する（タイトルの重みを3倍）
+_SQLITE_QUERY = text(
+    'SELECT kb.id AS id, -bm25(knowledge_base_fts, 3.0, 1.0) AS score '
+    'FROM knowledge_base_fts '
+    'JOIN knowledge_base AS kb ON kb.id = knowledge_base_fts.rowid '
+    'WHERE knowledge_base_fts MATCH :query AND kb.project_id = :project_id '
+    'ORDER BY score DESC LIMIT :limit'
+)
+
+# trigramトークナイザは3文字未満の語に一致しない
+_SQLITE_MIN_TERM_LENGTH = 3
+
+
+def build_fts5_query(query):
+    """空白区切りの語をFTS5のフレーズとしてOR結合する"""
+    phrases = [
+        '"' + term.replace('"', '""') + '"'
+        for term in query.split()
+        if len(term) >= _SQLITE_MIN_TERM_LENGTH
+    ]
+    return ' OR '.join(phrases)
+
+
+class FullTextSearchBackend:
+    """DBの全文検索索引を使う検索バックエンド
+
+    SearchEngineと同じ search(project_id, query, limit, expansions) を提供する。
+    索引はDB側でトリガーやFULLTEXT索引により同期されるため、差分更新は不要。
+    絞り込みやファセットの件数のために受け取る行は、スコアの高い順にmax_matches件までとする。
+    """
+
+    def __init__(self, max_matches=10000):
+        self.max_matches = max_matches
+
+    def search(self, project_id, query, limit=10, expansions=None, doc_filter=None):
+        """プロジェクト内を検索してSearchHitのリストを返す
+
+        expansions（あいまい検索の展開語）はクエリにOR条件として加える。DB側では重みは反映できない。
+        doc_filterを渡した場合は一致した行をmax_matches件まで受け取り、述語に一致するものから上位limit件を返す。
+        """
+        hits = self._match(project_id, query, limit if doc_filter is None else self.max_matches, expansions)
+        if doc_filter is not None:
+            hits = [hit for hit in hits if doc_filter(hit.doc_id)][:limit]
+        return hits
+
+    def search_with_matches(self, project_id, query, limit=10, expansions=None, doc_filter=None):
+        """search() の結果と一致したナレッジIDの集合（ファセットの件数用）を1回のMATCHで返す
+
+        一致した行はmax_matches件まで受け取り、上位limit件をその中から選ぶ。
+        """
+        matches = self._match(project_id, query, self.max_matches, expansions)
+        hits = matches if doc_filter is None else [hit for hit in matches if doc_filter(hit.doc_id)]
+        return hits[:limit], {hit.doc_id for hit in matches}
+
+    def matching_documents(self, project_id, query, expansions=None):
+        """全文検索索引に一致するナレッジIDの集合（ファセットの件数用。max_matches件まで）"""
+        return {hit.doc_id for hit in self._match(project_id, query, self.max_matches, expansions)}
+
+    def _match(self, project_id, query, limit, expansions=None):
+        """スコアの高い順に上位limit件のSearchHitを返す"""
+        if expansions:
+            query = ' '.join([query, *expansions])
+        dialect = db.session.get_bind().dialect.name
+        if dialect == 'mysql':
+            statement, query_text = _MYSQL_QUERY, query
+        elif dialect == 'sqlite':
+            statement, query_text = _SQLITE_QUERY, build_fts5_query(query)
+            if not query_text:
+                return []
+        else:
+            raise ValueError(f'全文検索に対応していないデータベースです: {dialect}')
+
+        rows = db.session.execute(statement, {
+            'query': query_text,
+            'project_id': project_id,
+            'limit': limit
+        })
+        return [SearchHit(row.id, float(row.score)) for row in rows]
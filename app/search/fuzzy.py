@@ -0,0 +1,337 @@
+# -*- coding: utf-8 -*-
+"""
+あいまい検索（語の展開）と「もしかして」
+カタカナ語と英数字の語を語彙辞書に集め、SymSpell方式の削除索引で編集距離の近い語を引く
+"""
+
+import re
+import threading
+import unicodedata
+from collections import Counter
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import func
+
+from ..models import db
+from ..models.knowledge import KnowledgeBase
+from ..models.search_log import SearchLog
+from ..utils.logger import get_logger
+from .tokenizer import normalize
+
+logger = get_logger(__name__)
+
+# 表記揺れ・綴り間違いの多い語（NFKC正規化後のカタカナ語と英数字の語）
+_WORD_PATTERN = re.compile(r'[ァ-ヺー]{2,}|[a-zA-Z][a-zA-Z0-9]{2,}')
+
+
+def extract_words(text):
+    """本文から語彙辞書に載せる語の (開始, 終了, 表記) を返す（位置はNFKC正規化後の文字列上）"""
+    if not text:
+        return []
+    text = unicodedata.normalize('NFKC', text)
+    return [(match.start(), match.end(), match.group()) for match in _WORD_PATTERN.finditer(text)]
+
+
+def edit_distance(source, target, max_distance):
+    """隣接文字の入れ替えを1操作と数える編集距離（max_distanceを超えたらmax_distance + 1）"""
+    if source == target:
+        return 0
+    if abs(len(source) - len(target)) > max_distance:
+        return max_distance + 1
+
+    previous2 = None
+    previous = list(range(len(target) + 1))
+    for i, source_char in enumerate(source, start=1):
+        current = [i] + [0] * len(target)
+        row_min = i
+        for j, target_char in enumerate(target, start=1):
+            cost = 0 if source_char == target_char else 1
+            value = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if (previous2 is not None and i > 1 and j > 1
+                    and source_char == target[j - 2] and source[i - 2] == target_char):
+                value = min(value, previous2[j - 2] + 1)
+            current[j] = value
+            row_min = min(row_min, value)
+        if row_min > max_distance:
+            return max_distance + 1
+        previous2, previous = previous, current
+    return min(previous[-1], max_distance + 1)
+
+
+def max_distance_for(term):
+    """語の長さに応じた許容編集距離（短い語は誤展開が多いので展開しない）"""
+    if len(term) < 4:
+        return 0
+    if len(term) < 8:
+        return 1
+    return 2
+
+
+class SymSpellIndex:
+    """削除索引による近似語の検索
+
+    語の先頭prefix_length文字から最大max_distance文字を削除した文字列をキーに語を引けるようにしておき、
+    問い合わせ語にも同じ削除を施して候補を集め、最後に編集距離で絞り込む。
+    """
+
+    def __init__(self, max_distance=2, prefix_length=7):
+        self.max_distance = max_distance
+        self.prefix_length = prefix_length
+        self.counts = Counter()
+        self._deletes = {}
+
+    def __len__(self):
+        return len(self.counts)
+
+    def __contains__(self, term):
+        return term in self.counts
+
+    def _variants(self, term):
+        prefix = term[:self.prefix_length]
+        variants = {prefix}
+        frontier = {prefix}
+        for _ in range(self.max_distance):
+            frontier = {
+                variant[:position] + variant[position + 1:]
+                for variant in frontier
+                for position in range(len(variant))
+            } - variants
+            variants |= frontier
+        return variants
+
+    def add(self, term, count=1):
+        """語の出現回数を増減する（0以下になった語は取り除く）"""
+        if not term:
+            return
+        new_count = self.counts[term] + count
+        if new_count > 0:
+            if term not in self.counts or not self.counts[term]:
+                for variant in self._variants(term):
+                    self._deletes.setdefault(variant, set()).add(term)
+            self.counts[term] = new_count
+        elif term in self.counts:
+            del self.counts[term]
+            for variant in self._variants(term):
+                terms = self._deletes.get(variant)
+                if terms is not None:
+                    terms.discard(term)
+                    if not terms:
+                        del self._deletes[variant]
+
+    def lookup(self, term, max_distance=None, limit=3):
+        """近い語を (語, 距離, 出現回数) のリストで、距離の小さい順・出現回数の多い順に返す"""
+        max_distance = self.max_distance if max_distance is None else min(max_distance, self.max_distance)
+        candidates = set()
+        for variant in self._variants(term):
+            candidates |= self._deletes.get(variant, set())
+
+        matches = []
+        for candidate in candidates:
+            if candidate == term or abs(len(candidate) - len(term)) > max_distance:
+                continue
+            distance = edit_distance(term, candidate, max_distance)
+            if distance <= max_distance:
+                matches.append((candidate, distance, self.counts[candidate]))
+        matches.sort(key=lambda match: (match[1], -match[2], match[0]))
+        return matches[:limit]
+
+
+class _Vocabulary:
+    """プロジェクト1つ分の語彙辞書と検索履歴"""
+
+    def __init__(self, max_distance, prefix_length):
+        self.terms = SymSpellIndex(max_distance, prefix_length)
+        self.queries = SymSpellIndex(max_distance, prefix_length)
+        self.labels = {}          # 正規化した語 -> 表記
+        self.query_labels = {}    # 正規化したクエリ -> 表記
+        self.contributions = {}   # ナレッジID -> Counter(正規化した語)
+
+
+class FuzzyIndex:
+    """プロジェクトごとの語彙辞書を保持し、語の展開と「もしかして」を提供する
+
+    語彙はナレッジのタイトル・本文・タグから集め、ナレッジの更新では差分だけを反映する。
+    検索履歴は結果が1件以上あったクエリの回数を持つ。
+    """
+
+    def __init__(self, max_distance=2, prefix_length=7, max_expansions=3, penalty=0.5,
+                 query_days=90, max_queries=1000):
+        self.max_distance = max_distance
+        self.prefix_length = prefix_length
+        self.max_expansions = max_expansions
+        self.penalty = penalty
+        self.query_days = query_days
+        self.max_queries = max_queries
+        self._vocabularies = {}
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def _document_words(title, content, tags):
+        words = Counter()
+        labels = {}
+        for value in (title, content, ' '.join(tag for tag in tags or [] if isinstance(tag, str))):
+            for _, _, surface in extract_words(value):
+                term = normalize(surface)
+                words[term] += 1
+                labels.setdefault(term, surface)
+        return words, labels
+
+    def _apply(self, vocabulary, words, sign=1):
+        for term, count in words.items():
+            vocabulary.terms.add(term, sign * count)
+            if term not in vocabulary.terms:
+                vocabulary.labels.pop(term, None)
+
+    def get_vocabulary(self, project_id):
+        """プロジェクトの語彙辞書を取得（未構築ならDBから構築）"""
+        vocabulary = self._vocabularies.get(project_id)
+        if vocabulary is not None:
+            return vocabulary
+
+        with self._lock:
+            vocabulary = self._vocabularies.get(project_id)
+            if vocabulary is None:
+                vocabulary = self._build(project_id)
+                self._vocabularies[project_id] = vocabulary
+            return vocabulary
+
+    def _build(self, project_id):
+        vocabulary = _Vocabulary(self.max_distance, self.prefix_length)
+        rows = db.session.query(
+            KnowledgeBase.id, KnowledgeBase.title, KnowledgeBase.content, KnowledgeBase.tags
+        ).filter(
+            KnowledgeBase.project_id == project_id
+        ).yield_per(1000)
+        for kb_id, title, content, tags in rows:
+            words, labels = self._document_words(title, content, tags)
+            vocabulary.contributions[kb_id] = words
+            self._apply(vocabulary, words)
+            for term, label in labels.items():
+                vocabulary.labels.setdefault(term, label)
+
+        since = datetime.utcnow() - timedelta(days=self.query_days)
+        queries = db.session.query(
+            SearchLog.query_text, func.count(SearchLog.id)
+        ).filter(
+            SearchLog.project_id == project_id,
+            SearchLog.results_count > 0,
+            SearchLog.created_at >= since
+        ).group_by(
+            SearchLog.query_text
+        ).order_by(
+            func.count(SearchLog.id).desc()
+        ).limit(self.max_queries)
+        for query_text, count in queries:
+            self._add_query(vocabulary, query_text, count)
+
+        logger.info(f"語彙辞書構築: プロジェクト {project_id} ({len(vocabulary.terms)}語)")
+        return vocabulary
+
+    @staticmethod
+    def _add_query(vocabulary, query_text, count=1):
+        key = ' '.join(normalize(query_text).split())
+        if key:
+            vocabulary.queries.add(key, count)
+            vocabulary.query_labels.setdefault(key, query_text.strip())
+
+    def expand(self, project_id, query):
+        """語彙辞書にない語を近い語に展開し、{展開語の表記: 重み} を返す
+
+        重みは penalty ** 編集距離。1語あたりの展開数は max_expansions までに抑える。
+        """
+        vocabulary = self.get_vocabulary(project_id)
+        expansions = {}
+        for _, _, surface in extract_words(query):
+            term = normalize(surface)
+            distance = min(max_distance_for(term), self.max_distance)
+            if not distance or term in vocabulary.terms:
+                continue
+            for candidate, candidate_distance, _ in vocabulary.terms.lookup(term, distance, self.max_expansions):
+                label = vocabulary.labels.get(candidate, candidate)
+                weight = self.penalty ** candidate_distance
+                expansions[label] = max(expansions.get(label, 0.0), weight)
+        return expansions
+
+    def did_you_mean(self, project_id, query):
+        """修正候補のクエリを返す（なければNone）
+
+        結果のあった過去のクエリに近いものがあればそれを優先し、
+        なければ語彙辞書にない語を最も近い語に置き換える。
+        """
+        vocabulary = self.get_vocabulary(project_id)
+        key = ' '.join(normalize(query).split())
+        if not key or key in vocabulary.queries:
+            return None
+
+        matches = vocabulary.queries.lookup(key, max_distance_for(key.replace(' ', '')), 1)
+        if matches:
+            return vocabulary.query_labels.get(matches[0][0], matches[0][0])
+
+        text = unicodedata.normalize('NFKC', query)
+        corrected = []
+        position = 0
+        for start, end, surface in extract_words(text):
+            term = normalize(surface)
+            distance = min(max_distance_for(term), self.max_distance)
+            if not distance or term in vocabulary.terms:
+                continue
+            matches = vocabulary.terms.lookup(term, distance, 1)
+            if matches:
+                corrected.append(text[position:start])
+                corrected.append(vocabulary.labels.get(matches[0][0], matches[0][0]))
+                position = end
+        if not corrected:
+            return None
+        corrected.append(text[position:])
+        return ''.join(corrected)
+
+    def index_document(self, knowledge_base):
+        """ナレッジの作成・更新を差分で反映（未構築のプロジェクトは次回構築時に読み込む）"""
+        with self._lock:
+            vocabulary = self._vocabularies.get(knowledge_base.project_id)
+            if vocabulary is None:
+                return
+            self._apply(vocabulary, vocabulary.contributions.pop(knowledge_base.id, Counter()), sign=-1)
+            words, labels = self._document_words(knowledge_base.title, knowledge_base.content, knowledge_base.tags)
+            vocabulary.contributions[knowledge_base.id] = words
+            self._apply(vocabulary, words)
+            for term, label in labels.items():
+                vocabulary.labels.setdefault(term, label)
+
+    def remove_document(self, project_id, kb_id):
+        """ナレッジの削除を反映"""
+        with self._lock:
+            vocabulary = self._vocabularies.get(project_id)
+            if vocabulary is not None:
+                self._apply(vocabulary, vocabulary.contributions.pop(kb_id, Counter()), sign=-1)
+
+    def record_query(self, project_id, query):
+        """結果のあった検索クエリを履歴に加える"""
+        with self._lock:
+            vocabulary = self._vocabularies.get(project_id)
+            if vocabulary is not None:
+                self._add_query(vocabulary, query)
+
+    def drop_project(self, project_id):
+        """プロジェクト削除時に語彙辞書を破棄"""
+        with self._lock:
+            self._vocabularies.pop(project_id, None)
+
+
+def init_fuzzy(app):
+    """あいまい検索を初期化"""
+    index = FuzzyIndex(
+        max_distance=app.config.get('SEARCH_FUZZY_MAX_DISTANCE', 2),
+        prefix_length=app.config.get('SEARCH_FUZZY_PREFIX_LENGTH', 7),
+        max_expansions=app.config.get('SEARCH_FUZZY_MAX_EXPANSIONS', 3),
+        penalty=app.config.get('SEARCH_FUZZY_PENALTY', 0.5),
+        query_days=app.config.get('SEARCH_SUGGEST_QUERY_DAYS', 90),
+        max_queries=app.config.get('SEARCH_SUGGEST_MAX_QUERIES', 1000)
+    )
+    app.extensions['fuzzy_index'] = index
+    return index
+
+
+def get_fuzzy_index():
+    """現在のアプリケーションのあいまい検索インデックスを取得"""
+    return current_app.extensions['fuzzy_index']
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""
+検索索引の世代番号
+ナレッジの書き込みごとにDB上のプロジェクトの世代番号を進め、各ワーカーはメモリ上の索引が
+反映済みの世代と比べて、他のワーカーの書き込みがあれば索引を破棄してDBから構築し直す
+"""
+
+import threading
+from flask import current_app
+from sqlalchemy import func, select, update
+from sqlalchemy.exc import IntegrityError
+
+from ..models import db
+from ..models.search_generation import SearchGeneration
+
+
+def read_generation(project_id):
+    """DB上のプロジェクトの世代番号（書き込みがなければ0）"""
+    generation = db.session.execute(
+        select(SearchGeneration.generation).where(SearchGeneration.project_id == project_id)
+    ).scalar()
+    return generation or 0
+
+
+def read_total_generation():
+    """全プロジェクトの世代番号の合計（横断索引の世代。行は削除しないため単調に増える）"""
+    return db.session.execute(
+        select(func.coalesce(func.sum(SearchGeneration.generation), 0))
+    ).scalar()
+
+
+def bump_generation(project_id):
+    """DB上のプロジェクトの世代番号を進めてコミットし、進めた後の値を返す"""
+    statement = update(SearchGeneration).where(
+        SearchGeneration.project_id == project_id
+    ).values(generation=SearchGeneration.generation + 1)
+    if db.session.execute(statement).rowcount == 0:
+        try:
+            with db.session.begin_nested():
+                db.session.add(SearchGeneration(project_id=project_id, generation=1))
+        except IntegrityError:
+            # 他のワーカーが同時に最初の行を作った
+            db.session.execute(statement)
+    db.session.commit()
+    return read_generation(project_id)
+
+
+class IndexGenerations:
+    """このプロセスのメモリ上の索引が反映済みの世代番号
+
+    索引のキー（プロジェクトID、横断索引はその索引のキー）ごとに最後に確認した世代を覚えておき、
+    DB上の世代と食い違えば索引を破棄させる。
+    """
+
+    def __init__(self):
+        self._seen = {}
+        self._lock = threading.Lock()
+
+    def sync(self, key, generation, discard):
+        """世代が記録と違えば discard() で索引を破棄してから記録する（初めて確認するキーも破棄する）"""
+        with self._lock:
+            if self._seen.get(key) != generation:
+                discard()
+                self._seen[key] = generation
+
+    def advance(self, key, generation):
+        """このプロセスの書き込みで進めた世代を記録する
+
+        間に他のワーカーの書き込みがあった（1つ前の世代を見ていない）場合は記録せず、
+        次の sync() で索引を破棄させる。
+        """
+        with self._lock:
+            if self._seen.get(key) == generation - 1:
+                self._seen[key] = generation
+
+    def forget(self, key):
+        """記録を消す（索引への反映に失敗した時に呼び、次の sync() で索引を破棄させる）"""
+        with self._lock:
+            self._seen.pop(key, None)
+
+
+def init_index_generations(app):
+    """索引の世代番号の記録を初期化"""
+    generations = IndexGenerations()
+    app.extensions['index_generations'] = generations
+    return generations
+
+
+def get_index_generations():
+    """現在のアプリケーションの索引の世代番号の記録を取得"""
+    return current_app.extensions['index_generations']
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""
+検索結果のハイライトとスニペット
+チャンクの文字オフセットを使い、一致したチャンクの中だけを走査して最も一致の密な範囲を切り出す
+"""
+
+import unicodedata
+
+from .tokenizer import WordTokenizer, normalize
+
+_word_tokenizer = WordTokenizer()
+
+# 一致の走査を打ち切る件数（1件あたりの処理量を抑える）
+MAX_MATCHES = 64
+
+
+def highlight_terms(query, expansions=None):
+    """ハイライトする語（正規化済み）を長い順に返す"""
+    terms = set(_word_tokenizer(query))
+    for text in expansions or ():
+        terms.update(_word_tokenizer(text))
+    return sorted(terms, key=lambda term: (-len(term), term))
+
+
+def _is_combining(char):
+    # 半角の濁点・半濁点はNFKCで結合文字になる
+    return unicodedata.combining(unicodedata.normalize('NFKC', char)) != 0
+
+
+def _normalized_with_offsets(text):
+    """文字（と後続の結合文字）ごとに正規化し、正規化後の各文字の元の範囲 (開始, 終了) を返す"""
+    chars = []
+    offsets = []
+    position = 0
+    while position < len(text):
+        end = position + 1
+        while end < len(text) and _is_combining(text[end]):
+            end += 1
+        for normalized in normalize(text[position:end]):
+            chars.append(normalized)
+            offsets.append((position, end))
+        position = end
+    return ''.join(chars), offsets
+
+
+def _find_all(haystack, needle, spans, limit):
+    start = haystack.find(needle)
+    while start >= 0 and len(spans) < limit:
+        spans.append((start, start + len(needle)))
+        start = haystack.find(needle, start + len(needle))
+
+
+def find_matches(text, terms, limit=MAX_MATCHES):
+    """text中の語の出現位置を (開始, 終了) のリストで返す（重なりは結合する）
+
+    日本語の語がそのまま見つからない場合は、検索と同じく2文字ずつに分けて探す。
+    """
+    if not text or not terms:
+        return []
+    haystack, offsets = _normalized_with_offsets(text)
+
+    spans = []
+    for term in terms:
+        if len(spans) >= limit:
+            break
+        found = len(spans)
+        _find_all(haystack, term, spans, limit)
+        if len(spans) == found and len(term) > 2 and not term.isascii():
+            for position in range(len(term) - 1):
+                _find_all(haystack, term[position:position + 2], spans, limit)
+
+    merged = []
+    for start, end in sorted(spans):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return [(offsets[start][0], offsets[end - 1][1]) for start, end in merged]
+
+
+def densest_window(matches, text_length, window):
+    """一致が最も多く収まるwindow文字の範囲 (開始, 終了) を返す"""
+    if text_length <= window:
+        return 0, text_length
+    if not matches:
+        return 0, window
+
+    best_count, best_start = 0, 0
+    first = 0
+    for last, (_, end) in enumerate(matches):
+        while end - matches[first][0] > window:
+            first += 1
+        count = last - first + 1
+        if count > best_count:
+            best_count, best_start = count, matches[first][0]
+            best_end = end
+
+    # 一致の塊が窓の中央に来るように前後へ広げる
+    margin = (window - (best_end - best_start)) // 2
+    start = max(0, min(best_start - margin, text_length - window))
+    return start, start + window
+
+
+def build_snippet(text, base_offset, terms, window=160, max_highlights=10):
+    """text（本文のbase_offset文字目から始まる部分）からスニペットとハイライトを作る
+
+    オフセットはすべて本文全体での文字位置で返す。
+    """
+    matches = find_matches(text, terms)
+    start, end = densest_window(matches, len(text), window)
+    highlights = [
+        {'start': base_offset + match_start, 'end': base_offset + match_end}
+        for match_start, match_end in matches
+        if start <= match_start and match_end <= end
+    ][:max_highlights]
+    return {
+        'snippet': {
+            'text': text[start:end],
+            'start_offset': base_offset + start,
+            'end_offset': base_offset + end
+        },
+        'highlights': highlights
+    }
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+"""
+ナレッジの書き込みを各検索索引に反映するフック
+"""
+
+from contextlib import contextmanager
+
+from ..models import db
+from ..utils.logger import get_logger
+from .chunks import get_chunk_search
+from .crossproject import ALL_PROJECTS, get_cross_project_search
+from .engine import get_search_engine
+from .facets import get_facet_index
+from .fuzzy import get_fuzzy_index
+from .generations import bump_generation, get_index_generations, read_generation, read_total_generation
+from .suggest import get_suggest_index
+from .vector import get_vector_search
+
+logger = get_logger(__name__)
+
+
+def index_knowledge(knowledge_base):
+    """ナレッジの作成・更新を反映"""
+    with _reflecting([knowledge_base.project_id]):
+        get_search_engine().index_document(knowledge_base)
+        get_vector_search().index_document(knowledge_base)
+        get_chunk_search().index_document(knowledge_base)
+        get_cross_project_search().index_document(knowledge_base)
+        get_suggest_index().index_document(knowledge_base)
+        get_fuzzy_index().index_document(knowledge_base)
+        get_facet_index().index_document(knowledge_base)
+
+
+def unindex_knowledge(project_id, kb_id):
+    """ナレッジの削除を反映"""
+    with _reflecting([project_id]):
+        get_search_engine().remove_document(project_id, kb_id)
+        get_vector_search().remove_document(project_id, kb_id)
+        get_chunk_search().remove_document(project_id, kb_id)
+        get_cross_project_search().remove_document(project_id, kb_id)
+        get_suggest_index().remove_document(project_id, kb_id)
+        get_fuzzy_index().remove_document(project_id, kb_id)
+        get_facet_index().remove_document(project_id, kb_id)
+
+
+def index_knowledge_batch(knowledge_bases):
+    """複数のナレッジの作成・更新をまとめて反映（キャッシュの無効化はプロジェクトごとに1回）"""
+    if not knowledge_bases:
+        return
+    with _reflecting({knowledge_base.project_id for knowledge_base in knowledge_bases}):
+        get_search_engine().index_documents(knowledge_bases)
+        get_vector_search().index_documents(knowledge_bases)
+        get_chunk_search().index_documents(knowledge_bases)
+        get_cross_project_search().index_documents(knowledge_bases)
+        for index in (get_suggest_index(), get_fuzzy_index(), get_facet_index()):
+            for knowledge_base in knowledge_bases:
+                index.index_document(knowledge_base)
+
+
+def unindex_knowledge_batch(documents):
+    """複数のナレッジ（(プロジェクトID, ナレッジID) の組）の削除をまとめて反映"""
+    if not documents:
+        return
+    with _reflecting({project_id for project_id, _ in documents}):
+        get_search_engine().remove_documents(documents)
+        get_vector_search().remove_documents(documents)
+        get_chunk_search().remove_documents(documents)
+        get_cross_project_search().remove_documents(documents)
+        for index in (get_suggest_index(), get_fuzzy_index(), get_facet_index()):
+            for project_id, kb_id in documents:
+                index.remove_document(project_id, kb_id)
+
+
+def drop_project_indexes(project_id):
+    """プロジェクト削除時に索引を破棄"""
+    with _reflecting([project_id]):
+        get_search_engine().drop_project(project_id)
+        get_vector_search().drop_project(project_id)
+        get_chunk_search().drop_project(project_id)
+        get_cross_project_search().drop_project(project_id)
+        get_suggest_index().drop_project(project_id)
+        get_fuzzy_index().drop_project(project_id)
+        get_facet_index().drop_project(project_id)
+
+
+def rebuild_project_indexes(project_id):
+    """一括インポート後に索引を破棄し、永続化している索引はDBから1回で構築し直す
+
+    メモリのみの索引は次回の検索時に構築される。
+    """
+    drop_project_indexes(project_id)
+    with _reflecting([project_id]):
+        for engine in (get_search_engine(), get_chunk_search()):
+            if engine.index_dir:
+                engine.get_index(project_id)
+
+
+def sync_project_indexes(project_id):
+    """他のワーカーの書き込みでDB上の世代が進んでいれば、このプロセスのメモリ上の索引を破棄する
+
+    破棄した索引は次回の検索時にDBから構築される。ディスクセグメントの索引はmanifestで
+    他のワーカーの書き込みに追従するため破棄しない。DB上の世代番号を返す。
+    """
+    generation = read_generation(project_id)
+    get_index_generations().sync(project_id, generation, lambda: _discard_memory_indexes(project_id))
+    return generation
+
+
+def sync_cross_project_index():
+    """他のワーカーの書き込みがあれば、このプロセスのメモリ上の横断索引を破棄する"""
+    engine = get_cross_project_search()
+    get_index_generations().sync(
+        ALL_PROJECTS, read_total_generation(), lambda: _discard_memory_index(engine, ALL_PROJECTS)
+    )
+
+
+def _discard_memory_indexes(project_id):
+    for engine in (get_search_engine(), get_chunk_search()):
+        _discard_memory_index(engine, project_id)
+    # ベクトル・入力補完・あいまい検索・ファセットの索引はメモリのみ
+    for index in (get_vector_search(), get_suggest_index(), get_fuzzy_index(), get_facet_index()):
+        index.drop_project(project_id)
+
+
+def _discard_memory_index(engine, key):
+    if not engine.index_dir:
+        engine.invalidate(key)
+
+
+@contextmanager
+def _reflecting(project_ids):
+    """ブロック内で索引に反映し、最後にプロジェクトごとにDB上の世代番号を進める
+
+    DBへのコミット後に呼ばれるため、反映に失敗しても例外は呼び出し元に返さない（保存済みの
+    書き込みをエラーとして返さない）。失敗した場合はこのプロセスの世代の記録を消し、
+    次の検索でメモリ上の索引を破棄してDBから構築し直させる。
+    """
+    generations = get_index_generations()
+    try:
+        yield
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"検索索引への反映エラー: プロジェクト {sorted(project_ids)}: {str(e)}")
+        for project_id in project_ids:
+            generations.forget(project_id)
+        generations.forget(ALL_PROJECTS)
+    try:
+        for project_id in project_ids:
+            _publish_write(project_id)
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"検索索引の世代番号の更新エラー: プロジェクト {sorted(project_ids)}: {str(e)}")
+
+
+def _publish_write(project_id):
+    """DB上の世代番号を進めて他のワーカーに書き込みを知らせる
+
+    検索結果キャッシュもキーの世代番号が変わるため、全ワーカーで無効になる。
+    """
+    generations = get_index_generations()
+    generations.advance(project_id, bump_generation(project_id))
+    generations.advance(ALL_PROJECTS, read_total_generation())
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""
+ハイブリッド検索
+キーワード検索とベクトル検索を並列に実行し、順位を融合する
+"""
+
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+
+from .engine import get_search_backend
+from .vector import get_vector_search
+
+# 融合後の検索結果（breakdownにリトリーバごとの順位とスコアを持つ）
+HybridHit = namedtuple('HybridHit', ['doc_id', 'score', 'breakdown'])
+
+FUSION_METHODS = ('rrf', 'weighted')
+
+
+def reciprocal_rank_fusion(results, weights, k=60):
+    """Reciprocal Rank Fusion: Σ weight / (k + rank)"""
+    fused = {}
+    for name, hits in results.items():
+        weight = weights.get(name, 1.0)
+        for rank, hit in enumerate(hits, start=1):
+            fused[hit.doc_id] = fused.get(hit.doc_id, 0.0) + weight / (k + rank)
+    return fused
+
+
+def weighted_score_fusion(results, weights):
+    """リトリーバごとにスコアをmin-max正規化して重み付き和をとる"""
+    fused = {}
+    for name, hits in results.items():
+        if not hits:
+            continue
+        weight = weights.get(name, 1.0)
+        scores = [hit.score for hit in hits]
+        low, high = min(scores), max(scores)
+        span = high - low
+        for hit in hits:
+            normalized = (hit.score - low) / span if span else 1.0
+            fused[hit.doc_id] = fused.get(hit.doc_id, 0.0) + weight * normalized
+    return fused
+
+
+class HybridSearcher:
+    """キーワード（BM25または全文検索）とベクトルの2つのリトリーバを融合する
+
+    2つの検索はスレッドプールで同時に実行するため、待ち時間は合計ではなく遅い方で決まる。
+    """
+
+    def __init__(self, max_workers=4, fusion='rrf', rrf_k=60, depth=50, weights=None):
+        self.fusion = fusion
+        self.rrf_k = rrf_k
+        self.depth = depth
+        self.weights = weights or {'keyword': 1.0, 'semantic': 1.0}
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='hybrid-search')
+
+    def _retrievers(self):
+        return {
+            'keyword': get_search_backend(),
+            'semantic': get_vector_search()
+        }
+
+    def search(self, project_id, query, limit=10, depth=None, fusion=None, doc_filter=None):
+        """両リトリーバの上位depth件を融合し、上位limit件をHybridHitで返す"""
+        depth = max(depth or self.depth, limit)
+        fusion = fusion or self.fusion
+        if fusion not in FUSION_METHODS:
+            raise ValueError(f'不明な融合方式です: {fusion}')
+
+        app = current_app._get_current_object()
+
+        def run(retriever):
+            # ワーカースレッドでもDBセッションを使えるようアプリケーションコンテキストを張る
+            with app.app_context():
+                return retriever.search(project_id, query, depth, doc_filter=doc_filter)
+
+        futures = {
+            name: self._executor.submit(run, retriever)
+            for name, retriever in self._retrievers().items()
+        }
+        results = {name: future.result() for name, future in futures.items()}
+
+        if fusion == 'rrf':
+            fused = reciprocal_rank_fusion(results, self.weights, self.rrf_k)
+        else:
+            fused = weighted_score_fusion(results, self.weights)
+
+        positions = {
+            name: {hit.doc_id: (rank, hit.score) for rank, hit in enumerate(hits, start=1)}
+            for name, hits in results.items()
+        }
+        ranked = sorted(fused.items(), key=lambda item: (-item[1], item[0]))[:limit]
+
+        hits = []
+        for doc_id, score in ranked:
+            breakdown = {}
+            for name, ranks in positions.items():
+                rank, raw_score = ranks.get(doc_id, (None, None))
+                breakdown[name] = {
+                    'rank': rank,
+                    'score': round(raw_score, 4) if raw_score is not None else None
+                }
+            breakdown['fusion'] = fusion
+            hits.append(HybridHit(doc_id, score, breakdown))
+        return hits
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+
+def init_hybrid_search(app):
+    """ハイブリッド検索を初期化"""
+    searcher = HybridSearcher(
+        max_workers=app.config.get('SEARCH_HYBRID_WORKERS', 4),
+        fusion=app.config.get('SEARCH_HYBRID_FUSION', 'rrf'),
+        rrf_k=app.config.get('SEARCH_HYBRID_RRF_K', 60),
+        depth=app.config.get('SEARCH_HYBRID_DEPTH', 50),
+        weights=app.config.get('SEARCH_HYBRID_WEIGHTS')
+    )
+    app.extensions['hybrid_search'] = searcher
+    return searcher
+
+
+def get_hybrid_search():
+    """現在のアプリケーションのハイブリッド検索を取得"""
+    return current_app.extensions['hybrid_search']
@@ -0,0 +1,297 @@
+# -*- coding: utf-8 -*-
+"""
+転置インデックス（BM25スコアリング）
+"""
+
+import heapq
+import math
+from array import array
+from collections import Counter, namedtuple
+from contextlib import contextmanager
+from operator import itemgetter
+
+from .tokenizer import tokenize
+
+# フィールドごとの重み（BM25Fの簡易版として出現頻度に乗算する）
+FIELD_WEIGHTS = {'title': 3, 'tags': 2, 'content': 1}
+
+# 検索結果の1件
+SearchHit = namedtuple('SearchHit', ['doc_id', 'score'])
+
+
+class PostingList:
+    """ポスティングリスト（文書番号と出現頻度を配列で保持）"""
+    __slots__ = ('doc_ids', 'freqs')
+
+    def __init__(self):
+        self.doc_ids = array('I')
+        self.freqs = array('I')
+
+    def append(self, ordinal, freq):
+        """文書番号は昇順で追記される"""
+        self.doc_ids.append(ordinal)
+        self.freqs.append(freq)
+
+    def __len__(self):
+        return len(self.doc_ids)
+
+
+class InvertedIndex:
+    """BM25でランキングするインメモリ転置インデックス
+
+    文書は内部の連番（ordinal）で管理し、外部ID（KnowledgeBase.id）との対応表を持つ。
+    更新・削除された文書は墓標（tombstone）として残し、compacted()でまとめて除去する。
+    """
+
+    def __init__(self, k1=1.2, b=0.75, tokenizer=None):
+        self.k1 = k1
+        self.b = b
+        self.tokenizer = tokenizer or tokenize
+        self._postings = {}
+        self._doc_keys = array('q')      # ordinal -> 外部ID
+        self._doc_lengths = array('I')   # ordinal -> 文書長（重み付き）
+        self._ordinals = {}              # 外部ID -> ordinal
+        self._deleted = set()            # 墓標となったordinal
+        self._total_length = 0
+
+    def __len__(self):
+        return len(self._ordinals)
+
+    def __contains__(self, doc_id):
+        return doc_id in self._ordinals
+
+    @property
+    def tombstone_count(self):
+        """墓標の数"""
+        return len(self._deleted)
+
+    @property
+    def tombstone_ratio(self):
+        """全文書番号に占める墓標の割合"""
+        return len(self._deleted) / len(self._doc_keys) if self._doc_keys else 0.0
+
+    def analyze(self, title=None, content=None, tags=None):
+        """フィールドを解析して重み付き出現頻度を返す"""
+        freqs = Counter()
+        tag_text = ' '.join(tag for tag in tags or [] if isinstance(tag, str))
+        for field, value in (('title', title), ('content', content), ('tags', tag_text)):
+            weight = FIELD_WEIGHTS[field]
+            for term in self.tokenizer(value):
+                freqs[term] += weight
+        return freqs
+
+    def add_document(self, doc_id, title=None, content=None, tags=None, keys=()):
+        """文書をインデックスに追加（既存の文書は置き換える）
+
+        keysは文書の属性を表す語（プロジェクトなど）。出現頻度0で載せるため文書長やスコアには影響せず、
+        search(within=...) で検索対象を絞るのに使う。
+        """
+        if doc_id in self._ordinals:
+            self.remove_document(doc_id)
+
+        freqs = self.analyze(title, content, tags)
+        ordinal = len(self._doc_keys)
+        length = sum(freqs.values())
+
+        # 検索中のスレッドが参照できるよう、文書表を先に伸ばしてからポスティングを追記する
+        self._doc_keys.append(doc_id)
+        self._doc_lengths.append(length)
+        for term, freq in freqs.items():
+            postings = self._postings.get(term)
+            if postings is None:
+                postings = self._postings[term] = PostingList()
+            postings.append(ordinal, freq)
+        for key in keys:
+            postings = self._postings.get(key)
+            if postings is None:
+                postings = self._postings[key] = PostingList()
+            postings.append(ordinal, 0)
+
+        self._ordinals[doc_id] = ordinal
+        self._total_length += length
+
+    def remove_document(self, doc_id):
+        """文書を墓標化して検索対象から外す"""
+        ordinal = self._ordinals.pop(doc_id, None)
+        if ordinal is None:
+            return False
+        self._deleted.add(ordinal)
+        self._total_length -= self._doc_lengths[ordinal]
+        return True
+
+    @contextmanager
+    def batch(self):
+        """SegmentedIndexと同じインターフェース（メモリ上では即時反映のため何もしない）"""
+        yield self
+
+    def compacted(self):
+        """墓標を取り除いた新しいインデックスを返す（再トークナイズは行わない）"""
+        index = InvertedIndex(k1=self.k1, b=self.b, tokenizer=self.tokenizer)
+        remap = array('q', [-1]) * len(self._doc_keys)
+
+        for ordinal in sorted(self._ordinals.values()):
+            remap[ordinal] = len(index._doc_keys)
+            index._doc_keys.append(self._doc_keys[ordinal])
+            index._doc_lengths.append(self._doc_lengths[ordinal])
+            index._ordinals[self._doc_keys[ordinal]] = remap[ordinal]
+        index._total_length = self._total_length
+
+        for term, postings in self._postings.items():
+            live = PostingList()
+            for ordinal, freq in zip(postings.doc_ids, postings.freqs):
+                new_ordinal = remap[ordinal]
+                if new_ordinal >= 0:
+                    live.append(new_ordinal, freq)
+            if len(live):
+                index._postings[term] = live
+        return index
+
+    def document_frequency(self, term):
+        """語を含む文書数（墓標を含む）"""
+        postings = self._postings.get(term)
+        return len(postings) if postings is not None else 0
+
+    # --- score_sources() から参照されるソースとしてのインターフェース ---
+
+    @property
+    def doc_lengths(self):
+        return self._doc_lengths
+
+    @property
+    def deleted(self):
+        return self._deleted
+
+    @property
+    def total_length(self):
+        return self._total_length
+
+    def postings(self, term):
+        """語のポスティングリスト（存在しなければNone）"""
+        return self._postings.get(term)
+
+    def doc_key(self, ordinal):
+        """文書番号から外部IDを引く"""
+        return self._doc_keys[ordinal]
+
+    def live_documents(self):
+        """有効な文書の (外部ID, ordinal) を返す"""
+        return self._ordinals.items()
+
+    def search(self, query, limit=10, expansions=None, doc_filter=None, within=None):
+        """クエリに一致する文書をBM25スコア順に上位limit件返す（withinはscore_sources()を参照）"""
+        terms, weights = query_terms(self.tokenizer, query, expansions)
+        return score_sources(
+            [self], terms, len(self._ordinals), self._total_length,
+            limit, self.k1, self.b, weights, doc_filter, within
+        )
+
+    def key_documents(self, keys):
+        """keysのいずれかを持つ文書の外部IDの集合"""
+        return match_sources([self], keys)
+
+    def matching_documents(self, query, expansions=None):
+        """クエリの語をどれか含む文書の外部IDの集合（スコアは計算しない）"""
+        terms, _ = query_terms(self.tokenizer, query, expansions)
+        return match_sources([self], terms)
+
+
+def query_terms(tokenizer, query, expansions=None):
+    """クエリの語と、展開語から加わった語の重みを返す
+
+    expansionsは {展開語: 重み}。クエリ自体に含まれる語の重みは常に1とする。
+    """
+    terms = set(tokenizer(query))
+    weights = {}
+    for text, weight in (expansions or {}).items():
+        for term in tokenizer(text):
+            if term not in terms:
+                weights[term] = max(weights.get(term, 0.0), weight)
+    return terms | set(weights), weights
+
+
+def match_sources(sources, terms):
+    """複数のソースを横断して、いずれかの語を含む有効な文書の外部IDの集合を返す
+
+    ファセットの件数など一致の有無だけが必要な場合に、score_sources() の代わりに使う。
+    """
+    matched = set()
+    for source in sources:
+        matched.update(source.doc_key(ordinal) for ordinal in _source_ordinals(source, terms))
+    return matched
+
+
+def _source_ordinals(source, terms):
+    """ソース内でいずれかの語を含む有効な文書番号の集合"""
+    ordinals = set()
+    for term in terms:
+        postings = source.postings(term)
+        if postings is not None:
+            ordinals.update(postings.doc_ids)
+    ordinals -= source.deleted
+    return ordinals
+
+
+def score_sources(sources, terms, doc_count, total_length, limit, k1=1.2, b=0.75, weights=None,
+                  doc_filter=None, within=None):
+    """複数のソース（メモリ上のインデックスやディスク上のセグメント）を横断してBM25で順位付け
+
+    文書数・平均文書長・文書頻度はソース全体で合算した値を使う。
+    weightsに含まれる語（あいまい検索の展開語など）はスコアに重みを掛ける。
+    doc_filter（外部IDを受け取る述語）を渡すと、スコアの付いた文書のうち一致するものだけを順位付けする。
+    within（add_document() のkeysの語のリスト）を渡すと、いずれかのkeyを持つ文書だけをスコア計算の対象にする。
+    """
+    if not terms or not doc_count or limit <= 0:
+        return []
+    allowed = None
+    if within is not None:
+        allowed = [_source_ordinals(source, within) for source in sources]
+        if not any(allowed):
+            return []
+
+    avg_length = total_length / doc_count or 1.0
+    norm_const = k1 * (1 - b)
+    norm_length = k1 * b / avg_length
+    scores = [{} for _ in sources]
+
+    for term in terms:
+        matched = []
+        df = 0
+        for position, source in enumerate(sources):
+            postings = source.postings(term)
+            if postings is not None:
+                matched.append((position, postings))
+                df += len(postings)
+        if not matched:
+            continue
+
+        df = min(df, doc_count)
+        idf = math.log(1 + (doc_count - df + 0.5) / (df + 0.5))
+        if weights:
+            idf *= weights.get(term, 1.0)
+        for position, postings in matched:
+            source = sources[position]
+            lengths = source.doc_lengths
+            deleted = source.deleted
+            source_allowed = allowed[position] if allowed is not None else None
+            source_scores = scores[position]
+            for ordinal, tf in zip(postings.doc_ids, postings.freqs):
+                if source_allowed is not None:
+                    if ordinal not in source_allowed:
+                        continue
+                elif deleted and ordinal in deleted:
+                    continue
+                weight = idf * tf * (k1 + 1) / (tf + norm_const + norm_length * lengths[ordinal])
+                source_scores[ordinal] = source_scores.get(ordinal, 0.0) + weight
+
+    candidates = (
+        (score, position, ordinal)
+        for position, source_scores in enumerate(scores)
+        for ordinal, score in source_scores.items()
+    )
+    if doc_filter is not None:
+        candidates = (
+            candidate for candidate in candidates
+            if doc_filter(sources[candidate[1]].doc_key(candidate[2]))
+        )
+    top = heapq.nlargest(limit, candidates, key=itemgetter(0))
+    return [SearchHit(sources[position].doc_key(ordinal), score) for score, position, ordinal in top]
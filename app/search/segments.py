@@ -0,0 +1,308 @@
+# -*- coding: utf-8 -*-
+"""
+検索インデックスのディスクセグメント
+不変のセグメントファイルをmmapで開き、複数ワーカーでOSのページキャッシュを共有する
+
+ファイル構成（リトルエンディアン）:
+    ヘッダ | 文書ID表(int64) | 文書長表(uint32) | 語オフセット表(uint32) |
+    ポスティングオフセット表(uint64) | 語の連結バイト列 | ポスティング
+ポスティングは文書番号の差分と出現頻度を可変長整数（varint）で格納する。
+"""
+
+import mmap
+import os
+import struct
+import sys
+from array import array
+from bisect import bisect_left
+from functools import lru_cache
+
+from .index import PostingList
+
+MAGIC = b'KBSEG001'
+HEADER = struct.Struct('<8sQQQQQQQQ')
+SEGMENT_SUFFIX = '.seg'
+DELETES_SUFFIX = '.del'
+
+
+def _encode_varint(value, out):
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _decode_varints(buffer, offset, count):
+    """offsetからcount個のvarintを読み、(値の配列, 次のoffset)を返す"""
+    values = array('I')
+    append = values.append
+    for _ in range(count):
+        value = 0
+        shift = 0
+        while True:
+            byte = buffer[offset]
+            offset += 1
+            value |= (byte & 0x7F) << shift
+            if byte < 0x80:
+                break
+            shift += 7
+        append(value)
+    return values, offset
+
+
+def _pad(out):
+    out.extend(b'\0' * (-len(out) % 8))
+
+
+def write_segment(path, doc_keys, doc_lengths, postings):
+    """セグメントファイルを書き出す
+
+    doc_keys は昇順の外部ID、postings は {語: (文書番号列, 出現頻度列)}。
+    一時ファイルに書いてからリネームするため、読み手が書きかけを開くことはない。
+    """
+    if sys.byteorder != 'little':
+        raise RuntimeError('セグメントはリトルエンディアン環境でのみ書き出せます')
+
+    terms = sorted(term.encode('utf-8') for term in postings)
+    term_offsets = array('I', [0])
+    posting_offsets = array('Q')
+    blob = bytearray()
+    data = bytearray()
+
+    for encoded in terms:
+        blob.extend(encoded)
+        term_offsets.append(len(blob))
+        posting_offsets.append(len(data))
+
+        doc_ids, freqs = postings[encoded.decode('utf-8')]
+        _encode_varint(len(doc_ids), data)
+        previous = 0
+        for ordinal in doc_ids:
+            _encode_varint(ordinal - previous, data)
+            previous = ordinal
+        for freq in freqs:
+            _encode_varint(freq, data)
+    posting_offsets.append(len(data))
+
+    body = bytearray(HEADER.size)
+    keys_offset = len(body)
+    body.extend(array('q', doc_keys).tobytes())
+    lengths_offset = len(body)
+    body.extend(array('I', doc_lengths).tobytes())
+    _pad(body)
+    term_offsets_offset = len(body)
+    body.extend(term_offsets.tobytes())
+    _pad(body)
+    posting_offsets_offset = len(body)
+    body.extend(posting_offsets.tobytes())
+    blob_offset = len(body)
+    body.extend(blob)
+    postings_offset = len(body)
+    body.extend(data)
+
+    HEADER.pack_into(
+        body, 0, MAGIC, len(doc_keys), len(terms), sum(doc_lengths),
+        keys_offset, lengths_offset, term_offsets_offset, posting_offsets_offset,
+        blob_offset
+    )
+    # ポスティング領域の開始位置はblob_offset + 語の総バイト数で求まる
+    assert postings_offset == blob_offset + term_offsets[-1]
+
+    temp_path = f'{path}.tmp'
+    with open(temp_path, 'wb') as f:
+        f.write(body)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+
+
+def write_index_segment(path, index):
+    """InvertedIndexの有効な文書を外部ID順に並べ替えてセグメントに書き出す"""
+    live = sorted(index.live_documents())
+    remap = {ordinal: position for position, (_, ordinal) in enumerate(live)}
+    doc_keys = [doc_id for doc_id, _ in live]
+    doc_lengths = [index.doc_lengths[ordinal] for _, ordinal in live]
+
+    postings = {}
+    for term, posting_list in index._postings.items():
+        pairs = sorted(
+            (remap[ordinal], freq)
+            for ordinal, freq in zip(posting_list.doc_ids, posting_list.freqs)
+            if ordinal in remap
+        )
+        if pairs:
+            postings[term] = ([ordinal for ordinal, _ in pairs], [freq for _, freq in pairs])
+
+    write_segment(path, doc_keys, doc_lengths, postings)
+
+
+def merge_segments(path, segments):
+    """複数セグメントの有効な文書を1つのセグメントにまとめる"""
+    live = sorted(
+        (segment.doc_key(ordinal), position, ordinal)
+        for position, segment in enumerate(segments)
+        for ordinal in segment.live_ordinals()
+    )
+    remap = {(position, ordinal): new for new, (_, position, ordinal) in enumerate(live)}
+    doc_keys = [doc_id for doc_id, _, _ in live]
+    doc_lengths = [segments[position].doc_lengths[ordinal] for _, position, ordinal in live]
+
+    merged = {}
+    for position, segment in enumerate(segments):
+        for term in segment.terms():
+            posting_list = segment.postings(term)
+            target = merged.setdefault(term, [])
+            for ordinal, freq in zip(posting_list.doc_ids, posting_list.freqs):
+                new = remap.get((position, ordinal))
+                if new is not None:
+                    target.append((new, freq))
+
+    postings = {}
+    for term, pairs in merged.items():
+        if pairs:
+            pairs.sort()
+            postings[term] = ([ordinal for ordinal, _ in pairs], [freq for _, freq in pairs])
+
+    write_segment(path, doc_keys, doc_lengths, postings)
+
+
+class Segment:
+    """mmapで開いた読み取り専用セグメント
+
+    削除は外部IDのリストとして隣接する .del ファイルに保存する。
+    """
+
+    def __init__(self, path, postings_cache_size=1024):
+        self.path = path
+        self.name = os.path.basename(path)
+        self._file = open(path, 'rb')
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self._mmap)
+
+        (magic, doc_count, term_count, total_length, keys_offset, lengths_offset,
+         term_offsets_offset, posting_offsets_offset, blob_offset) = HEADER.unpack_from(view, 0)
+        if magic != MAGIC:
+            raise ValueError(f'セグメントの形式が不正です: {path}')
+
+        self.doc_count = doc_count
+        self.term_count = term_count
+        self._doc_keys = view[keys_offset:keys_offset + doc_count * 8].cast('q')
+        self.doc_lengths = view[lengths_offset:lengths_offset + doc_count * 4].cast('I')
+        self._term_offsets = view[term_offsets_offset:term_offsets_offset + (term_count + 1) * 4].cast('I')
+        self._posting_offsets = view[posting_offsets_offset:posting_offsets_offset + (term_count + 1) * 8].cast('Q')
+        self._blob = view[blob_offset:blob_offset + self._term_offsets[term_count]]
+        postings_offset = blob_offset + self._term_offsets[term_count]
+        self._data = view[postings_offset:postings_offset + self._posting_offsets[term_count]]
+
+        self._header_total_length = total_length
+        self.total_length = total_length
+        self.deleted = set()
+        self.dirty = False
+        self._decode = lru_cache(maxsize=postings_cache_size)(self._decode_postings)
+        self.load_deletes()
+
+    def __len__(self):
+        """有効な文書数"""
+        return self.doc_count - len(self.deleted)
+
+    @property
+    def deletes_path(self):
+        return self.path[:-len(SEGMENT_SUFFIX)] + DELETES_SUFFIX
+
+    def _term(self, position):
+        return bytes(self._blob[self._term_offsets[position]:self._term_offsets[position + 1]])
+
+    def _find_term(self, encoded):
+        low, high = 0, self.term_count
+        while low < high:
+            middle = (low + high) // 2
+            if self._term(middle) < encoded:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.term_count and self._term(low) == encoded:
+            return low
+        return None
+
+    def _decode_postings(self, position):
+        offset = self._posting_offsets[position]
+        count, offset = _decode_varints(self._data, offset, 1)
+        gaps, offset = _decode_varints(self._data, offset, count[0])
+        freqs, _ = _decode_varints(self._data, offset, count[0])
+
+        posting_list = PostingList()
+        ordinal = 0
+        for gap in gaps:
+            ordinal += gap
+            posting_list.doc_ids.append(ordinal)
+        posting_list.freqs = freqs
+        return posting_list
+
+    def postings(self, term):
+        """語のポスティングリスト（存在しなければNone）"""
+        position = self._find_term(term.encode('utf-8'))
+        if position is None:
+            return None
+        return self._decode(position)
+
+    def terms(self):
+        """格納されている語を辞書順に返す"""
+        for position in range(self.term_count):
+            yield self._term(position).decode('utf-8')
+
+    def doc_key(self, ordinal):
+        return self._doc_keys[ordinal]
+
+    def find(self, doc_id):
+        """外部IDから文書番号を二分探索で引く"""
+        ordinal = bisect_left(self._doc_keys, doc_id)
+        if ordinal < self.doc_count and self._doc_keys[ordinal] == doc_id:
+            return ordinal
+        return None
+
+    def live_ordinals(self):
+        return (ordinal for ordinal in range(self.doc_count) if ordinal not in self.deleted)
+
+    def delete(self, doc_id):
+        """文書を削除済みにする（save_deletes()で永続化）"""
+        ordinal = self.find(doc_id)
+        if ordinal is None or ordinal in self.deleted:
+            return False
+        self.deleted.add(ordinal)
+        self.total_length -= self.doc_lengths[ordinal]
+        self.dirty = True
+        return True
+
+    def load_deletes(self):
+        """.delファイルから削除済み文書を読み込む"""
+        self.deleted = set()
+        self.total_length = self._header_total_length
+        if os.path.exists(self.deletes_path):
+            keys = array('q')
+            with open(self.deletes_path, 'rb') as f:
+                keys.frombytes(f.read())
+            for doc_id in keys:
+                ordinal = self.find(doc_id)
+                if ordinal is not None and ordinal not in self.deleted:
+                    self.deleted.add(ordinal)
+                    self.total_length -= self.doc_lengths[ordinal]
+        self.dirty = False
+
+    def save_deletes(self):
+        """削除済み文書を.delファイルに書き出す"""
+        keys = array('q', sorted(self._doc_keys[ordinal] for ordinal in self.deleted))
+        temp_path = f'{self.deletes_path}.tmp'
+        with open(temp_path, 'wb') as f:
+            f.write(keys.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.deletes_path)
+        self.dirty = False
+
+    def close(self):
+        # memoryviewを解放してからmmapを閉じる
+        for name in ('_doc_keys', 'doc_lengths', '_term_offsets', '_posting_offsets', '_blob', '_data'):
+            getattr(self, name).release()
+        self._decode.cache_clear()
+        self._mmap.close()
+        self._file.close()
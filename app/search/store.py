@@ -0,0 +1,356 @@
+# -*- coding: utf-8 -*-
+"""
+ディスク永続化された検索インデックス
+不変セグメント群とメモリ上の書き込みバッファ（InvertedIndex）をログ構造的に組み合わせる
+"""
+
+import fcntl
+import json
+import os
+import threading
+from contextlib import contextmanager
+
+from ..utils.logger import get_logger
+from .index import InvertedIndex, match_sources, query_terms, score_sources
+from .segments import Segment, SEGMENT_SUFFIX, DELETES_SUFFIX, write_index_segment, merge_segments
+
+logger = get_logger(__name__)
+
+MANIFEST_NAME = 'manifest.json'
+LOCK_NAME = 'LOCK'
+
+
+class SegmentedIndex:
+    """プロジェクト1つ分のセグメント化インデックス
+
+    ディレクトリ構成:
+        manifest.json   有効なセグメント一覧と世代番号
+        000001.seg      不変セグメント（mmapで開く）
+        000001.del      セグメントから削除された外部ID
+        LOCK            ワーカー間の排他用ロックファイル
+
+    起動時はmanifestに載ったセグメントを開くだけなので、コーパスの大きさに依存しない。
+    書き込みはバッファに溜め、flush_threshold件ごとに新しいセグメントとして書き出す。
+    セグメントは文書数で階層（merge_factor倍ごと）に分け、同じ階層のセグメントが
+    merge_factor個たまったらそれだけを1つにまとめる（階層型マージ）。大きな基底セグメントは
+    同規模のセグメントがたまるまで統合の対象にならないため、書き込みのたびにコーパス全体を
+    書き直すことはなく、1文書が書き直される回数は階層の数（O(log N)）に収まる。
+    """
+
+    def __init__(self, directory, k1=1.2, b=0.75, tokenizer=None, flush_threshold=1, merge_factor=8):
+        self.directory = directory
+        self.k1 = k1
+        self.b = b
+        self.tokenizer = tokenizer
+        self.flush_threshold = flush_threshold
+        self.merge_factor = merge_factor
+        self.segments = []
+        self.generation = 0
+        self.doc_count_at_flush = 0
+        self._memtable = self._new_memtable()
+        self._pending_masks = set()   # 未フラッシュの更新・削除で隠すべき外部ID
+        self._pending_ops = 0
+        self._batch_depth = 0
+        self._manifest_stamp = None
+        self._lock = threading.RLock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _new_memtable(self):
+        return InvertedIndex(k1=self.k1, b=self.b, tokenizer=self.tokenizer)
+
+    @staticmethod
+    def exists(directory):
+        return os.path.exists(os.path.join(directory, MANIFEST_NAME))
+
+    @classmethod
+    def open(cls, directory, **kwargs):
+        """既存のインデックスを開く（セグメントファイルを開くだけでコーパスは読まない）"""
+        index = cls(directory, **kwargs)
+        with index._file_lock(fcntl.LOCK_SH):
+            index._load_manifest()
+        return index
+
+    # --- ソース横断の統計 ---
+
+    def __len__(self):
+        return sum(len(segment) for segment in self.segments) + len(self._memtable)
+
+    def __contains__(self, doc_id):
+        if doc_id in self._memtable:
+            return True
+        for segment in self.segments:
+            ordinal = segment.find(doc_id)
+            if ordinal is not None and ordinal not in segment.deleted:
+                return True
+        return False
+
+    @property
+    def tombstone_count(self):
+        return sum(len(segment.deleted) for segment in self.segments) + self._memtable.tombstone_count
+
+    @property
+    def tombstone_ratio(self):
+        total = sum(segment.doc_count for segment in self.segments) + len(self._memtable._doc_keys)
+        return self.tombstone_count / total if total else 0.0
+
+    @property
+    def sources(self):
+        return self.segments + [self._memtable]
+
+    # --- 書き込み ---
+
+    def add_document(self, doc_id, title=None, content=None, tags=None, keys=()):
+        """文書を追加または置き換え（keysは InvertedIndex.add_document() を参照）"""
+        with self._lock:
+            self._mask(doc_id)
+            self._memtable.add_document(doc_id, title=title, content=content, tags=tags, keys=keys)
+            self._after_write()
+
+    def remove_document(self, doc_id):
+        """文書を削除"""
+        with self._lock:
+            removed = self._mask(doc_id)
+            removed = self._memtable.remove_document(doc_id) or removed
+            self._after_write()
+            return removed
+
+    def _mask(self, doc_id):
+        self._pending_masks.add(doc_id)
+        removed = False
+        for segment in self.segments:
+            removed = segment.delete(doc_id) or removed
+        return removed
+
+    def _after_write(self):
+        self._pending_ops += 1
+        if not self._batch_depth and self._pending_ops >= self.flush_threshold:
+            self.flush()
+
+    @contextmanager
+    def batch(self):
+        """ブロック内の書き込みをまとめて1回でフラッシュする"""
+        with self._lock:
+            self._batch_depth += 1
+            try:
+                yield self
+            finally:
+                self._batch_depth -= 1
+                if not self._batch_depth and self._pending_ops >= self.flush_threshold:
+                    self.flush()
+
+    def flush(self):
+        """バッファと削除情報をディスクに書き出し、manifestを更新"""
+        with self._lock, self._file_lock(fcntl.LOCK_EX):
+            # 他のワーカーが先に書き込んでいれば最新のセグメント構成に追従する
+            if self._manifest_changed():
+                self._load_manifest()
+
+            names = [segment.name for segment in self.segments]
+            if len(self._memtable):
+                name = self._next_segment_name()
+                write_index_segment(os.path.join(self.directory, name), self._memtable)
+                self.segments.append(Segment(os.path.join(self.directory, name)))
+                names.append(name)
+
+            for segment in self.segments:
+                if segment.dirty:
+                    segment.save_deletes()
+
+            self._memtable = self._new_memtable()
+            self._pending_masks.clear()
+            self._pending_ops = 0
+            self._write_manifest(names)
+
+            targets = self._merge_candidates()
+            while targets:
+                self._merge(targets)
+                targets = self._merge_candidates()
+
+    def _tier(self, segment):
+        """セグメントの階層（文書数がmerge_factorの何乗の規模か）"""
+        size = segment.doc_count
+        tier = 0
+        while size >= self.merge_factor:
+            size //= self.merge_factor
+            tier += 1
+        return tier
+
+    def _merge_candidates(self):
+        """同じ階層にmerge_factor個たまったセグメントのうち、最も小さい階層のものを返す"""
+        if self.merge_factor < 2:
+            return []
+        tiers = {}
+        for segment in self.segments:
+            tiers.setdefault(self._tier(segment), []).append(segment)
+        for tier in sorted(tiers):
+            if len(tiers[tier]) >= self.merge_factor:
+                return tiers[tier][:self.merge_factor]
+        return []
+
+    def rebuild(self, documents):
+        """(外部ID, タイトル, 本文, タグ[, keys]) の列から単一セグメントを作り直す"""
+        memtable = self._new_memtable()
+        for document in documents:
+            memtable.add_document(*document)
+
+        with self._lock, self._file_lock(fcntl.LOCK_EX):
+            name = self._next_segment_name()
+            write_index_segment(os.path.join(self.directory, name), memtable)
+            self.segments = [Segment(os.path.join(self.directory, name))]
+            self._memtable = self._new_memtable()
+            self._pending_masks.clear()
+            self._pending_ops = 0
+            self._write_manifest([name])
+
+            # 以前の世代のファイルを削除
+            for filename in os.listdir(self.directory):
+                stale = filename.endswith(SEGMENT_SUFFIX) or filename.endswith(DELETES_SUFFIX)
+                if stale and not filename.startswith(name[:-len(SEGMENT_SUFFIX)]):
+                    os.remove(os.path.join(self.directory, filename))
+
+    def compacted(self):
+        """全セグメントを1つにまとめて削除済み文書を除去する"""
+        self.flush()
+        with self._lock, self._file_lock(fcntl.LOCK_EX):
+            if self._manifest_changed():
+                self._load_manifest()
+            if len(self.segments) > 1 or self.tombstone_count:
+                self._merge(list(self.segments))
+        return self
+
+    def _merge(self, targets):
+        """targetsを新しいセグメントにまとめる（ファイルロック内で呼ぶ）"""
+        if not targets:
+            return
+        name = self._next_segment_name()
+        merge_segments(os.path.join(self.directory, name), targets)
+
+        merged = Segment(os.path.join(self.directory, name))
+        position = min(self.segments.index(segment) for segment in targets)
+        remaining = [segment for segment in self.segments if segment not in targets]
+        remaining.insert(position, merged)
+        self.segments = remaining
+        self._write_manifest([segment.name for segment in self.segments])
+
+        # 検索中のスレッドが参照している可能性があるため、mmapは参照が切れた時点で解放させる
+        for segment in targets:
+            for suffix in (SEGMENT_SUFFIX, DELETES_SUFFIX):
+                path = os.path.join(self.directory, segment.name[:-len(SEGMENT_SUFFIX)] + suffix)
+                if os.path.exists(path):
+                    os.remove(path)
+        logger.info(f"検索セグメント統合: {self.directory} ({len(targets)}個 -> {name})")
+
+    # --- 検索 ---
+
+    def search(self, query, limit=10, expansions=None, doc_filter=None, within=None):
+        """全セグメントとバッファを横断して検索（withinは score_sources() を参照）"""
+        self.refresh()
+        sources = self.sources
+        terms, weights = query_terms(self._memtable.tokenizer, query, expansions)
+        return score_sources(
+            sources,
+            terms,
+            sum(len(source) for source in sources),
+            sum(source.total_length for source in sources),
+            limit, self.k1, self.b, weights, doc_filter, within
+        )
+
+    def key_documents(self, keys):
+        """keysのいずれかを持つ文書の外部IDの集合"""
+        self.refresh()
+        return match_sources(self.sources, keys)
+
+    def matching_documents(self, query, expansions=None):
+        """クエリの語をどれか含む文書の外部IDの集合（スコアは計算しない）"""
+        self.refresh()
+        terms, _ = query_terms(self._memtable.tokenizer, query, expansions)
+        return match_sources(self.sources, terms)
+
+    def refresh(self):
+        """他のワーカーがmanifestを更新していればセグメントを開き直す"""
+        if not self._manifest_changed():
+            return
+        with self._lock, self._file_lock(fcntl.LOCK_SH):
+            if self._manifest_changed():
+                self._load_manifest()
+
+    # --- manifest ---
+
+    @property
+    def _manifest_path(self):
+        return os.path.join(self.directory, MANIFEST_NAME)
+
+    def _stat_manifest(self):
+        try:
+            stat = os.stat(self._manifest_path)
+        except FileNotFoundError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+    def _manifest_changed(self):
+        return self._stat_manifest() != self._manifest_stamp
+
+    def _load_manifest(self):
+        """manifestを読み、セグメントを開き直す（ファイルロック内で呼ぶ）"""
+        stamp = self._stat_manifest()
+        if stamp is None:
+            return
+        with open(self._manifest_path, encoding='utf-8') as f:
+            manifest = json.load(f)
+
+        opened = {segment.name: segment for segment in self.segments}
+        segments = []
+        for name in manifest['segments']:
+            segment = opened.pop(name, None)
+            if segment is None:
+                segment = Segment(os.path.join(self.directory, name))
+            else:
+                segment.load_deletes()
+            segments.append(segment)
+
+        self.segments = segments
+        self.generation = manifest['generation']
+        self.doc_count_at_flush = manifest.get('doc_count', 0)
+        self._manifest_stamp = stamp
+
+        # 未フラッシュの更新・削除を新しいセグメントにも反映する
+        for doc_id in self._pending_masks:
+            for segment in self.segments:
+                segment.delete(doc_id)
+
+    def _write_manifest(self, names):
+        self.generation += 1
+        self.doc_count_at_flush = len(self)
+        temp_path = f'{self._manifest_path}.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                'generation': self.generation,
+                'segments': names,
+                'doc_count': self.doc_count_at_flush
+            }, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self._manifest_path)
+        self._manifest_stamp = self._stat_manifest()
+
+    def _next_segment_name(self):
+        existing = [
+            int(name[:-len(SEGMENT_SUFFIX)])
+            for name in os.listdir(self.directory)
+            if name.endswith(SEGMENT_SUFFIX) and name[:-len(SEGMENT_SUFFIX)].isdigit()
+        ]
+        return f'{max(existing, default=0) + 1:06d}{SEGMENT_SUFFIX}'
+
+    @contextmanager
+    def _file_lock(self, mode):
+        with open(os.path.join(self.directory, LOCK_NAME), 'a') as lock_file:
+            fcntl.flock(lock_file.fileno(), mode)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+    def close(self):
+        for segment in self.segments:
+            segment.close()
+        self.segments = []
@@ -0,0 +1,324 @@
+# -*- coding: utf-8 -*-
+"""
+入力補完（サジェスト）
+タイトル・タグ・よく検索されるクエリを、プロジェクトごとの圧縮トライ（基数木）で前方一致検索する
+"""
+
+import heapq
+import threading
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import func
+
+from ..models import db
+from ..models.knowledge import KnowledgeBase
+from ..models.search_log import SearchLog
+from ..utils.logger import get_logger
+from .tokenizer import normalize
+
+logger = get_logger(__name__)
+
+
+class _Node:
+    """基数木のノード"""
+    __slots__ = ('children', 'key', 'weight', 'top')
+
+    def __init__(self):
+        self.children = {}   # 辺ラベルの先頭文字 -> (辺ラベル, 子ノード)
+        self.key = None      # このノードで終わる語
+        self.weight = 0.0    # その語の重み（0なら語の終端ではない）
+        self.top = []        # 部分木内の上位 (重み, 語)。重みの降順
+
+
+class PrefixTrie:
+    """重み付きの基数木
+
+    各ノードに部分木の上位top_k件を保持しておくため、前方一致の問い合わせは
+    接頭辞の長さ分だけノードをたどれば済み、語彙数に依存しない。
+    重みの更新は根から終端までの経路上のノードだけを作り直す。
+    """
+
+    def __init__(self, top_k=10):
+        self.top_k = top_k
+        self._root = _Node()
+        self._weights = {}
+
+    def __len__(self):
+        return len(self._weights)
+
+    def __contains__(self, key):
+        return key in self._weights
+
+    def weight(self, key):
+        return self._weights.get(key, 0.0)
+
+    def add(self, key, delta):
+        """語の重みをdeltaだけ増減する（0以下になった語は取り除く）"""
+        if not key:
+            return
+        weight = self._weights.get(key, 0.0) + delta
+        if weight <= 0:
+            if key not in self._weights:
+                return
+            del self._weights[key]
+            weight = 0.0
+        else:
+            self._weights[key] = weight
+
+        path = self._insert_path(key) if weight else self._find_path(key)
+        if path is None:
+            return
+        path[-1].key = key
+        path[-1].weight = weight
+
+        # 終端から根に向かって上位リストを作り直し、空になったノードは刈り取る
+        for depth in range(len(path) - 1, -1, -1):
+            node = path[depth]
+            if depth and not node.weight and not node.children:
+                parent = path[depth - 1]
+                for first, (_, child) in list(parent.children.items()):
+                    if child is node:
+                        del parent.children[first]
+                        break
+                continue
+            self._refresh_top(node)
+
+    def _refresh_top(self, node):
+        entries = [entry for _, child in node.children.values() for entry in child.top]
+        if node.weight:
+            entries.append((node.weight, node.key))
+        node.top = heapq.nlargest(self.top_k, entries, key=_rank)
+
+    def _find_path(self, key):
+        node = self._root
+        path = [node]
+        position = 0
+        while position < len(key):
+            edge = node.children.get(key[position])
+            if edge is None:
+                return None
+            label, child = edge
+            if not key.startswith(label, position):
+                return None
+            position += len(label)
+            node = child
+            path.append(node)
+        return path
+
+    def _insert_path(self, key):
+        node = self._root
+        path = [node]
+        position = 0
+        while position < len(key):
+            edge = node.children.get(key[position])
+            if edge is None:
+                child = _Node()
+                node.children[key[position]] = (key[position:], child)
+                path.append(child)
+                break
+
+            label, child = edge
+            common = _common_prefix_length(label, key, position)
+            if common < len(label):
+                # 辺を分割して中間ノードを挟む
+                middle = _Node()
+                middle.children[label[common]] = (label[common:], child)
+                middle.top = list(child.top)
+                node.children[key[position]] = (label[:common], middle)
+                child = middle
+            position += common
+            node = child
+            path.append(node)
+        return path
+
+    def complete(self, prefix, limit=10):
+        """接頭辞に一致する語を重みの降順で (語, 重み) のリストで返す"""
+        node = self._root
+        position = 0
+        while position < len(prefix):
+            edge = node.children.get(prefix[position])
+            if edge is None:
+                return []
+            label, child = edge
+            remaining = prefix[position:position + len(label)]
+            if not label.startswith(remaining):
+                return []
+            position += len(label)
+            node = child
+        return [(key, weight) for weight, key in node.top[:limit]]
+
+
+def _common_prefix_length(label, key, position):
+    length = 0
+    limit = min(len(label), len(key) - position)
+    while length < limit and label[length] == key[position + length]:
+        length += 1
+    return length
+
+
+def _rank(entry):
+    """重みの降順、同じ重みなら短い語・辞書順で先に並べる"""
+    weight, key = entry
+    return weight, -len(key), tuple(-ord(char) for char in key)
+
+
+def suggest_key(text):
+    """補完用のキー（正規化して空白をまとめる）"""
+    return ' '.join(normalize(text).split())
+
+
+class SuggestIndex:
+    """プロジェクトごとの補完用トライを保持するレジストリ
+
+    重みはタイトル・タグの出現件数と、結果が1件以上あった検索クエリの回数にそれぞれ係数を掛けたもの。
+    ナレッジごとに寄与分を覚えておき、更新・削除ではその差分だけをトライに反映する。
+    """
+
+    def __init__(self, top_k=10, query_days=90, max_queries=1000, weights=None):
+        self.top_k = top_k
+        self.query_days = query_days
+        self.max_queries = max_queries
+        self.weights = weights or {'title': 1.0, 'tag': 1.0, 'query': 1.0}
+        self._tries = {}
+        self._labels = {}         # project_id -> {キー: 表示文字列}
+        self._contributions = {}  # project_id -> {ナレッジID: [(キー, 表示文字列, 重み)]}
+        self._lock = threading.RLock()
+
+    def _document_entries(self, title, tags):
+        entries = []
+        if title and suggest_key(title):
+            entries.append((suggest_key(title), title.strip(), self.weights['title']))
+        for tag in tags or []:
+            if isinstance(tag, str) and suggest_key(tag):
+                entries.append((suggest_key(tag), tag.strip(), self.weights['tag']))
+        return entries
+
+    @staticmethod
+    def _apply(trie, labels, entries, sign=1):
+        """(キー, 表示文字列, 重み) をトライに加算または減算（公開済みのトライにはロック内で呼ぶ）"""
+        for key, label, weight in entries:
+            trie.add(key, sign * weight)
+            if key in trie:
+                labels.setdefault(key, label)
+            else:
+                labels.pop(key, None)
+
+    def get_trie(self, project_id):
+        """プロジェクトのトライを取得（未構築ならDBから構築）"""
+        trie = self._tries.get(project_id)
+        if trie is not None:
+            return trie
+
+        with self._lock:
+            trie = self._tries.get(project_id)
+            if trie is None:
+                trie, labels, contributions = self._build(project_id)
+                # 構築し終えてから公開する（ロックなしで読む get_trie() に途中のトライを見せない）
+                self._labels[project_id] = labels
+                self._contributions[project_id] = contributions
+                self._tries[project_id] = trie
+            return trie
+
+    def _build(self, project_id):
+        """DBからトライ・表示文字列・寄与分を構築して返す（公開はしない）"""
+        trie = PrefixTrie(top_k=self.top_k)
+        labels = {}
+        contributions = {}
+
+        rows = db.session.query(
+            KnowledgeBase.id, KnowledgeBase.title, KnowledgeBase.tags
+        ).filter(
+            KnowledgeBase.project_id == project_id
+        ).yield_per(1000)
+        for kb_id, title, tags in rows:
+            entries = contributions[kb_id] = self._document_entries(title, tags)
+            self._apply(trie, labels, entries)
+
+        since = datetime.utcnow() - timedelta(days=self.query_days)
+        queries = db.session.query(
+            SearchLog.query_text, func.count(SearchLog.id).label('count')
+        ).filter(
+            SearchLog.project_id == project_id,
+            SearchLog.results_count > 0,
+            SearchLog.created_at >= since
+        ).group_by(
+            SearchLog.query_text
+        ).order_by(
+            func.count(SearchLog.id).desc()
+        ).limit(self.max_queries)
+        for query_text, count in queries:
+            key = suggest_key(query_text)
+            if key:
+                self._apply(trie, labels, [(key, query_text.strip(), self.weights['query'] * count)])
+
+        logger.info(f"補完インデックス構築: プロジェクト {project_id} ({len(trie)}語)")
+        return trie, labels, contributions
+
+    def suggest(self, project_id, prefix, limit=10):
+        """接頭辞に一致する候補を {'text', 'score'} のリストで返す"""
+        key = suggest_key(prefix)
+        if not key:
+            return []
+        trie = self.get_trie(project_id)
+        labels = self._labels.get(project_id, {})
+        return [
+            {'text': labels.get(candidate, candidate), 'score': round(weight, 4)}
+            for candidate, weight in trie.complete(key, min(limit, self.top_k))
+        ]
+
+    def index_document(self, knowledge_base):
+        """ナレッジの作成・更新を差分で反映（未構築のプロジェクトは次回構築時に読み込む）"""
+        project_id = knowledge_base.project_id
+        with self._lock:
+            if project_id not in self._tries:
+                return
+            trie, labels = self._tries[project_id], self._labels[project_id]
+            contributions = self._contributions[project_id]
+            self._apply(trie, labels, contributions.pop(knowledge_base.id, []), sign=-1)
+            entries = contributions[knowledge_base.id] = self._document_entries(
+                knowledge_base.title, knowledge_base.tags
+            )
+            self._apply(trie, labels, entries)
+
+    def remove_document(self, project_id, kb_id):
+        """ナレッジの削除を反映"""
+        with self._lock:
+            if project_id not in self._tries:
+                return
+            self._apply(
+                self._tries[project_id], self._labels[project_id],
+                self._contributions[project_id].pop(kb_id, []), sign=-1
+            )
+
+    def record_query(self, project_id, query):
+        """結果のあった検索クエリを重みに加える"""
+        key = suggest_key(query)
+        with self._lock:
+            if key and project_id in self._tries:
+                self._apply(
+                    self._tries[project_id], self._labels[project_id], [(key, query.strip(), self.weights['query'])]
+                )
+
+    def drop_project(self, project_id):
+        """プロジェクト削除時にトライを破棄"""
+        with self._lock:
+            self._tries.pop(project_id, None)
+            self._labels.pop(project_id, None)
+            self._contributions.pop(project_id, None)
+
+
+def init_suggest(app):
+    """入力補完を初期化"""
+    index = SuggestIndex(
+        top_k=app.config.get('SEARCH_SUGGEST_TOP_K', 10),
+        query_days=app.config.get('SEARCH_SUGGEST_QUERY_DAYS', 90),
+        max_queries=app.config.get('SEARCH_SUGGEST_MAX_QUERIES', 1000),
+        weights=app.config.get('SEARCH_SUGGEST_WEIGHTS')
+    )
+    app.extensions['suggest_index'] = index
+    return index
+
+
+def get_suggest_index():
+    """現在のアプリケーションの入力補完インデックスを取得"""
+    return current_app.extensions['suggest_index']
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""
+検索用トークナイザ
+日本語テキストを正規化し、文字n-gramまたは形態素解析で語に分割する
+"""
+
+import re
+import unicodedata
+from functools import lru_cache
+
+from ..utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+# カタカナ（ァ〜ヶ）をひらがなに寄せる変換表
+_KANA_FOLD = {code: code - 0x60 for code in range(0x30A1, 0x30F7)}
+
+# 日本語の文字（ひらがな・長音・々〆・漢字）
+_CJK_CHARS = 'ぁ-ゖゝゞー々〆㐀-䶿一-鿿豈-﫿'
+
+# 日本語の連続部分と、それ以外の単語（「Kubernetes入門」のような混在も英数字部分で切る）
+_TERM_PATTERN = re.compile(
+    rf'(?P<cjk>[{_CJK_CHARS}]+)'
+    rf'|(?P<word>[^\W{_CJK_CHARS}]+)'
+)
+
+
+def normalize(text):
+    """NFKC正規化・小文字化・カナ正規化を行う
+
+    NFKCで全角英数字と半角カナの幅を揃え、カタカナはひらがなに寄せる。
+    """
+    if not text:
+        return ''
+    return unicodedata.normalize('NFKC', text).lower().translate(_KANA_FOLD)
+
+
+class Tokenizer:
+    """トークナイザの基底クラス"""
+    name = None
+
+    def __call__(self, text):
+        raise NotImplementedError
+
+    def tokenize_batch(self, texts):
+        """複数テキストをまとめて分割"""
+        return [self(text) for text in texts]
+
+
+class WordTokenizer(Tokenizer):
+    """単語境界（\\w+）で分割するトークナイザ"""
+    name = 'word'
+
+    def __call__(self, text):
+        if not text:
+            return []
+        return [match.group() for match in _TERM_PATTERN.finditer(normalize(text))]
+
+
+class NGramTokenizer(Tokenizer):
+    """日本語部分を文字n-gramに、英数字部分を単語に分割するトークナイザ"""
+    name = 'ngram'
+
+    def __init__(self, ngram_sizes=(2, 3), cache_size=65536):
+        self.ngram_sizes = tuple(sorted(ngram_sizes))
+        # 同じ語の繰り返しが多いため、日本語部分のn-gram展開をキャッシュする
+        self._ngrams = lru_cache(maxsize=cache_size)(self._build_ngrams)
+
+    def _build_ngrams(self, run):
+        if len(run) < self.ngram_sizes[0]:
+            return (run,)
+        return tuple(
+            run[i:i + size]
+            for size in self.ngram_sizes
+            for i in range(len(run) - size + 1)
+        )
+
+    def __call__(self, text):
+        if not text:
+            return []
+        tokens = []
+        for match in _TERM_PATTERN.finditer(normalize(text)):
+            if match.lastgroup == 'cjk':
+                tokens.extend(self._ngrams(match.group()))
+            else:
+                tokens.append(match.group())
+        return tokens
+
+    def cache_info(self):
+        """n-gramキャッシュの統計"""
+        return self._ngrams.cache_info()
+
+
+class MorphologicalTokenizer(Tokenizer):
+    """辞書ベースの形態素解析トークナイザ（fugashi または janome が必要）"""
+    name = 'morph'
+
+    def __init__(self, cache_size=65536):
+        self._segment = _load_morphological_backend()
+        if self._segment is None:
+            raise ImportError('形態素解析ライブラリ（fugashi または janome）がインストールされていません')
+        self._normalize_term = lru_cache(maxsize=cache_size)(normalize)
+
+    def __call__(self, text):
+        if not text:
+            return []
+        # 解析精度のためカナ正規化は分割後の語にだけ適用する
+        tokens = []
+        for surface in self._segment(unicodedata.normalize('NFKC', text)):
+            term = self._normalize_term(surface)
+            if _TERM_PATTERN.fullmatch(term):
+                tokens.append(term)
+        return tokens
+
+
+def _load_morphological_backend():
+    """利用可能な形態素解析器を読み込む"""
+    try:
+        from fugashi import Tagger
+        tagger = Tagger()
+        return lambda text: [word.surface for word in tagger(text)]
+    except (ImportError, RuntimeError):
+        pass
+
+    try:
+        from janome.tokenizer import Tokenizer as JanomeTokenizer
+        janome = JanomeTokenizer(wakati=True)
+        return lambda text: list(janome.tokenize(text))
+    except ImportError:
+        return None
+
+
+def get_tokenizer(name='ngram', ngram_sizes=(2, 3)):
+    """名前からトークナイザを生成
+
+    'auto' は形態素解析器が利用できればそれを、なければn-gramを使う。
+    'morph' が利用できない場合もn-gramにフォールバックする。
+    """
+    if name in ('auto', 'morph'):
+        try:
+            return MorphologicalTokenizer()
+        except ImportError:
+            if name == 'morph':
+                logger.warning("形態素解析器が見つからないため、n-gramトークナイザを使用します")
+            return NGramTokenizer(ngram_sizes)
+    if name == 'word':
+        return WordTokenizer()
+    if name == 'ngram':
+        return NGramTokenizer(ngram_sizes)
+    raise ValueError(f'不明なトークナイザです: {name}')
+
+
+# 既定のトークナイザ
+tokenize = NGramTokenizer()
@@ -0,0 +1,401 @@
+# -*- coding: utf-8 -*-
+"""
+ベクトル検索
+ローカルのCPUエンコーダで埋め込みを計算し、IVF（転置ファイル）方式の近似最近傍探索を行う
+"""
+
+import hashlib
+import math
+import threading
+from collections import Counter
+from functools import lru_cache
+
+import numpy as np
+from flask import current_app
+
+from ..models import db
+from ..models.knowledge import KnowledgeBase
+from ..utils.logger import get_logger
+from .index import SearchHit
+from .tokenizer import get_tokenizer
+
+logger = get_logger(__name__)
+
+
+def document_text(title, content, tags):
+    """埋め込み対象のテキストを組み立てる"""
+    tag_text = ' '.join(tag for tag in tags or [] if isinstance(tag, str))
+    return '\n'.join([title or '', tag_text, content or ''])
+
+
+class Encoder:
+    """エンコーダの基底クラス（正規化済みfloat32行列を返す）"""
+    dim = None
+
+    def encode(self, texts):
+        raise NotImplementedError
+
+
+class HashingEncoder(Encoder):
+    """特徴ハッシングによる決定的なエンコーダ
+
+    モデルのダウンロードが不要で、プロセスや再起動をまたいで同じベクトルを返す。
+    語の出現頻度を対数で抑え、符号付きハッシュで次元に割り当てる。
+    """
+
+    def __init__(self, dim=256, tokenizer=None, cache_size=65536):
+        self.dim = dim
+        self.tokenizer = tokenizer or get_tokenizer()
+        self._bucket = lru_cache(maxsize=cache_size)(self._hash_term)
+
+    def _hash_term(self, term):
+        digest = int.from_bytes(hashlib.blake2b(term.encode('utf-8'), digest_size=8).digest(), 'little')
+        sign = 1.0 if digest & 1 else -1.0
+        return (digest >> 1) % self.dim, sign
+
+    def encode(self, texts):
+        rows, cols, values = [], [], []
+        for row, text in enumerate(texts):
+            for term, count in Counter(self.tokenizer(text)).items():
+                col, sign = self._bucket(term)
+                rows.append(row)
+                cols.append(col)
+                values.append(sign * (1.0 + math.log(count)))
+
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        if rows:
+            np.add.at(matrix, (np.asarray(rows), np.asarray(cols)), np.asarray(values, dtype=np.float32))
+        return normalize_rows(matrix)
+
+
+class SentenceTransformerEncoder(Encoder):
+    """sentence-transformers のローカルモデルを使うエンコーダ（CPU固定）"""
+
+    def __init__(self, model_name, batch_size=64):
+        from sentence_transformers import SentenceTransformer
+        self.model = SentenceTransformer(model_name, device='cpu')
+        self.dim = self.model.get_sentence_embedding_dimension()
+        self.batch_size = batch_size
+
+    def encode(self, texts):
+        vectors = self.model.encode(list(texts), batch_size=self.batch_size, convert_to_numpy=True)
+        return normalize_rows(vectors.astype(np.float32))
+
+
+def normalize_rows(matrix):
+    """行ごとにL2正規化（ゼロベクトルはそのまま）"""
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def get_encoder(name='hashing', dim=256, tokenizer=None):
+    """名前からエンコーダを生成
+
+    'hashing' 以外は sentence-transformers のモデル名として扱う。
+    """
+    if name == 'hashing':
+        return HashingEncoder(dim=dim, tokenizer=tokenizer)
+    return SentenceTransformerEncoder(name)
+
+
+class VectorIndex:
+    """1プロジェクト分のベクトル索引
+
+    ベクトルは行列（float32、またはint8と行ごとのスケール）に追記し、削除は生存フラグで管理する。
+    削除済みの行が生存している行より多くなったら、生存している行だけに詰め直す。
+    件数がmin_train_sizeを超えるとk-meansで粗いクラスタ（IVF）を学習し、
+    検索時はクエリに近いnprobe個のクラスタだけを走査する。それ未満は全件の内積で厳密に探索する。
+    """
+
+    def __init__(self, dim, quantize=False, nprobe=8, min_train_size=1024):
+        self.dim = dim
+        self.quantize = quantize
+        self.nprobe = nprobe
+        self.min_train_size = min_train_size
+        self._size = 0
+        self._ids = np.empty(0, dtype=np.int64)
+        self._alive = np.empty(0, dtype=bool)
+        self._vectors = np.empty((0, dim), dtype=np.int8 if quantize else np.float32)
+        self._scales = np.empty(0, dtype=np.float32)
+        self._rows = {}                 # 外部ID -> 行番号
+        self._centroids = None
+        self._lists = []                # クラスタごとの行番号配列
+        self._trained_size = 0
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._rows)
+
+    @property
+    def trained(self):
+        return self._centroids is not None
+
+    def _reserve(self, count):
+        """容量を倍々で確保する"""
+        needed = self._size + count
+        capacity = len(self._ids)
+        if needed <= capacity:
+            return
+        capacity = max(needed, capacity * 2, 64)
+        self._ids = np.resize(self._ids, capacity)
+        self._alive = np.resize(self._alive, capacity)
+        self._scales = np.resize(self._scales, capacity)
+        vectors = np.zeros((capacity, self.dim), dtype=self._vectors.dtype)
+        vectors[:self._size] = self._vectors[:self._size]
+        self._vectors = vectors
+
+    def add(self, doc_ids, vectors):
+        """ベクトルをまとめて追加（既存IDは置き換え）"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        with self._lock:
+            for doc_id in doc_ids:
+                self.remove(doc_id)
+
+            count = len(doc_ids)
+            self._reserve(count)
+            start, end = self._size, self._size + count
+            self._ids[start:end] = doc_ids
+            self._alive[start:end] = True
+            if self.quantize:
+                scales = np.abs(vectors).max(axis=1) / 127.0
+                scales[scales == 0] = 1.0
+                self._vectors[start:end] = np.round(vectors / scales[:, None]).astype(np.int8)
+                self._scales[start:end] = scales
+            else:
+                self._vectors[start:end] = vectors
+                self._scales[start:end] = 1.0
+
+            for offset, doc_id in enumerate(doc_ids):
+                self._rows[doc_id] = start + offset
+            self._size = end
+
+            if self.trained:
+                assignments = self._assign(vectors)
+                new_rows = np.arange(start, end)
+                for cluster in np.unique(assignments):
+                    self._lists[cluster] = np.concatenate([self._lists[cluster], new_rows[assignments == cluster]])
+
+            # 未学習で閾値を超えた、または学習時の2倍に増えたら学習し直す
+            if len(self._rows) >= self.min_train_size and len(self._rows) >= 2 * self._trained_size:
+                self.train()
+
+    def remove(self, doc_id):
+        """ベクトルを削除済みにする"""
+        with self._lock:
+            row = self._rows.pop(doc_id, None)
+            if row is None:
+                return False
+            self._alive[row] = False
+            if self._size - len(self._rows) > len(self._rows):
+                self._compact()
+            return True
+
+    def _compact(self):
+        """削除済みの行を取り除き、行番号とIVFのリストを付け直す"""
+        rows = np.nonzero(self._alive[:self._size])[0]
+        if len(rows) == self._size:
+            return
+        mapping = np.full(self._size, -1, dtype=np.int64)
+        mapping[rows] = np.arange(len(rows))
+        self._lists = [mapping[cluster[self._alive[cluster]]] for cluster in self._lists]
+
+        self._ids = self._ids[rows]
+        self._alive = np.ones(len(rows), dtype=bool)
+        self._vectors = self._vectors[rows]
+        self._scales = self._scales[rows]
+        self._size = len(rows)
+        self._rows = {int(doc_id): row for row, doc_id in enumerate(self._ids)}
+
+    def _dense(self, rows):
+        """行をfloat32で取り出す"""
+        vectors = self._vectors[rows]
+        if self.quantize:
+            return vectors.astype(np.float32) * self._scales[rows][:, None]
+        return vectors
+
+    def _assign(self, vectors):
+        return np.argmax(vectors @ self._centroids.T, axis=1)
+
+    def train(self, iterations=10, seed=0):
+        """生存しているベクトルで球面k-meansを学習し、IVFのリストを作り直す"""
+        with self._lock:
+            self._compact()
+            rows = np.arange(self._size)
+            if len(rows) == 0:
+                return
+            data = self._dense(rows)
+            clusters = max(1, int(math.sqrt(len(rows))))
+            rng = np.random.default_rng(seed)
+            centroids = data[rng.choice(len(rows), clusters, replace=False)]
+
+            for _ in range(iterations):
+                assignments = np.argmax(data @ centroids.T, axis=1)
+                sums = np.zeros_like(centroids)
+                np.add.at(sums, assignments, data)
+                empty = ~sums.any(axis=1)
+                sums[empty] = centroids[empty]
+                centroids = normalize_rows(sums)
+
+            self._centroids = centroids
+            assignments = np.argmax(data @ centroids.T, axis=1)
+            order = np.argsort(assignments, kind='stable')
+            bounds = np.searchsorted(assignments[order], np.arange(clusters + 1))
+            self._lists = [rows[order[bounds[i]:bounds[i + 1]]] for i in range(clusters)]
+            self._trained_size = len(rows)
+            logger.info(f"ベクトル索引学習: {len(rows)}件, クラスタ {clusters}個")
+
+    def search(self, query_vector, limit=10, doc_filter=None):
+        """クエリベクトルとのコサイン類似度で上位limit件を返す（doc_filterは文書IDの述語）"""
+        with self._lock:
+            return self._search(np.asarray(query_vector, dtype=np.float32), limit, doc_filter)
+
+    def _search(self, query_vector, limit, doc_filter=None):
+        if not self._rows or limit <= 0:
+            return []
+
+        if self.trained:
+            probes = np.argsort(-(self._centroids @ query_vector))[:self.nprobe]
+            rows = np.concatenate([self._lists[cluster] for cluster in probes])
+        else:
+            rows = np.arange(self._size)
+        rows = rows[self._alive[rows]]
+        if doc_filter is not None and len(rows):
+            rows = rows[np.fromiter((doc_filter(int(doc_id)) for doc_id in self._ids[rows]), bool, len(rows))]
+        if len(rows) == 0:
+            return []
+
+        scores = self._vectors[rows] @ query_vector
+        if self.quantize:
+            scores = scores * self._scales[rows]
+
+        if len(rows) > limit:
+            top = np.argpartition(-scores, limit)[:limit]
+        else:
+            top = np.arange(len(rows))
+        top = top[np.argsort(-scores[top], kind='stable')]
+        return [SearchHit(int(self._ids[rows[i]]), float(scores[i])) for i in top]
+
+
+class VectorSearchEngine:
+    """プロジェクトごとのベクトル索引を保持するレジストリ"""
+
+    def __init__(self, encoder, quantize=False, nprobe=8, min_train_size=1024, batch_size=256):
+        self.encoder = encoder
+        self.quantize = quantize
+        self.nprobe = nprobe
+        self.min_train_size = min_train_size
+        self.batch_size = batch_size
+        self._indexes = {}
+        self._lock = threading.RLock()
+
+    def _new_index(self):
+        return VectorIndex(
+            self.encoder.dim,
+            quantize=self.quantize,
+            nprobe=self.nprobe,
+            min_train_size=self.min_train_size
+        )
+
+    def get_index(self, project_id):
+        """プロジェクトの索引を取得（未構築ならDBからバッチで埋め込みを計算）"""
+        index = self._indexes.get(project_id)
+        if index is not None:
+            return index
+
+        with self._lock:
+            index = self._indexes.get(project_id)
+            if index is None:
+                index = self._build_index(project_id)
+                self._indexes[project_id] = index
+            return index
+
+    def _build_index(self, project_id):
+        index = self._new_index()
+        rows = db.session.query(
+            KnowledgeBase.id,
+            KnowledgeBase.title,
+            KnowledgeBase.content,
+            KnowledgeBase.tags
+        ).filter(
+            KnowledgeBase.project_id == project_id
+        ).yield_per(self.batch_size)
+
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= self.batch_size:
+                self._add_batch(index, batch)
+                batch = []
+        if batch:
+            self._add_batch(index, batch)
+
+        logger.info(f"ベクトル索引構築: プロジェクト {project_id} ({len(index)}件)")
+        return index
+
+    def _add_batch(self, index, rows):
+        vectors = self.encoder.encode([document_text(title, content, tags) for _, title, content, tags in rows])
+        index.add([kb_id for kb_id, _, _, _ in rows], vectors)
+
+    def search(self, project_id, query, limit=10, doc_filter=None):
+        """プロジェクト内を意味的に検索してSearchHitのリストを返す"""
+        index = self.get_index(project_id)
+        return index.search(self.encoder.encode([query])[0], limit, doc_filter)
+
+    def index_document(self, knowledge_base):
+        """構築済みの索引にだけ反映する（未構築なら次回検索時にDBから構築）"""
+        index = self._indexes.get(knowledge_base.project_id)
+        if index is not None:
+            self._add_batch(index, [(
+                knowledge_base.id, knowledge_base.title, knowledge_base.content, knowledge_base.tags
+            )])
+
+    def index_documents(self, knowledge_bases):
+        """複数のナレッジをプロジェクトごとにまとめてエンコードして反映"""
+        groups = {}
+        for knowledge_base in knowledge_bases:
+            groups.setdefault(knowledge_base.project_id, []).append(knowledge_base)
+        for project_id, documents in groups.items():
+            index = self._indexes.get(project_id)
+            if index is None:
+                continue
+            for start in range(0, len(documents), self.batch_size):
+                self._add_batch(index, [
+                    (knowledge_base.id, knowledge_base.title, knowledge_base.content, knowledge_base.tags)
+                    for knowledge_base in documents[start:start + self.batch_size]
+                ])
+
+    def remove_document(self, project_id, kb_id):
+        index = self._indexes.get(project_id)
+        if index is not None:
+            index.remove(kb_id)
+
+    def remove_documents(self, documents):
+        for project_id, kb_id in documents:
+            self.remove_document(project_id, kb_id)
+
+    def drop_project(self, project_id):
+        with self._lock:
+            self._indexes.pop(project_id, None)
+
+
+def init_vector_search(app):
+    """ベクトル検索を初期化"""
+    engine = VectorSearchEngine(
+        get_encoder(
+            app.config.get('SEARCH_VECTOR_ENCODER', 'hashing'),
+            dim=app.config.get('SEARCH_VECTOR_DIM', 256),
+            tokenizer=app.extensions['search_engine'].tokenizer
+        ),
+        quantize=app.config.get('SEARCH_VECTOR_QUANTIZE', False),
+        nprobe=app.config.get('SEARCH_VECTOR_NPROBE', 8),
+        min_train_size=app.config.get('SEARCH_VECTOR_MIN_TRAIN_SIZE', 1024),
+        batch_size=app.config.get('SEARCH_VECTOR_BATCH_SIZE', 256)
+    )
+    app.extensions['vector_search'] = engine
+    return engine
+
+
+def get_vector_search():
+    """現在のアプリケーションのベクトル検索エンジンを取得"""
+    return current_app.extensions['vector_search']
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""
+カーソル（キーセット）ページネーション
+(created_at, id) の降順で並べ、前ページ最後の行より後ろだけを索引で読む
+"""
+
+import base64
+import json
+from datetime import datetime
+from flask import current_app
+from sqlalchemy import String, and_, literal, or_
+
+from ..models import db
+
+
+class InvalidCursor(ValueError):
+    """カーソルが不正"""
+
+
+def encode_cursor(created_at, item_id):
+    """(作成日時, ID) を不透明なカーソル文字列にする
+
+    作成日時がない行はキーセットの位置を表せない（decode_cursor() でも受け付けない）ため、ValueErrorにする。
+    """
+    if created_at is None:
+        raise ValueError(f'作成日時のない行からはカーソルを作れません: ID {item_id}')
+    payload = json.dumps([created_at.isoformat(), item_id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """カーソル文字列を (作成日時, ID) に戻す"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        created_at, item_id = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        if not isinstance(item_id, int) or isinstance(item_id, bool):
+            raise ValueError(item_id)
+        return datetime.fromisoformat(created_at), item_id
+    except (TypeError, ValueError, UnicodeError):
+        raise InvalidCursor(cursor)
+
+
+def page_limit(limit=None):
+    """件数を既定値と上限に収める"""
+    if limit is None:
+        return current_app.config['PAGINATION_DEFAULT_LIMIT']
+    return max(1, min(limit, current_app.config['PAGINATION_MAX_LIMIT']))
+
+
+def parse_page_args(args):
+    """クエリ文字列から (limit, cursor, エラーメッセージ) を取り出す"""
+    limit = args.get('limit')
+    if limit is not None:
+        try:
+            limit = int(limit)
+        except ValueError:
+            limit = 0
+        if limit < 1:
+            return None, None, 'limitは1以上の整数で指定してください'
+    cursor = args.get('cursor') or None
+    if cursor is not None:
+        try:
+            decode_cursor(cursor)
+        except InvalidCursor:
+            return None, None, 'cursorが不正です'
+    return page_limit(limit), cursor, None
+
+
+def _created_bound(created_at):
+    """カーソルの作成日時を比較用の値にする
+
+    SQLiteはCURRENT_TIMESTAMPを秒までの文字列で保存するため、datetimeをそのまま渡すと
+    マイクロ秒付きの文字列と比べることになり一致しない。保存時と同じ書式の文字列で比べる。
+    """
+    if db.session.get_bind().dialect.name == 'sqlite':
+        return literal(created_at.isoformat(sep=' '), String)
+    return created_at
+
+
+def keyset_paginate(query, created_column, id_column, limit=None, cursor=None, key=None):
+    """(created_at, id) の降順でlimit件を取り、(行のリスト, 次ページのカーソル) を返す
+
+    keyは行から (作成日時, ID) を取り出す関数（省略時は行の created_at と id）。
+    最後のページでは次ページのカーソルはNone。
+    """
+    limit = page_limit(limit)
+    if cursor:
+        created_at, item_id = decode_cursor(cursor)
+        created_at = _created_bound(created_at)
+        query = query.filter(or_(
+            created_column < created_at,
+            and_(created_column == created_at, id_column < item_id)
+        ))
+    rows = query.order_by(created_column.desc(), id_column.desc()).limit(limit + 1).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        key = key or (lambda row: (row.created_at, row.id))
+        next_cursor = encode_cursor(*key(rows[-1]))
+    return rows, next_cursor
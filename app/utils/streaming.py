@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+"""
+ストリーミングレスポンス用のユーティリティ
+"""
+
+import zlib
+
+
+def encode_chunks(chunks, encoding='utf-8'):
+    """文字列のチャンクをバイト列にして返す"""
+    for chunk in chunks:
+        yield chunk.encode(encoding)
+
+
+def gzip_chunks(chunks, level=6):
+    """バイト列のチャンクをその場でgzip圧縮して返す（全体をメモリに持たない）"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
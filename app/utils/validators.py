@@ -56,3 +56,25 @@ def is_valid_project_name(name):
         return False, "プロジェクト名は100文字以下である必要があります"
     
     return True, "有効なプロジェクト名です"
+
+
+def parse_fields(value, allowed, default):
+    """?fields= のカンマ区切りを検証し、(フィールドのタプル, エラーメッセージ) を返す"""
+    if not value:
+        return tuple(default), None
+    fields = tuple(dict.fromkeys(field.strip() for field in value.split(',') if field.strip()))
+    unknown = [field for field in fields if field not in allowed]
+    if unknown:
+        return None, f"不明なフィールドです: {', '.join(unknown)}"
+    if not fields:
+        return None, 'fieldsを指定してください'
+    return fields, None
+
+
+def validate_tags(tags):
+    """タグが文字列の配列（またはNone）かを検証し、エラーメッセージ（問題なければNone）を返す"""
+    if tags is None:
+        return None
+    if not isinstance(tags, list) or not all(isinstance(tag, str) for tag in tags):
+        return 'tagsは文字列の配列で指定してください'
+    return None
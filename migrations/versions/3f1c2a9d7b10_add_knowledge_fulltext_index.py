@@ -0,0 +1,63 @@
+"""ナレッジの全文検索索引を追加
+
+MySQL: knowledge_base(title, content) に ngram パーサの FULLTEXT 索引
+SQLite: FTS5 の影テーブル knowledge_base_fts と同期用トリガー
+
+Revision ID: 3f1c2a9d7b10
+Revises: 
+Create Date: 2026-10-18 10:00:00.000000
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '3f1c2a9d7b10'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'mysql':
+        op.execute(
+            'ALTER TABLE knowledge_base '
+            'ADD FULLTEXT INDEX ft_knowledge_title_content (title, content) WITH PARSER ngram'
+        )
+    elif dialect == 'sqlite':
+        op.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS knowledge_base_fts USING fts5("
+            "title, content, content='knowledge_base', content_rowid='id', tokenize='trigram')"
+        )
+        op.execute(
+            "CREATE TRIGGER IF NOT EXISTS knowledge_base_fts_ai AFTER INSERT ON knowledge_base BEGIN "
+            "INSERT INTO knowledge_base_fts(rowid, title, content) VALUES (new.id, new.title, new.content); "
+            "END"
+        )
+        op.execute(
+            "CREATE TRIGGER IF NOT EXISTS knowledge_base_fts_ad AFTER DELETE ON knowledge_base BEGIN "
+            "INSERT INTO knowledge_base_fts(knowledge_base_fts, rowid, title, content) "
+            "VALUES ('delete', old.id, old.title, old.content); "
+            "END"
+        )
+        op.execute(
+            "CREATE TRIGGER IF NOT EXISTS knowledge_base_fts_au AFTER UPDATE ON knowledge_base BEGIN "
+            "INSERT INTO knowledge_base_fts(knowledge_base_fts, rowid, title, content) "
+            "VALUES ('delete', old.id, old.title, old.content); "
+            "INSERT INTO knowledge_base_fts(rowid, title, content) VALUES (new.id, new.title, new.content); "
+            "END"
+        )
+        # 既存データを取り込む
+        op.execute("INSERT INTO knowledge_base_fts(knowledge_base_fts) VALUES ('rebuild')")
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'mysql':
+        op.drop_index('ft_knowledge_title_content', table_name='knowledge_base')
+    elif dialect == 'sqlite':
+        op.execute('DROP TRIGGER IF EXISTS knowledge_base_fts_au')
+        op.execute('DROP TRIGGER IF EXISTS knowledge_base_fts_ad')
+        op.execute('DROP TRIGGER IF EXISTS knowledge_base_fts_ai')
+        op.execute('DROP TABLE IF EXISTS knowledge_base_fts')
@@ -0,0 +1,188 @@
+"""ナレッジのチャンクテーブルを追加
+
+knowledge_base.content_hash と knowledge_chunks を作成し、既存ナレッジをバッチでチャンク分割する
+
+Revision ID: 8b2e4d6f1a23
+Revises: 3f1c2a9d7b10
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+import hashlib
+import re
+from collections import namedtuple
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8b2e4d6f1a23'
+down_revision = '3f1c2a9d7b10'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 500
+MAX_TOKENS = 256
+OVERLAP_TOKENS = 32
+
+# アプリケーションの app/search/chunker.py と同じ規則でチャンクに分割する
+# （appパッケージをimportすると create_app() が走るため、このリビジョン時点の実装を複製する）
+_Chunk = namedtuple('_Chunk', ['position', 'heading', 'start', 'end', 'token_count'])
+_HEADING_PATTERN = re.compile(r'^[ \t]*(#{1,6})[ \t]+(.+?)[ \t#]*$', re.MULTILINE)
+_PARAGRAPH_BREAK = re.compile(r'\n[ \t]*\n')
+_SENTENCE_END = re.compile(r'[。．.!?！？]+[」』）)]*\s*|\n')
+_TOKEN_PATTERN = re.compile(r'[A-Za-z0-9_]+|[^\sA-Za-z0-9_]')
+
+
+def _count_tokens(text):
+    return len(_TOKEN_PATTERN.findall(text)) if text else 0
+
+
+def _content_hash(content):
+    return hashlib.sha256((content or '').encode('utf-8')).hexdigest()
+
+
+def _strip_span(text, start, end):
+    while start < end and text[start].isspace():
+        start += 1
+    while end > start and text[end - 1].isspace():
+        end -= 1
+    return start, end
+
+
+def _sections(text):
+    headings = list(_HEADING_PATTERN.finditer(text))
+    if not headings or headings[0].start() > 0:
+        first = headings[0].start() if headings else len(text)
+        yield None, 0, first
+    for number, match in enumerate(headings):
+        end = headings[number + 1].start() if number + 1 < len(headings) else len(text)
+        yield match.group(2).strip(), match.start(), end
+
+
+def _split_spans(text, start, end, pattern):
+    position = start
+    for match in pattern.finditer(text, start, end):
+        if match.end() > position:
+            yield position, match.end()
+            position = match.end()
+    if position < end:
+        yield position, end
+
+
+def _units(text, start, end, max_tokens):
+    for paragraph_start, paragraph_end in _split_spans(text, start, end, _PARAGRAPH_BREAK):
+        paragraph_start, paragraph_end = _strip_span(text, paragraph_start, paragraph_end)
+        if paragraph_start == paragraph_end:
+            continue
+        tokens = _count_tokens(text[paragraph_start:paragraph_end])
+        if tokens <= max_tokens:
+            yield paragraph_start, paragraph_end, tokens
+            continue
+
+        for sentence_start, sentence_end in _split_spans(text, paragraph_start, paragraph_end, _SENTENCE_END):
+            sentence_start, sentence_end = _strip_span(text, sentence_start, sentence_end)
+            if sentence_start == sentence_end:
+                continue
+            tokens = _count_tokens(text[sentence_start:sentence_end])
+            if tokens <= max_tokens:
+                yield sentence_start, sentence_end, tokens
+                continue
+
+            matches = list(_TOKEN_PATTERN.finditer(text, sentence_start, sentence_end))
+            for offset in range(0, len(matches), max_tokens):
+                window = matches[offset:offset + max_tokens]
+                yield window[0].start(), window[-1].end(), len(window)
+
+
+def _chunk_text(text, max_tokens, overlap_tokens):
+    if not text or not text.strip():
+        return []
+    overlap_tokens = min(max(overlap_tokens, 0), max_tokens - 1)
+
+    chunks = []
+    for heading, section_start, section_end in _sections(text):
+        units = list(_units(text, section_start, section_end, max_tokens))
+        first = 0
+        while first < len(units):
+            last = first
+            tokens = units[first][2]
+            while last + 1 < len(units) and tokens + units[last + 1][2] <= max_tokens:
+                last += 1
+                tokens += units[last][2]
+
+            chunks.append(_Chunk(len(chunks), heading, units[first][0], units[last][1], tokens))
+            if last + 1 >= len(units):
+                break
+
+            next_first = last + 1
+            overlap = 0
+            while next_first - 1 > first and overlap + units[next_first - 1][2] <= overlap_tokens:
+                next_first -= 1
+                overlap += units[next_first][2]
+            first = next_first
+    return chunks
+
+
+def upgrade():
+    with op.batch_alter_table('knowledge_base') as batch_op:
+        batch_op.add_column(sa.Column('content_hash', sa.String(length=64), nullable=True))
+
+    chunks = op.create_table(
+        'knowledge_chunks',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('knowledge_base_id', sa.Integer(), nullable=False),
+        sa.Column('position', sa.Integer(), nullable=False),
+        sa.Column('heading', sa.String(length=200), nullable=True),
+        sa.Column('content', sa.Text(), nullable=False),
+        sa.Column('start_offset', sa.Integer(), nullable=False),
+        sa.Column('end_offset', sa.Integer(), nullable=False),
+        sa.Column('token_count', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['knowledge_base_id'], ['knowledge_base.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('knowledge_base_id', 'position', name='uq_knowledge_chunk_position')
+    )
+
+    # 既存ナレッジをID順にバッチで分割
+    bind = op.get_bind()
+    knowledge_base = sa.table(
+        'knowledge_base',
+        sa.column('id', sa.Integer),
+        sa.column('content', sa.Text),
+        sa.column('content_hash', sa.String)
+    )
+    last_id = 0
+    while True:
+        rows = bind.execute(
+            sa.select(knowledge_base.c.id, knowledge_base.c.content)
+            .where(knowledge_base.c.id > last_id)
+            .order_by(knowledge_base.c.id)
+            .limit(BATCH_SIZE)
+        ).fetchall()
+        if not rows:
+            break
+
+        records = []
+        for kb_id, content in rows:
+            for chunk in _chunk_text(content, MAX_TOKENS, OVERLAP_TOKENS):
+                records.append({
+                    'knowledge_base_id': kb_id,
+                    'position': chunk.position,
+                    'heading': chunk.heading[:200] if chunk.heading else None,
+                    'content': content[chunk.start:chunk.end],
+                    'start_offset': chunk.start,
+                    'end_offset': chunk.end,
+                    'token_count': chunk.token_count
+                })
+            bind.execute(
+                knowledge_base.update().where(knowledge_base.c.id == kb_id).values(content_hash=_content_hash(content))
+            )
+        if records:
+            op.bulk_insert(chunks, records)
+        last_id = rows[-1][0]
+
+
+def downgrade():
+    op.drop_table('knowledge_chunks')
+    with op.batch_alter_table('knowledge_base') as batch_op:
+        batch_op.drop_column('content_hash')
@@ -0,0 +1,32 @@
+"""検索索引の世代番号テーブルを追加
+
+search_generations を作成する。ナレッジの書き込みごとにプロジェクトの世代番号を進め、
+複数ワーカーのメモリ上の索引がDBに追従できるようにする
+
+Revision ID: a6d2f8c4e9b7
+Revises: f2b8d4a6c1e3
+Create Date: 2026-10-18 21:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a6d2f8c4e9b7'
+down_revision = 'f2b8d4a6c1e3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'search_generations',
+        sa.Column('project_id', sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column('generation', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('project_id')
+    )
+
+
+def downgrade():
+    op.drop_table('search_generations')
@@ -0,0 +1,34 @@
+"""検索ログにプロジェクトIDを追加
+
+入力補完でプロジェクトごとの人気クエリを集計するため
+
+Revision ID: c4a7e9b2d5f6
+Revises: 8b2e4d6f1a23
+Create Date: 2026-10-18 14:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4a7e9b2d5f6'
+down_revision = '8b2e4d6f1a23'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('search_logs') as batch_op:
+        batch_op.add_column(sa.Column('project_id', sa.Integer(), nullable=True))
+        batch_op.create_foreign_key(
+            'fk_search_logs_project_id', 'projects', ['project_id'], ['id'], ondelete='SET NULL'
+        )
+        batch_op.create_index('idx_search_logs_project_created_at', ['project_id', 'created_at'])
+
+
+def downgrade():
+    with op.batch_alter_table('search_logs') as batch_op:
+        batch_op.drop_index('idx_search_logs_project_created_at')
+        batch_op.drop_constraint('fk_search_logs_project_id', type_='foreignkey')
+        batch_op.drop_column('project_id')
@@ -0,0 +1,111 @@
+"""タグを正規化したテーブルを追加
+
+tags と knowledge_tags を作成し、knowledge_base.tags（JSON）からバッチで埋める
+
+Revision ID: d8f3b1c6e2a4
+Revises: c4a7e9b2d5f6
+Create Date: 2026-10-18 16:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd8f3b1c6e2a4'
+down_revision = 'c4a7e9b2d5f6'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 500
+MAX_NAME_LENGTH = 50
+
+
+def _tag_names(tags):
+    """アプリケーションの normalize_tag_names() と同じ規則でタグ名を取り出す"""
+    names = {}
+    for tag in tags or []:
+        if isinstance(tag, str) and tag.strip():
+            name = tag.strip()[:MAX_NAME_LENGTH]
+            names.setdefault(name.casefold(), name)
+    return list(names.values())
+
+
+def upgrade():
+    tags = op.create_table(
+        'tags',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('project_id', sa.Integer(), nullable=False),
+        sa.Column('name', sa.String(length=MAX_NAME_LENGTH), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['project_id'], ['projects.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('project_id', 'name', name='uq_tag_project_name')
+    )
+    knowledge_tags = op.create_table(
+        'knowledge_tags',
+        sa.Column('knowledge_base_id', sa.Integer(), nullable=False),
+        sa.Column('tag_id', sa.Integer(), nullable=False),
+        sa.Column('project_id', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['knowledge_base_id'], ['knowledge_base.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['tag_id'], ['tags.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['project_id'], ['projects.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('knowledge_base_id', 'tag_id')
+    )
+    op.create_index(
+        'idx_knowledge_tags_project_tag', 'knowledge_tags', ['project_id', 'tag_id', 'knowledge_base_id']
+    )
+
+    # 既存ナレッジのJSONをID順にバッチで移す
+    bind = op.get_bind()
+    knowledge_base = sa.table(
+        'knowledge_base',
+        sa.column('id', sa.Integer),
+        sa.column('project_id', sa.Integer),
+        sa.column('tags', sa.JSON)
+    )
+    tag_ids = {}  # (project_id, 正規化したタグ名) -> タグID
+    last_id = 0
+    while True:
+        rows = bind.execute(
+            sa.select(knowledge_base.c.id, knowledge_base.c.project_id, knowledge_base.c.tags)
+            .where(knowledge_base.c.id > last_id)
+            .order_by(knowledge_base.c.id)
+            .limit(BATCH_SIZE)
+        ).fetchall()
+        if not rows:
+            break
+
+        documents = [(kb_id, project_id, _tag_names(names)) for kb_id, project_id, names in rows]
+        new_tags = {}
+        for _, project_id, names in documents:
+            for name in names:
+                key = (project_id, name.casefold())
+                if key not in tag_ids:
+                    new_tags.setdefault(key, {'project_id': project_id, 'name': name})
+        if new_tags:
+            op.bulk_insert(tags, list(new_tags.values()))
+            inserted = {}
+            for (project_id, _), tag in new_tags.items():
+                inserted.setdefault(project_id, []).append(tag['name'])
+            for project_id, names in inserted.items():
+                for tag_id, name in bind.execute(
+                    sa.select(tags.c.id, tags.c.name)
+                    .where(tags.c.project_id == project_id, tags.c.name.in_(names))
+                ):
+                    tag_ids.setdefault((project_id, name.casefold()), tag_id)
+
+        records = [
+            {'knowledge_base_id': kb_id, 'tag_id': tag_ids[(project_id, name.casefold())], 'project_id': project_id}
+            for kb_id, project_id, names in documents
+            for name in names
+        ]
+        if records:
+            op.bulk_insert(knowledge_tags, records)
+        last_id = rows[-1][0]
+
+
+def downgrade():
+    op.drop_index('idx_knowledge_tags_project_tag', table_name='knowledge_tags')
+    op.drop_table('knowledge_tags')
+    op.drop_table('tags')
@@ -0,0 +1,31 @@
+"""一覧のカーソルページネーション用の複合索引を追加
+
+プロジェクト内で (created_at, id) の降順に読む一覧（ナレッジ・招待）を索引だけで辿れるようにする
+
+Revision ID: e1a9c3d7f5b2
+Revises: d8f3b1c6e2a4
+Create Date: 2026-10-18 18:00:00.000000
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'e1a9c3d7f5b2'
+down_revision = 'd8f3b1c6e2a4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index(
+        'idx_knowledge_project_created_at', 'knowledge_base', ['project_id', 'created_at', 'id']
+    )
+    op.create_index(
+        'idx_invitations_project_created_at', 'project_invitations', ['project_id', 'created_at', 'id']
+    )
+
+
+def downgrade():
+    op.drop_index('idx_invitations_project_created_at', table_name='project_invitations')
+    op.drop_index('idx_knowledge_project_created_at', table_name='knowledge_base')
@@ -0,0 +1,74 @@
+"""ナレッジの一覧用に抜粋と本文の文字数を追加
+
+knowledge_base に excerpt と content_length を追加し、既存の本文からバッチで埋める
+
+Revision ID: f2b8d4a6c1e3
+Revises: e1a9c3d7f5b2
+Create Date: 2026-10-18 19:00:00.000000
+
+"""
+import re
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f2b8d4a6c1e3'
+down_revision = 'e1a9c3d7f5b2'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 500
+EXCERPT_LENGTH = 200
+
+_WHITESPACE = re.compile(r'\s+')
+
+
+def _excerpt(content):
+    """アプリケーションの make_excerpt() と同じ規則で抜粋を作る"""
+    text = _WHITESPACE.sub(' ', content or '').strip()
+    if len(text) <= EXCERPT_LENGTH:
+        return text
+    return text[:EXCERPT_LENGTH - 1].rstrip() + '…'
+
+
+def upgrade():
+    op.add_column('knowledge_base', sa.Column('excerpt', sa.String(length=EXCERPT_LENGTH), nullable=True))
+    op.add_column('knowledge_base', sa.Column('content_length', sa.Integer(), nullable=True))
+
+    # 既存ナレッジの本文をID順にバッチで読み、抜粋と文字数を書き込む
+    bind = op.get_bind()
+    knowledge_base = sa.table(
+        'knowledge_base',
+        sa.column('id', sa.Integer),
+        sa.column('content', sa.Text),
+        sa.column('excerpt', sa.String),
+        sa.column('content_length', sa.Integer)
+    )
+    update = knowledge_base.update().where(
+        knowledge_base.c.id == sa.bindparam('kb_id')
+    ).values(
+        excerpt=sa.bindparam('excerpt'),
+        content_length=sa.bindparam('content_length')
+    )
+    last_id = 0
+    while True:
+        rows = bind.execute(
+            sa.select(knowledge_base.c.id, knowledge_base.c.content)
+            .where(knowledge_base.c.id > last_id)
+            .order_by(knowledge_base.c.id)
+            .limit(BATCH_SIZE)
+        ).fetchall()
+        if not rows:
+            break
+        bind.execute(update, [
+            {'kb_id': kb_id, 'excerpt': _excerpt(content), 'content_length': len(content or '')}
+            for kb_id, content in rows
+        ])
+        last_id = rows[-1][0]
+
+
+def downgrade():
+    op.drop_column('knowledge_base', 'content_length')
+    op.drop_column('knowledge_base', 'excerpt')
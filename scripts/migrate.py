@@ -8,6 +8,7 @@ Flask-Migrate用のスクリプト
 1. マイグレーション初期化: flask db init
 2. マイグレーション生成: flask db migrate -m "コメント"
 3. マイグレーション実行: flask db upgrade
+4. ナレッジ一括インポート: flask knowledge import DIR --project-id N --user-id N
 """
 
 import os
@@ -32,4 +33,5 @@ if __name__ == '__main__':
         print("  flask db init     - マイグレーション初期化")
         print("  flask db migrate  - マイグレーション生成")
         print("  flask db upgrade  - マイグレーション実行")
+        print("  flask knowledge import DIR --project-id N --user-id N - ナレッジ一括インポート")
         print("  python migrate.py - この情報を表示")
@@ -112,3 +112,13 @@ def authenticated_client(client, test_user):
         sess['_user_id'] = str(test_user.id)
         sess['_fresh'] = True
     return client
+
+
+@pytest.fixture
+def no_insert_returning(app, monkeypatch):
+    """INSERT ... RETURNING を使えない方言（MySQL）として振る舞わせる"""
+    dialect = db.engine.dialect
+    for name in ('insert_returning', 'insert_executemany_returning',
+                 'insert_executemany_returning_sort_by_parameter_order'):
+        monkeypatch.setattr(dialect, name, False)
+    return dialect
@@ -80,6 +80,87 @@ class TestAuth:
         assert response.status_code == 401
         assert 'error' in response.json
     
+    def test_user_loader_cache(self, app, authenticated_client, test_user):
+        """認証済みリクエストがusersを引かずにキャッシュを使い、ユーザーの更新で無効化されるテスト"""
+        from sqlalchemy import event
+        from app.models import db, User
+        
+        statements = []
+        
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            if 'FROM users' in statement:
+                statements.append(statement)
+        
+        def get_me():
+            # 本番と同じくリクエストごとに新しいアプリケーションコンテキスト（g・セッション）で呼ぶ
+            with app.app_context():
+                response = authenticated_client.get('/api/v1/auth/me')
+                assert response.status_code == 200
+                return response.json['user']
+        
+        event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            for _ in range(3):
+                assert get_me()['email'] == 'test@example.com'
+            assert len(statements) == 1
+            
+            with app.app_context():
+                user = db.session.get(User, test_user.id)
+                user.email = 'changed@example.com'
+                db.session.commit()
+            statements.clear()
+            
+            assert get_me()['email'] == 'changed@example.com'
+            assert get_me()['email'] == 'changed@example.com'
+            assert len(statements) == 1
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+    
+    def test_password_rehash_and_busy(self, app, client, test_user):
+        """低いコストのハッシュはログイン時に作り直し（下げはしない）、待ちが溢れたら503を返すテスト"""
+        from app.models import db, User
+        from app.auth.passwords import PasswordHasher, hash_cost
+        
+        login_data = {'email': 'test@example.com', 'password': 'testpassword123'}
+        app.extensions['password_hasher'] = PasswordHasher(cost=5, workers=1)
+        response = client.post('/api/v1/auth/login', json=login_data)
+        assert response.status_code == 200
+        user = db.session.get(User, test_user.id)
+        assert hash_cost(user.password_hash) == 5 and user.check_password('testpassword123')
+        
+        # コストの低いワーカーがあっても保存済みのハッシュを下げない
+        app.extensions['password_hasher'] = PasswordHasher(cost=4, workers=1)
+        response = client.post('/api/v1/auth/login', json=login_data)
+        assert response.status_code == 200
+        assert hash_cost(db.session.get(User, test_user.id).password_hash) == 5
+        
+        hasher = PasswordHasher(cost=4, workers=1, max_pending=0, retry_after=3)
+        app.extensions['password_hasher'] = hasher
+        hasher._slots.acquire()  # 実行枠を埋めて混雑状態にする
+        response = client.post('/api/v1/auth/login', json=login_data)
+        assert response.status_code == 503
+        assert response.headers['Retry-After'] == '3'
+        
+        hasher._slots.release()
+        response = client.post('/api/v1/auth/login', json=login_data)
+        assert response.status_code == 200
+    
+    def test_password_cost_calibrated_once(self, tmp_path, monkeypatch):
+        """未指定のコストは初めて使う時に1度だけ調整し、保存した値を他のプロセスも使うテスト"""
+        from app.auth import passwords
+        
+        cost_file = str(tmp_path / 'instance' / 'password_hash_cost')
+        monkeypatch.setattr(passwords, 'calibrate_cost', lambda target_ms: 5)
+        hasher = passwords.PasswordHasher(cost=None, workers=1, cost_file=cost_file)
+        assert not (tmp_path / 'instance').exists()
+        assert passwords.hash_cost(hasher.hash('password')) == 5
+        
+        def fail(target_ms):
+            raise AssertionError('保存済みなら調整しない')
+        monkeypatch.setattr(passwords, 'calibrate_cost', fail)
+        assert passwords.PasswordHasher(cost=None, workers=1, cost_file=cost_file).cost == 5
+        assert sorted(path.name for path in (tmp_path / 'instance').iterdir()) == ['password_hash_cost']
+    
     def test_logout_success(self, client):
         """ログアウト成功テスト"""
         # ユーザー登録とログイン
@@ -41,6 +41,44 @@ class TestKnowledge:
         assert 'knowledge_bases' in response.json
         assert isinstance(response.json['knowledge_bases'], list)
     
+    def test_get_knowledge_bases_paginated(self, authenticated_client, test_project):
+        """カーソルで新しい順にページをたどるテスト"""
+        created = []
+        for number in range(5):
+            response = authenticated_client.post('/api/v1/knowledge', json={
+                'title': f'KB {number}',
+                'content': 'content',
+                'project_id': test_project.id
+            })
+            created.append(response.json['knowledge_base']['id'])
+        
+        seen = []
+        cursor = None
+        while True:
+            url = f'/api/v1/knowledge?project_id={test_project.id}&limit=2'
+            response = authenticated_client.get(url + (f'&cursor={cursor}' if cursor else ''))
+            assert response.status_code == 200
+            assert len(response.json['knowledge_bases']) <= 2
+            seen.extend(kb['id'] for kb in response.json['knowledge_bases'])
+            cursor = response.json['next_cursor']
+            if cursor is None:
+                break
+        assert seen == sorted(created, reverse=True)
+        
+        response = authenticated_client.get(f'/api/v1/knowledge?project_id={test_project.id}&cursor=broken')
+        assert response.status_code == 400
+        response = authenticated_client.get(f'/api/v1/knowledge?project_id={test_project.id}&limit=0')
+        assert response.status_code == 400
+        
+        # カーソルは作成日時とIDの組で往復し、作成日時のない行からは作らない
+        from datetime import datetime
+        from app.utils.pagination import decode_cursor, encode_cursor
+        
+        created_at = datetime(2024, 1, 2, 3, 4, 5)
+        assert decode_cursor(encode_cursor(created_at, 7)) == (created_at, 7)
+        with pytest.raises(ValueError):
+            encode_cursor(None, 7)
+    
     def test_get_knowledge_base_detail(self, authenticated_client, test_knowledge_base):
         """ナレッジベース詳細取得テスト"""
         response = authenticated_client.get(f'/api/v1/knowledge/{test_knowledge_base.id}')
@@ -48,6 +86,223 @@ class TestKnowledge:
         assert 'knowledge_base' in response.json
         assert response.json['knowledge_base']['id'] == test_knowledge_base.id
     
+    def test_tag_filter_and_tag_cloud(self, authenticated_client, test_project):
+        """正規化したタグでの絞り込みとタグクラウドのテスト"""
+        ids = []
+        for title, tags in [('Redis', ['redis', 'cache']), ('Memcached', [' cache ', 'Cache']), ('MySQL', ['db'])]:
+            response = authenticated_client.post('/api/v1/knowledge', json={
+                'title': title,
+                'content': 'content',
+                'project_id': test_project.id,
+                'tags': tags
+            })
+            ids.append(response.json['knowledge_base']['id'])
+        
+        response = authenticated_client.get(f'/api/v1/knowledge?project_id={test_project.id}&tag=cache')
+        assert sorted(kb['id'] for kb in response.json['knowledge_bases']) == sorted(ids[:2])
+        
+        authenticated_client.put(f'/api/v1/knowledge/{ids[2]}', json={'tags': ['cache']})
+        response = authenticated_client.get(f'/projects/{test_project.id}/knowledge?tag=db')
+        assert response.json['knowledge_items'] == []
+        
+        response = authenticated_client.get(f'/api/v1/projects/{test_project.id}/tags')
+        assert response.status_code == 200
+        assert response.json['tags'] == [{'name': 'cache', 'count': 3}, {'name': 'redis', 'count': 1}]
+    
+    def test_tags_are_case_insensitive(self, app, authenticated_client, test_project):
+        """大文字小文字だけが違うタグは既存のタグを使い、同時に作成されたタグは取得し直すテスト"""
+        from app.knowledge.services import _create_tag
+        from app.models import db
+        from app.models.tag import Tag
+        
+        for tags in (['Redis'], ['redis', 'Cache']):
+            authenticated_client.post('/api/v1/knowledge', json={
+                'title': 'Redis',
+                'content': 'content',
+                'project_id': test_project.id,
+                'tags': tags
+            })
+        authenticated_client.post('/api/v1/knowledge/bulk', json=[
+            {'op': 'create', 'project_id': test_project.id, 'title': 'Bulk', 'content': 'content', 'tags': ['REDIS', 'cache']}
+        ])
+        
+        response = authenticated_client.get(f'/api/v1/projects/{test_project.id}/tags')
+        assert response.json['tags'] == [{'name': 'Redis', 'count': 3}, {'name': 'Cache', 'count': 2}]
+        response = authenticated_client.get(f'/api/v1/knowledge?project_id={test_project.id}&tag=REDIS')
+        assert len(response.json['knowledge_bases']) == 3
+        
+        with app.app_context():
+            # 一意制約違反はセーブポイントだけを戻し、既存のタグを返す
+            tag = _create_tag(test_project.id, 'Cache')
+            assert tag.name == 'Cache'
+            db.session.commit()
+            assert Tag.query.filter_by(project_id=test_project.id).count() == 2
+    
+    def test_invalid_tags_are_rejected(self, authenticated_client, test_project, test_knowledge_base):
+        """文字列の配列でないtagsは保存せずに400を返すテスト"""
+        for tags in ([1, {'a': 1}], 'redis'):
+            response = authenticated_client.post('/api/v1/knowledge', json={
+                'title': 'Invalid', 'content': 'content', 'project_id': test_project.id, 'tags': tags
+            })
+            assert response.status_code == 400
+            response = authenticated_client.put(f'/api/v1/knowledge/{test_knowledge_base.id}', json={'tags': tags})
+            assert response.status_code == 400
+            response = authenticated_client.post('/api/v1/knowledge/bulk', json=[
+                {'op': 'create', 'project_id': test_project.id, 'title': 'Invalid', 'tags': tags}
+            ])
+            assert response.json['results'][0]['status'] == 'error'
+        
+        response = authenticated_client.get(f'/api/v1/knowledge?project_id={test_project.id}')
+        assert [kb['title'] for kb in response.json['knowledge_bases']] == ['Test Knowledge Base']
+        response = authenticated_client.post(f'/api/v1/knowledge/{test_knowledge_base.id}/search', json={'query': 'test'})
+        assert response.status_code == 200
+    
+    def test_list_summary_fields(self, authenticated_client, test_project):
+        """一覧は既定で本文の代わりに抜粋と文字数を返し、fieldsで項目を選べるテスト"""
+        content = 'line one\n\n' + 'x' * 300
+        authenticated_client.post('/api/v1/knowledge', json={
+            'title': 'Long',
+            'content': content,
+            'project_id': test_project.id
+        })
+        
+        response = authenticated_client.get(f'/api/v1/knowledge?project_id={test_project.id}')
+        item = response.json['knowledge_bases'][0]
+        assert 'content' not in item
+        assert item['content_length'] == len(content)
+        assert item['excerpt'].startswith('line one xxx')
+        assert len(item['excerpt']) == 200 and item['excerpt'].endswith('…')
+        
+        response = authenticated_client.get(f'/projects/{test_project.id}/knowledge?fields=id,title,content')
+        assert response.json['knowledge_items'] == [
+            {'id': item['id'], 'title': 'Long', 'content': content}
+        ]
+        
+        response = authenticated_client.get(f'/api/v1/knowledge?project_id={test_project.id}&fields=id,body')
+        assert response.status_code == 400
+    
+    def test_bulk_write(self, app, authenticated_client, test_project):
+        """一括作成・更新・削除が操作ごとの結果を返し、失敗した操作以外は反映されるテスト"""
+        import json
+        from app.models import db, KnowledgeBase, KnowledgeChunk
+        
+        response = authenticated_client.post('/api/v1/knowledge/bulk', json=[
+            {'op': 'create', 'project_id': test_project.id, 'title': 'Redis', 'content': 'redis cache memo', 'tags': ['cache']},
+            {'op': 'create', 'project_id': test_project.id, 'content': 'no title'},
+            {'op': 'create', 'project_id': test_project.id, 'title': 'MySQL', 'content': 'mysql index tuning'}
+        ])
+        assert response.status_code == 207
+        assert response.json['succeeded'] == 2 and response.json['failed'] == 1
+        results = response.json['results']
+        assert [result['status'] for result in results] == ['created', 'error', 'created']
+        redis_id, mysql_id = results[0]['id'], results[2]['id']
+        
+        operations = [
+            {'op': 'update', 'id': redis_id, 'content': 'redis sentinel memo', 'tags': ['ha']},
+            {'op': 'delete', 'id': mysql_id},
+            {'op': 'delete', 'id': 999999}
+        ]
+        response = authenticated_client.post(
+            '/api/v1/knowledge/bulk',
+            data='\n'.join(json.dumps(operation) for operation in operations),
+            content_type='application/x-ndjson'
+        )
+        assert [result['status'] for result in response.json['results']] == ['updated', 'deleted', 'error']
+        
+        with app.app_context():
+            redis = db.session.get(KnowledgeBase, redis_id)
+            assert redis.excerpt == 'redis sentinel memo' and redis.content_length == 19
+            assert [chunk.content for chunk in redis.chunks] == ['redis sentinel memo']
+            assert db.session.get(KnowledgeBase, mysql_id) is None
+            assert KnowledgeChunk.query.filter_by(knowledge_base_id=mysql_id).count() == 0
+        
+        response = authenticated_client.get(f'/api/v1/projects/{test_project.id}/tags')
+        assert response.json['tags'] == [{'name': 'ha', 'count': 1}]
+        response = authenticated_client.post(f'/api/v1/knowledge/{redis_id}/search', json={'query': 'sentinel'})
+        assert [result['id'] for result in response.json['results']] == [redis_id]
+        
+        response = authenticated_client.post('/api/v1/knowledge/bulk', data='{"op": ', content_type='application/x-ndjson')
+        assert response.status_code == 400
+    
+    def test_bulk_write_without_returning(self, app, authenticated_client, test_project, no_insert_returning):
+        """RETURNINGのない方言（MySQL）でも一括作成のIDとタグが行と同じ順で対応するテスト"""
+        from app.models import db, KnowledgeBase
+        
+        response = authenticated_client.post('/api/v1/knowledge/bulk', json=[
+            {'op': 'create', 'project_id': test_project.id, 'title': f'KB {number}',
+             'content': f'body {number}', 'tags': [f'tag{number}', 'common']}
+            for number in range(3)
+        ])
+        assert response.status_code == 200
+        kb_ids = [result['id'] for result in response.json['results']]
+        
+        with app.app_context():
+            for number, kb_id in enumerate(kb_ids):
+                kb = db.session.get(KnowledgeBase, kb_id)
+                assert kb.title == f'KB {number}'
+                assert [chunk.content for chunk in kb.chunks] == [f'body {number}']
+        response = authenticated_client.get(f'/api/v1/projects/{test_project.id}/tags')
+        assert response.json['tags'][0] == {'name': 'common', 'count': 3}
+    
+    def test_import_command(self, app, test_user, test_project, tmp_path):
+        """flask knowledge import が重複を除いて取り込み、チェックポイントから再開するテスト"""
+        import json
+        from app.models import KnowledgeBase, KnowledgeChunk
+        
+        (tmp_path / 'docs').mkdir()
+        (tmp_path / 'docs' / 'redis.md').write_text('# Redis\n\nキャッシュの設定', encoding='utf-8')
+        (tmp_path / 'docs' / 'copy.md').write_text('# Redis\n\nキャッシュの設定', encoding='utf-8')
+        (tmp_path / 'items.json').write_text(json.dumps([
+            {'title': 'MySQL', 'content': 'インデックス', 'tags': ['db']},
+            {'title': 'Nginx', 'content': 'リバースプロキシ'}
+        ]), encoding='utf-8')
+        (tmp_path / 'broken.jsonl').write_text('{"title": ', encoding='utf-8')
+        checkpoint = tmp_path / 'checkpoint.json'
+        
+        runner = app.test_cli_runner()
+        args = ['knowledge', 'import', str(tmp_path), '--project-id', str(test_project.id),
+                '--user-id', str(test_user.id), '--workers', '2', '--batch-size', '2',
+                '--checkpoint', str(checkpoint)]
+        result = runner.invoke(args=args)
+        assert result.exit_code == 0, result.output
+        assert '3件を取り込み' in result.output and '重複 1件' in result.output and 'docs/s' in result.output
+        assert 'broken.jsonl' in result.output
+        assert not checkpoint.exists()
+        
+        with app.app_context():
+            titles = sorted(kb.title for kb in KnowledgeBase.query.filter_by(project_id=test_project.id))
+            assert titles == ['MySQL', 'Nginx', 'Redis']
+            assert KnowledgeChunk.query.count() == 3
+            redis = KnowledgeBase.query.filter_by(title='Redis').one()
+            assert redis.excerpt == '# Redis キャッシュの設定' and redis.created_by_id == test_user.id
+        
+        # 取り込み済みのファイルはチェックポイントで飛ばし、そうでなくても本文のハッシュで重複を除く
+        checkpoint.write_text(json.dumps({'files': ['items.json']}))
+        result = runner.invoke(args=args)
+        assert '0件を取り込み' in result.output and '重複 2件' in result.output
+        assert '1ファイルをスキップ' in result.output
+    
+    def test_import_without_returning(self, app, test_user, test_project, tmp_path, no_insert_returning):
+        """RETURNINGのない方言（MySQL）でも flask knowledge import がチャンクとタグを正しいナレッジに書き込むテスト"""
+        import json
+        from app.models import KnowledgeBase
+        
+        (tmp_path / 'items.json').write_text(json.dumps([
+            {'title': 'MySQL', 'content': 'インデックス', 'tags': ['db']},
+            {'title': 'Nginx', 'content': 'リバースプロキシ', 'tags': ['web']}
+        ]), encoding='utf-8')
+        result = app.test_cli_runner().invoke(args=[
+            'knowledge', 'import', str(tmp_path), '--project-id', str(test_project.id),
+            '--user-id', str(test_user.id), '--workers', '1'
+        ])
+        assert result.exit_code == 0, result.output
+        
+        with app.app_context():
+            for title, content, tag in [('MySQL', 'インデックス', 'db'), ('Nginx', 'リバースプロキシ', 'web')]:
+                kb = KnowledgeBase.query.filter_by(title=title).one()
+                assert [chunk.content for chunk in kb.chunks] == [content]
+                assert [link.tag.name for link in kb.tag_links] == [tag]
+    
     def test_search_knowledge_base(self, authenticated_client, test_knowledge_base):
         """ナレッジベース検索テスト"""
         search_data = {
@@ -58,6 +313,48 @@ class TestKnowledge:
         assert response.status_code == 200
         assert 'results' in response.json
     
+    def test_search_knowledge_base_returns_hits(self, authenticated_client, test_project):
+        """検索結果がスコア付きで返るテスト"""
+        for title, content in [('Deploy guide', 'gunicorn and nginx'), ('Tuning', 'mysql index')]:
+            authenticated_client.post('/api/v1/knowledge', json={
+                'title': title,
+                'content': content,
+                'project_id': test_project.id
+            })
+        
+        response = authenticated_client.get(f'/api/v1/knowledge?project_id={test_project.id}')
+        kb_id = response.json['knowledge_bases'][0]['id']
+        
+        response = authenticated_client.post(f'/api/v1/knowledge/{kb_id}/search', json={'query': 'gunicorn'})
+        assert response.status_code == 200
+        results = response.json['results']
+        assert len(results) == 1
+        assert results[0]['title'] == 'Deploy guide'
+        assert results[0]['score'] > 0
+    
+    def test_search_knowledge_base_not_found(self, authenticated_client):
+        """存在しないナレッジベースの検索テスト"""
+        response = authenticated_client.post('/api/v1/knowledge/9999/search', json={'query': 'test'})
+        assert response.status_code == 404
+    
+    def test_search_knowledge_base_forbidden(self, app, authenticated_client):
+        """参加していないプロジェクトのナレッジベースは検索できないテスト"""
+        from app.knowledge.services import create_knowledge_base
+        from app.models import User, db
+        from app.projects.services import ProjectService
+        
+        with app.app_context():
+            other = User(email='other@example.com', username='other', email_verified=True)
+            other.set_password('password123')
+            db.session.add(other)
+            db.session.commit()
+            private_id = ProjectService.create_project('Private', '', other.id).id
+            kb_id = create_knowledge_base('Redis 非公開', 'redis', private_id, created_by_id=other.id).id
+        
+        response = authenticated_client.post(f'/api/v1/knowledge/{kb_id}/search', json={'query': 'redis'})
+        assert response.status_code == 403
+        assert 'error' in response.json
+    
     def test_unauthorized_access(self, client, test_project):
         """未認証でのアクセステスト"""
         response = client.get(f'/api/v1/knowledge?project_id={test_project.id}')
@@ -96,3 +96,59 @@ class TestKnowledgeBaseModel:
             assert 'title' in kb_dict
             assert 'content' in kb_dict
             assert 'project_id' in kb_dict
+
+
+class TestListQueries:
+    """一覧のto_dict()で追加のクエリ（N+1）が発行されないことのテスト"""
+    
+    @staticmethod
+    def _count_queries(app, func):
+        from sqlalchemy import event
+        
+        statements = []
+        
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+        
+        event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            func()
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+        return len(statements)
+    
+    def test_list_serialization_is_single_query(self, app, test_project):
+        """件数によらず一覧とシリアライズが1クエリで済むテスト"""
+        from datetime import datetime, timedelta
+        from app.knowledge.services import get_project_knowledge_bases
+        from app.models import ProjectInvitation
+        from app.models.knowledge import KNOWLEDGE_SUMMARY_FIELDS
+        from app.projects.services import ProjectService
+        
+        with app.app_context():
+            owner_id = test_project.owner_id
+            for number in range(5):
+                member = User(email=f'member{number}@example.com', username=f'member{number}', email_verified=True)
+                member.set_password('password123')
+                db.session.add(member)
+                db.session.flush()
+                ProjectService.add_member(test_project.id, member.id)
+                db.session.add(KnowledgeBase(
+                    title=f'KB {number}', content='content', project_id=test_project.id, created_by_id=member.id
+                ))
+                db.session.add(ProjectInvitation(
+                    project_id=test_project.id, email=f'invite{number}@example.com', invited_by_id=owner_id,
+                    token=f'token-{number}', expires_at=datetime.utcnow() + timedelta(days=7)
+                ))
+            db.session.commit()
+            db.session.expunge_all()
+            
+            def list_all():
+                items, _ = get_project_knowledge_bases(test_project.id)
+                assert len([item.to_dict(KNOWLEDGE_SUMMARY_FIELDS) for item in items]) == 5
+                projects, _ = ProjectService.get_user_projects(owner_id)
+                assert projects[0]['member_count'] == 6
+                invitations, _ = ProjectService.get_project_invitations(test_project.id)
+                assert len([invitation.to_dict() for invitation in invitations]) == 5
+            
+            assert self._count_queries(app, list_all) == 3
@@ -38,6 +38,21 @@ class TestProjects:
         assert 'projects' in response.json
         assert isinstance(response.json['projects'], list)
     
+    def test_get_projects_paginated(self, authenticated_client):
+        """プロジェクト一覧のカーソルページネーションテスト"""
+        for number in range(3):
+            authenticated_client.post('/api/v1/projects', json={'name': f'Project {number}'})
+        
+        response = authenticated_client.get('/api/v1/projects?limit=2')
+        first_page = response.json['projects']
+        assert len(first_page) == 2
+        assert response.json['next_cursor']
+        
+        response = authenticated_client.get(f"/projects?limit=2&cursor={response.json['next_cursor']}")
+        assert [project['name'] for project in response.json['projects']] == ['Project 0']
+        assert response.json['next_cursor'] is None
+        assert [project['name'] for project in first_page] == ['Project 2', 'Project 1']
+    
     def test_get_project_detail(self, app, authenticated_client, test_user, test_project):
         """プロジェクト詳細取得テスト"""
         with app.app_context():
@@ -54,3 +69,128 @@ class TestProjects:
         response = client.get('/api/v1/projects')
         assert response.status_code == 401
         assert 'error' in response.json
+    
+    def test_build_context(self, app, authenticated_client, test_project):
+        """コンテキスト取得テスト（重複除去とトークン予算）"""
+        app.config['SEARCH_CHUNK_MAX_TOKENS'] = 20
+        app.config['SEARCH_CHUNK_OVERLAP_TOKENS'] = 10
+        content = '\n\n'.join(f'キャッシュ設定{i}について説明します。' for i in range(6))
+        for title in ('キャッシュ', 'キャッシュ（複製）'):
+            response = authenticated_client.post('/api/v1/knowledge', json={
+                'title': title,
+                'content': content,
+                'project_id': test_project.id
+            })
+            assert response.status_code == 201
+        
+        response = authenticated_client.post(f'/api/v1/projects/{test_project.id}/context', json={
+            'query': 'キャッシュ設定',
+            'token_budget': 60
+        })
+        assert response.status_code == 200
+        context = response.json['context']
+        texts = [passage['text'] for passage in context['passages']]
+        assert texts
+        assert len(texts) == len(set(texts))
+        assert context['used_tokens'] <= 60
+        assert context['sources'] == sorted({p['knowledge_base_id'] for p in context['passages']})
+        
+        # 同じナレッジ内で選ばれた範囲は重ならない
+        spans = sorted(
+            (p['knowledge_base_id'], p['start_offset'], p['end_offset'])
+            for p in context['passages']
+        )
+        for previous, current in zip(spans, spans[1:]):
+            if previous[0] == current[0]:
+                assert previous[2] <= current[1]
+    
+    def test_build_context_requires_query(self, authenticated_client, test_project):
+        """クエリなしのコンテキスト取得テスト"""
+        response = authenticated_client.post(f'/api/v1/projects/{test_project.id}/context', json={})
+        assert response.status_code == 400
+        response = authenticated_client.post(f'/api/v1/projects/{test_project.id}/context', json={
+            'query': 'キャッシュ',
+            'token_budget': True
+        })
+        assert response.status_code == 400
+    
+    def test_export_project(self, app, authenticated_client, test_project):
+        """ナレッジをNDJSON・CSV・gzipでストリーミングエクスポートするテスト"""
+        import csv
+        import gzip
+        import io
+        import json
+        
+        for number in range(3):
+            authenticated_client.post('/api/v1/knowledge', json={
+                'title': f'KB {number}',
+                'content': f'本文 {number}\n2行目',
+                'project_id': test_project.id,
+                'tags': ['a', 'b'] if number == 0 else None
+            })
+        app.config['EXPORT_BATCH_SIZE'] = 2
+        
+        response = authenticated_client.get(f'/api/v1/projects/{test_project.id}/export')
+        assert response.status_code == 200
+        assert response.mimetype == 'application/x-ndjson'
+        rows = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        assert [row['title'] for row in rows] == ['KB 0', 'KB 1', 'KB 2']
+        assert rows[0]['content'] == '本文 0\n2行目' and rows[0]['tags'] == ['a', 'b']
+        
+        response = authenticated_client.get(f'/api/v1/projects/{test_project.id}/export?format=csv&gzip=true')
+        assert response.mimetype == 'application/gzip'
+        assert 'project-' in response.headers['Content-Disposition']
+        text = gzip.decompress(response.get_data()).decode('utf-8')
+        records = list(csv.DictReader(io.StringIO(text)))
+        assert [record['title'] for record in records] == ['KB 0', 'KB 1', 'KB 2']
+        assert records[0]['content'] == '本文 0\n2行目' and json.loads(records[0]['tags']) == ['a', 'b']
+        
+        response = authenticated_client.get(f'/api/v1/projects/{test_project.id}/export?format=xml')
+        assert response.status_code == 400
+    
+    def test_membership_cache(self, app, test_user, test_project):
+        """権限確認がリクエスト内とTTL内ではDBを引かず、メンバーの変更で無効化されるテスト"""
+        from sqlalchemy import event
+        from app.models import db, User
+        from app.projects.services import ProjectService
+        
+        statements = []
+        
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            if 'project_members' in statement:
+                statements.append(statement)
+        
+        with app.app_context():
+            member = User(email='member@example.com', username='member', email_verified=True)
+            admin = User(email='admin@example.com', username='admin', email_verified=True)
+            for user in (member, admin):
+                user.set_password('password123')
+                db.session.add(user)
+            db.session.commit()
+            member_id = member.id
+            ProjectService.add_member(test_project.id, admin.id, 'admin')
+            
+            event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+            try:
+                with app.test_request_context():
+                    assert ProjectService.check_user_permission(test_project.id, test_user.id)
+                    assert not ProjectService.check_user_permission(test_project.id, test_user.id, 'admin')
+                    assert test_project.id in ProjectService.get_user_project_ids(test_user.id)
+                    assert not ProjectService.check_user_permission(test_project.id, member_id)
+                assert len(statements) == 2
+                
+                with app.test_request_context():
+                    assert ProjectService.check_user_permission(test_project.id, test_user.id)
+                    assert len(statements) == 2
+                    
+                    ProjectService.add_member(test_project.id, member_id)
+                    assert ProjectService.check_user_permission(test_project.id, member_id)
+                    assert not ProjectService.check_user_permission(test_project.id, member_id, 'admin')
+                    
+                    assert ProjectService.remove_member(test_project.id, member_id, admin.id)[0]
+                    assert not ProjectService.check_user_permission(test_project.id, member_id)
+                    
+                    ProjectService.delete_project(test_project.id)
+                    assert not ProjectService.check_user_permission(test_project.id, test_user.id)
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
@@ -0,0 +1,1059 @@
+# -*- coding: utf-8 -*-
+"""
+検索エンジン関連のテスト
+"""
+
+import pytest
+from app.search import InvertedIndex, NGramTokenizer, get_tokenizer, normalize
+
+
+class TestInvertedIndex:
+    """転置インデックスのテスト"""
+    
+    def _build_index(self):
+        index = InvertedIndex()
+        index.add_document(1, title='Flask deployment guide', content='How to deploy flask with gunicorn')
+        index.add_document(2, title='MySQL tuning', content='Index design for mysql tables')
+        index.add_document(3, title='Gunicorn workers', content='Worker settings', tags=['flask'])
+        return index
+    
+    def test_search_ranks_by_bm25(self):
+        """BM25スコア順に返すテスト"""
+        index = self._build_index()
+        hits = index.search('gunicorn')
+        
+        assert [hit.doc_id for hit in hits] == [3, 1]
+        assert hits[0].score > hits[1].score > 0
+    
+    def test_search_limit(self):
+        """上位件数制限のテスト"""
+        index = self._build_index()
+        hits = index.search('flask gunicorn mysql', limit=2)
+        
+        assert len(hits) == 2
+    
+    def test_search_no_match(self):
+        """一致しないクエリのテスト"""
+        index = self._build_index()
+        
+        assert index.search('redis') == []
+        assert index.search('') == []
+    
+    def test_postings_are_arrays(self):
+        """ポスティングリストが配列で保持されるテスト"""
+        index = self._build_index()
+        postings = index._postings['flask']
+        
+        assert list(postings.doc_ids) == [0, 2]
+        assert postings.freqs.typecode == 'I'
+    
+    def test_replace_document(self):
+        """同一文書の再追加で置き換わるテスト"""
+        index = self._build_index()
+        index.add_document(1, title='Redis cache')
+        
+        assert [hit.doc_id for hit in index.search('gunicorn')] == [3]
+        assert [hit.doc_id for hit in index.search('redis')] == [1]
+        assert index.tombstone_count == 1
+    
+    def test_remove_and_compact(self):
+        """墓標化と圧縮のテスト"""
+        index = self._build_index()
+        assert index.remove_document(3)
+        assert not index.remove_document(3)
+        assert [hit.doc_id for hit in index.search('gunicorn')] == [1]
+        
+        compacted = index.compacted()
+        assert compacted.tombstone_count == 0
+        assert len(compacted) == 2
+        assert list(compacted._postings['flask'].doc_ids) == [0]
+        assert [hit.doc_id for hit in compacted.search('gunicorn')] == [1]
+
+
+class TestTokenizer:
+    """トークナイザのテスト"""
+    
+    def test_normalize_width_and_kana(self):
+        """幅とカナの正規化テスト"""
+        assert normalize('ＦＬＡＳＫ') == 'flask'
+        assert normalize('ﾅﾚｯｼﾞ') == normalize('ナレッジ') == 'なれっじ'
+    
+    def test_ngram_japanese(self):
+        """日本語部分の文字n-gram分割テスト"""
+        tokenizer = NGramTokenizer(ngram_sizes=(2, 3))
+        tokens = tokenizer('検索API')
+        
+        assert tokens == ['検索', 'api']
+        assert tokenizer('東京都') == ['東京', '京都', '東京都']
+    
+    def test_ngram_cache(self):
+        """n-gram展開のキャッシュテスト"""
+        tokenizer = NGramTokenizer()
+        tokenizer.tokenize_batch(['全文検索', '全文検索'])
+        
+        assert tokenizer.cache_info().hits >= 1
+    
+    def test_japanese_search(self):
+        """日本語文書の検索テスト"""
+        index = InvertedIndex(tokenizer=NGramTokenizer())
+        index.add_document(1, title='データベース設計', content='インデックスの作り方')
+        index.add_document(2, title='デプロイ手順', content='ｻｰﾊﾞｰへの配置方法')
+        
+        assert [hit.doc_id for hit in index.search('サーバー')] == [2]
+        assert index.search('でーたべーす')[0].doc_id == 1
+    
+    def test_unknown_tokenizer(self):
+        """不明なトークナイザ名のテスト"""
+        with pytest.raises(ValueError):
+            get_tokenizer('unknown')
+
+
+class TestSearchIndexMaintenance:
+    """検索インデックスの差分更新テスト"""
+    
+    def _search(self, client, kb_id, query):
+        response = client.post(f'/api/v1/knowledge/{kb_id}/search', json={'query': query})
+        return [result['id'] for result in response.json['results']]
+    
+    def test_incremental_updates(self, authenticated_client, test_knowledge_base):
+        """作成・更新・削除が検索結果に反映されるテスト"""
+        kb_id = test_knowledge_base.id
+        project_id = test_knowledge_base.project_id
+        assert self._search(authenticated_client, kb_id, 'ナレッジ') == []
+        
+        response = authenticated_client.post('/api/v1/knowledge', json={
+            'title': 'ナレッジ共有',
+            'content': '社内ナレッジの書き方',
+            'project_id': project_id
+        })
+        new_id = response.json['knowledge_base']['id']
+        assert self._search(authenticated_client, kb_id, 'ナレッジ') == [new_id]
+        
+        authenticated_client.put(f'/api/v1/knowledge/{new_id}', json={'title': '議事録', 'content': '会議メモ'})
+        assert self._search(authenticated_client, kb_id, 'ナレッジ') == []
+        assert self._search(authenticated_client, kb_id, '議事録') == [new_id]
+        
+        authenticated_client.delete(f'/api/v1/knowledge/{new_id}')
+        assert self._search(authenticated_client, kb_id, '議事録') == []
+        
+        response = authenticated_client.get(f'/api/v1/projects/{project_id}/search/status')
+        status = response.json['status']
+        assert status['loaded']
+        assert status['revision'] == 3
+        assert status['documents'] == 1
+        assert status['last_indexed_at'] is not None
+    
+    def test_other_worker_writes(self, app, authenticated_client, test_knowledge_base, monkeypatch):
+        """他のワーカーの書き込み（DB上の世代番号が進む）でメモリ上の索引が作り直されるテスト"""
+        from app.models import db, KnowledgeBase
+        from app.search.generations import bump_generation
+        
+        monkeypatch.setitem(app.extensions, 'query_cache', None)
+        kb_id = test_knowledge_base.id
+        project_id = test_knowledge_base.project_id
+        assert self._search(authenticated_client, kb_id, 'ナレッジ') == []
+        response = authenticated_client.post('/api/v1/search', json={'query': 'ナレッジ'})
+        assert response.json['results'] == []
+        
+        # DBに行を追加して世代番号だけを進める（このプロセスの索引には反映しない）
+        with app.app_context():
+            kb = KnowledgeBase(
+                title='ナレッジ共有',
+                content='社内ナレッジの書き方',
+                project_id=project_id,
+                created_by_id=test_knowledge_base.created_by_id
+            )
+            db.session.add(kb)
+            db.session.commit()
+            new_id = kb.id
+            bump_generation(project_id)
+        
+        assert self._search(authenticated_client, kb_id, 'ナレッジ') == [new_id]
+        response = authenticated_client.get(f'/api/v1/projects/{project_id}/suggest?q=ナレ')
+        assert 'ナレッジ共有' in [s['text'] for s in response.json['suggestions']]
+        response = authenticated_client.post('/api/v1/search', json={'query': 'ナレッジ'})
+        assert [result['id'] for result in response.json['results']] == [new_id]
+        
+        # 自分の書き込みでは索引を作り直さない
+        from app.search import get_search_engine
+        with app.app_context():
+            index = get_search_engine().get_index(project_id)
+        authenticated_client.put(f'/api/v1/knowledge/{new_id}', json={'title': '議事録'})
+        assert self._search(authenticated_client, kb_id, '議事録') == [new_id]
+        with app.app_context():
+            assert get_search_engine().get_index(project_id) is index
+    
+    def test_indexing_failure_after_commit(self, app, authenticated_client, test_knowledge_base, monkeypatch):
+        """コミット後の索引への反映に失敗しても保存は成功として返し、次の検索で索引を作り直すテスト"""
+        from app.models import db, KnowledgeBase
+        from app.search.generations import bump_generation
+        
+        monkeypatch.setitem(app.extensions, 'query_cache', None)
+        kb_id = test_knowledge_base.id
+        project_id = test_knowledge_base.project_id
+        assert self._search(authenticated_client, kb_id, 'ナレッジ') == []
+        
+        def fail(*args, **kwargs):
+            raise RuntimeError('index failure')
+        
+        with monkeypatch.context() as m:
+            m.setattr(app.extensions['vector_search'], 'index_document', fail)
+            response = authenticated_client.post('/api/v1/knowledge', json={
+                'title': 'ナレッジ共有',
+                'content': '社内ナレッジの書き方',
+                'project_id': project_id
+            })
+        assert response.status_code == 201
+        new_id = response.json['knowledge_base']['id']
+        response = authenticated_client.post(
+            f'/api/v1/knowledge/{kb_id}/search', json={'query': 'ナレッジ', 'mode': 'semantic'}
+        )
+        assert new_id in [result['id'] for result in response.json['results']]
+        
+        # 文字列以外のタグを持つ既存の行があっても検索できる
+        with app.app_context():
+            kb = KnowledgeBase(
+                title='議事録',
+                content='会議メモ',
+                tags=[1, 'redis'],
+                project_id=project_id,
+                created_by_id=test_knowledge_base.created_by_id
+            )
+            db.session.add(kb)
+            db.session.commit()
+            legacy_id = kb.id
+            bump_generation(project_id)
+        assert self._search(authenticated_client, kb_id, '議事録') == [legacy_id]
+        assert self._search(authenticated_client, kb_id, 'redis') == [legacy_id]
+        response = authenticated_client.post(
+            f'/api/v1/knowledge/{kb_id}/search', json={'query': '議事録', 'mode': 'hybrid'}
+        )
+        assert response.status_code == 200
+        assert legacy_id in [result['id'] for result in response.json['results']]
+    
+    def test_compaction(self, app, test_knowledge_base):
+        """墓標の圧縮テスト"""
+        from app.search import get_search_engine
+        from app.models import db, KnowledgeBase
+        
+        with app.app_context():
+            engine = get_search_engine()
+            kb = db.session.get(KnowledgeBase, test_knowledge_base.id)
+            engine.get_index(kb.project_id)
+            for _ in range(3):
+                engine.index_document(kb)
+            assert engine.status(kb.project_id)['tombstones'] == 3
+            
+            engine.compact(kb.project_id)
+            assert engine.status(kb.project_id)['tombstones'] == 0
+            assert engine.status(kb.project_id)['documents'] == 1
+
+
+class TestSegments:
+    """ディスクセグメントのテスト"""
+    
+    def _documents(self):
+        return [
+            (10, 'Flask deployment guide', 'How to deploy flask with gunicorn', None),
+            (20, 'MySQL tuning', 'Index design for mysql tables', ['db']),
+            (30, 'Gunicorn workers', 'ワーカー設定', ['flask']),
+        ]
+    
+    def test_segment_round_trip(self, tmp_path):
+        """セグメントの書き出しと読み込みでスコアが一致するテスト"""
+        from app.search.segments import Segment, write_index_segment
+        
+        index = InvertedIndex()
+        for doc_id, title, content, tags in self._documents():
+            index.add_document(doc_id, title=title, content=content, tags=tags)
+        path = str(tmp_path / '000001.seg')
+        write_index_segment(path, index)
+        
+        segment = Segment(path)
+        assert len(segment) == 3
+        assert segment.find(20) == 1
+        assert segment.find(15) is None
+        assert list(segment.postings('flask').doc_ids) == list(index.postings('flask').doc_ids)
+        assert segment.postings('redis') is None
+        segment.close()
+    
+    def test_segmented_index_persistence(self, tmp_path):
+        """書き込みが永続化され、開き直しても検索できるテスト"""
+        from app.search.store import SegmentedIndex
+        
+        directory = str(tmp_path / 'project_1')
+        index = SegmentedIndex(directory)
+        index.rebuild(self._documents())
+        index.add_document(40, title='Redis cache')
+        index.remove_document(20)
+        memory_hits = index.search('gunicorn flask')
+        
+        reopened = SegmentedIndex.open(directory)
+        assert len(reopened) == 3
+        assert reopened.search('gunicorn flask') == memory_hits
+        assert [hit.doc_id for hit in reopened.search('redis')] == [40]
+        assert reopened.search('mysql') == []
+    
+    def test_workers_see_each_other(self, tmp_path):
+        """別インスタンス（別ワーカー相当）の書き込みが反映されるテスト"""
+        from app.search.store import SegmentedIndex
+        
+        directory = str(tmp_path / 'project_1')
+        writer = SegmentedIndex(directory)
+        writer.rebuild(self._documents())
+        reader = SegmentedIndex.open(directory)
+        
+        writer.add_document(10, title='Renamed entry', content='nothing here')
+        assert [hit.doc_id for hit in reader.search('gunicorn')] == [30]
+    
+    def test_merge_segments(self, tmp_path):
+        """セグメント数が上限に達すると統合されるテスト"""
+        from app.search.store import SegmentedIndex
+        
+        index = SegmentedIndex(str(tmp_path / 'project_1'), merge_factor=3)
+        for doc_id in range(1, 6):
+            index.add_document(doc_id, title=f'entry {doc_id}', content='共通の本文')
+        # 1件のセグメント3つが3件のセグメントにまとまり、残りの2件はそれぞれのまま
+        assert sorted(segment.doc_count for segment in index.segments) == [1, 1, 3]
+        
+        index.remove_document(1)
+        index.compacted()
+        assert len(index.segments) == 1
+        assert index.tombstone_count == 0
+        assert sorted(hit.doc_id for hit in index.search('共通')) == [2, 3, 4, 5]
+    
+    def test_tiered_merge_keeps_base_segment(self, tmp_path):
+        """小さいセグメントだけが同じ規模どうしで統合され、大きな基底セグメントは書き直されないテスト"""
+        from app.search.store import SegmentedIndex
+        
+        index = SegmentedIndex(str(tmp_path / 'project_1'), merge_factor=3)
+        index.rebuild((doc_id, f'base {doc_id}', '共通の本文', None) for doc_id in range(1000, 1100))
+        base = index.segments[0].name
+        for doc_id in range(1, 31):
+            index.add_document(doc_id, title=f'entry {doc_id}', content='共通の本文')
+            assert index.segments[0].name == base
+            # 基底以外の各階層に残るのはmerge_factor未満
+            tiers = [index._tier(segment) for segment in index.segments[1:]]
+            assert all(tiers.count(tier) < 3 for tier in tiers)
+        
+        assert len(index.segments) <= 1 + 2 * 3
+        assert len(index.search('共通', limit=200)) == 130
+    
+    def test_engine_with_index_dir(self, app, authenticated_client, test_knowledge_base, tmp_path):
+        """永続化を有効にした検索エンジンのテスト"""
+        from app.search import get_search_engine
+        
+        with app.app_context():
+            engine = get_search_engine()
+            engine.index_dir = str(tmp_path)
+        
+        kb_id = test_knowledge_base.id
+        response = authenticated_client.post(f'/api/v1/knowledge/{kb_id}/search', json={'query': 'Test'})
+        assert [result['id'] for result in response.json['results']] == [kb_id]
+        
+        # 別ワーカー相当：メモリ上のインデックスを捨ててもディスクから開ける
+        with app.app_context():
+            engine.invalidate()
+            index = engine.get_index(test_knowledge_base.project_id)
+            assert len(index.segments) == 1
+            assert [hit.doc_id for hit in index.search('Test')] == [kb_id]
+
+
+class TestFullTextBackend:
+    """DB全文検索バックエンドのテスト（SQLite FTS5）"""
+    
+    def _search(self, client, kb_id, query):
+        response = client.post(f'/api/v1/knowledge/{kb_id}/search', json={'query': query})
+        return [result['id'] for result in response.json['results']]
+    
+    def test_fulltext_search(self, app, authenticated_client, test_knowledge_base):
+        """FTS5の影テーブルがトリガーで同期されるテスト"""
+        from app.search import FullTextSearchBackend
+        
+        if app.config['SQLALCHEMY_DATABASE_URI'].startswith('mysql'):
+            pytest.skip('SQLite専用のテスト')
+        app.extensions['search_backend'] = FullTextSearchBackend()
+        
+        kb_id = test_knowledge_base.id
+        project_id = test_knowledge_base.project_id
+        assert self._search(authenticated_client, kb_id, 'Knowledge') == [kb_id]
+        
+        response = authenticated_client.post('/api/v1/knowledge', json={
+            'title': 'データベース設計',
+            'content': '全文検索の索引について',
+            'project_id': project_id
+        })
+        new_id = response.json['knowledge_base']['id']
+        assert self._search(authenticated_client, kb_id, '全文検索') == [new_id]
+        
+        authenticated_client.put(f'/api/v1/knowledge/{new_id}', json={'content': '更新後の本文'})
+        assert self._search(authenticated_client, kb_id, '全文検索') == []
+        assert self._search(authenticated_client, kb_id, 'データベース') == [new_id]
+        
+        authenticated_client.delete(f'/api/v1/knowledge/{new_id}')
+        assert self._search(authenticated_client, kb_id, 'データベース') == []
+        
+        # 3文字未満の語は対象外
+        assert self._search(authenticated_client, kb_id, 'DB') == []
+    
+    def test_facets_share_one_bounded_match(self, app, authenticated_client, test_knowledge_base):
+        """ファセットの件数を検索と同じ1回のMATCHから、上限件数までで数えるテスト"""
+        from sqlalchemy import event
+        from app.models import db
+        from app.search import FullTextSearchBackend
+        
+        if app.config['SQLALCHEMY_DATABASE_URI'].startswith('mysql'):
+            pytest.skip('SQLite専用のテスト')
+        app.extensions['search_backend'] = FullTextSearchBackend(max_matches=2)
+        
+        project_id = test_knowledge_base.project_id
+        for title in ('データベース設計', 'データベース運用', 'データベース移行'):
+            authenticated_client.post('/api/v1/knowledge', json={
+                'title': title, 'content': '本文', 'project_id': project_id
+            })
+        
+        statements = []
+        
+        def record(conn, cursor, statement, parameters, context, executemany):
+            if 'MATCH' in statement:
+                statements.append(statement)
+        
+        with app.app_context():
+            engine = db.engine
+        event.listen(engine, 'before_cursor_execute', record)
+        try:
+            response = authenticated_client.post(f'/api/v1/knowledge/{test_knowledge_base.id}/search', json={
+                'query': 'データベース', 'limit': 1, 'fuzzy': False
+            })
+        finally:
+            event.remove(engine, 'before_cursor_execute', record)
+        assert len(response.json['results']) == 1
+        assert response.json['facets']['created_month'][0]['count'] == 2
+        assert len(statements) == 1
+
+
+class TestVectorSearch:
+    """ベクトル検索のテスト"""
+    
+    def test_hashing_encoder_is_deterministic(self):
+        """ハッシングエンコーダが決定的で正規化済みのテスト"""
+        import numpy as np
+        from app.search import HashingEncoder
+        
+        encoder = HashingEncoder(dim=64)
+        first = encoder.encode(['ナレッジ共有の手順', ''])
+        second = HashingEncoder(dim=64).encode(['ナレッジ共有の手順', ''])
+        
+        assert first.dtype == np.float32
+        assert np.allclose(first, second)
+        assert np.isclose(np.linalg.norm(first[0]), 1.0)
+        assert not first[1].any()
+    
+    @pytest.mark.parametrize('quantize', [False, True])
+    def test_ivf_matches_exact(self, quantize):
+        """IVF学習後も最近傍が見つかるテスト"""
+        import numpy as np
+        from app.search import VectorIndex
+        from app.search.vector import normalize_rows
+        
+        rng = np.random.default_rng(1)
+        vectors = normalize_rows(rng.normal(size=(400, 32)).astype(np.float32))
+        index = VectorIndex(32, quantize=quantize, nprobe=20, min_train_size=100)
+        index.add(list(range(400)), vectors)
+        assert index.trained
+        
+        hits = index.search(vectors[123], limit=5)
+        assert hits[0].doc_id == 123
+        assert len(hits) == 5
+        
+        index.remove(123)
+        assert 123 not in [hit.doc_id for hit in index.search(vectors[123], limit=5)]
+    
+    @pytest.mark.parametrize('quantize', [False, True])
+    def test_dead_rows_are_reclaimed(self, quantize):
+        """置き換え・削除で増えた削除済みの行が詰め直されるテスト"""
+        import numpy as np
+        from app.search import VectorIndex
+        from app.search.vector import normalize_rows
+        
+        rng = np.random.default_rng(2)
+        vectors = normalize_rows(rng.normal(size=(200, 32)).astype(np.float32))
+        index = VectorIndex(32, quantize=quantize, nprobe=20, min_train_size=100)
+        index.add(list(range(200)), vectors)
+        assert index.trained
+        
+        for _ in range(5):
+            index.add(list(range(200)), vectors)
+        for doc_id in range(0, 200, 2):
+            index.remove(doc_id)
+        assert len(index) == 100
+        assert index._size <= 200
+        assert sum(len(rows) for rows in index._lists) == index._size
+        
+        for doc_id in (1, 77, 199):
+            assert index.search(vectors[doc_id], limit=3)[0].doc_id == doc_id
+        assert 100 not in [hit.doc_id for hit in index.search(vectors[100], limit=5)]
+    
+    def test_semantic_mode(self, authenticated_client, test_knowledge_base):
+        """mode=semanticでの検索テスト"""
+        kb_id = test_knowledge_base.id
+        response = authenticated_client.post('/api/v1/knowledge', json={
+            'title': 'サーバー構築手順',
+            'content': 'nginxとgunicornでサーバーを構築する',
+            'project_id': test_knowledge_base.project_id
+        })
+        new_id = response.json['knowledge_base']['id']
+        
+        response = authenticated_client.post(f'/api/v1/knowledge/{kb_id}/search', json={
+            'query': 'サーバーの構築',
+            'mode': 'semantic'
+        })
+        assert response.status_code == 200
+        results = response.json['results']
+        assert results[0]['id'] == new_id
+        assert results[0]['score'] > results[1]['score']
+        
+        response = authenticated_client.post(f'/api/v1/knowledge/{kb_id}/search', json={
+            'query': 'test',
+            'mode': 'unknown'
+        })
+        assert response.status_code == 400
+
+
+class TestHybridSearch:
+    """ハイブリッド検索のテスト"""
+    
+    def test_reciprocal_rank_fusion(self):
+        """RRFの計算テスト"""
+        from app.search import SearchHit
+        from app.search.hybrid import reciprocal_rank_fusion
+        
+        fused = reciprocal_rank_fusion({
+            'keyword': [SearchHit(1, 5.0), SearchHit(2, 3.0)],
+            'semantic': [SearchHit(2, 0.9), SearchHit(3, 0.5)]
+        }, {'keyword': 1.0, 'semantic': 1.0}, k=60)
+        
+        assert fused[2] == pytest.approx(1 / 62 + 1 / 61)
+        assert fused[2] > fused[1] > fused[3]
+    
+    def test_weighted_fusion(self):
+        """正規化スコア融合のテスト"""
+        from app.search import SearchHit
+        from app.search.hybrid import weighted_score_fusion
+        
+        fused = weighted_score_fusion({
+            'keyword': [SearchHit(1, 10.0), SearchHit(2, 0.0)],
+            'semantic': [SearchHit(2, 0.8)]
+        }, {'keyword': 2.0, 'semantic': 1.0})
+        
+        assert fused == {1: 2.0, 2: 1.0}
+    
+    @pytest.mark.parametrize('fusion', ['rrf', 'weighted'])
+    def test_hybrid_mode(self, authenticated_client, test_knowledge_base, fusion):
+        """mode=hybridでスコア内訳が返るテスト"""
+        kb_id = test_knowledge_base.id
+        authenticated_client.post('/api/v1/knowledge', json={
+            'title': 'gunicornの設定',
+            'content': 'ワーカー数の決め方',
+            'project_id': test_knowledge_base.project_id
+        })
+        
+        response = authenticated_client.post(f'/api/v1/knowledge/{kb_id}/search', json={
+            'query': 'gunicorn ワーカー',
+            'mode': 'hybrid',
+            'depth': 10,
+            'fusion': fusion
+        })
+        assert response.status_code == 200
+        top = response.json['results'][0]
+        assert top['title'] == 'gunicornの設定'
+        assert top['score_breakdown']['keyword']['rank'] == 1
+        assert top['score_breakdown']['semantic']['rank'] == 1
+        assert top['score_breakdown']['fusion'] == fusion
+    
+    def test_invalid_fusion(self, authenticated_client, test_knowledge_base):
+        """不正な融合方式のテスト"""
+        response = authenticated_client.post(f'/api/v1/knowledge/{test_knowledge_base.id}/search', json={
+            'query': 'test',
+            'mode': 'hybrid',
+            'fusion': 'max'
+        })
+        assert response.status_code == 400
+
+
+class TestChunking:
+    """チャンク分割とパッセージ検索のテスト"""
+    
+    def test_chunk_text_respects_headings_and_budget(self):
+        """見出しをまたがず、上限内で分割されるテスト"""
+        from app.search import chunk_text
+        
+        text = '# 導入\n\n' + '\n\n'.join(f'段落{i}の本文です。' for i in range(6)) + '\n\n# 設定\n\n設定の説明。'
+        chunks = chunk_text(text, max_tokens=20, overlap_tokens=10)
+        
+        assert [chunk.position for chunk in chunks] == list(range(len(chunks)))
+        assert all(chunk.token_count <= 20 for chunk in chunks)
+        assert chunks[-1].heading == '設定'
+        assert text[chunks[-1].start:chunks[-1].end] == '# 設定\n\n設定の説明。'
+        # 同じ見出し内の隣接チャンクは重なる
+        assert chunks[1].start < chunks[0].end
+    
+    def test_chunk_text_splits_long_sentence(self):
+        """上限を超える1文も分割されるテスト"""
+        from app.search import chunk_text
+        
+        chunks = chunk_text('あ' * 50, max_tokens=20, overlap_tokens=0)
+        assert [(chunk.start, chunk.end) for chunk in chunks] == [(0, 20), (20, 40), (40, 50)]
+    
+    def test_rechunk_only_on_content_change(self, app, test_project, test_user):
+        """本文が変わったときだけ再分割されるテスト"""
+        from app.knowledge.services import create_knowledge_base, update_knowledge_base
+        from app.models import KnowledgeChunk
+        
+        with app.app_context():
+            kb = create_knowledge_base('手順書', '最初の本文', test_project.id, created_by_id=test_user.id)
+            chunk_ids = [chunk.id for chunk in kb.chunks]
+            assert chunk_ids
+            
+            update_knowledge_base(kb.id, title='新しいタイトル')
+            assert [chunk.id for chunk in kb.chunks] == chunk_ids
+            
+            update_knowledge_base(kb.id, content='まったく別の本文')
+            chunks = KnowledgeChunk.query.filter_by(knowledge_base_id=kb.id).all()
+            assert [chunk.content for chunk in chunks] == ['まったく別の本文']
+    
+    def test_passage_mode(self, authenticated_client, test_knowledge_base):
+        """mode=passageでオフセット付きのパッセージが返るテスト"""
+        content = '# 概要\n\nこの文書はデプロイ手順です。\n\n# ロールバック\n\n失敗したら前のリリースに戻します。'
+        response = authenticated_client.post('/api/v1/knowledge', json={
+            'title': '運用手順',
+            'content': content,
+            'project_id': test_knowledge_base.project_id
+        })
+        assert response.status_code == 201
+        
+        response = authenticated_client.post(f'/api/v1/knowledge/{test_knowledge_base.id}/search', json={
+            'query': 'ロールバック',
+            'mode': 'passage'
+        })
+        assert response.status_code == 200
+        top = response.json['results'][0]
+        assert top['title'] == '運用手順'
+        passage = top['passages'][0]
+        assert passage['heading'] == 'ロールバック'
+        assert content[passage['start_offset']:passage['end_offset']] == passage['text']
+
+
+class TestQueryCache:
+    """検索結果キャッシュのテスト"""
+    
+    @pytest.fixture(params=['memory', 'sqlite'])
+    def cache(self, request, tmp_path):
+        from app.search import MemoryQueryCache, SQLiteQueryCache
+        
+        if request.param == 'memory':
+            return MemoryQueryCache(max_entries=2, ttl=60)
+        return SQLiteQueryCache(str(tmp_path / 'cache.sqlite3'), max_entries=2, ttl=60)
+    
+    def test_lru_eviction_and_counters(self, cache):
+        """LRUの追い出しとカウンタのテスト"""
+        cache.set('a', [1])
+        cache.set('b', [2])
+        assert cache.get('a') == [1]
+        cache.set('c', [3])
+        
+        assert cache.get('b') is None
+        assert cache.get('c') == [3]
+        stats = cache.stats()
+        assert (stats['hits'], stats['misses'], stats['evictions']) == (2, 1, 1)
+        assert stats['entries'] == 2
+    
+    def test_ttl_expiry(self, cache):
+        """TTLで期限切れになるテスト"""
+        cache.ttl = 0
+        cache.set('a', [1])
+        assert cache.get('a') is None
+    
+    def test_cache_key_normalization(self):
+        """クエリの表記揺れが同じキーになるテスト"""
+        from app.search import make_cache_key
+        
+        assert make_cache_key(1, 'Ｆｌａｓｋ  設定', 'keyword', 3, 10) == make_cache_key(1, 'flask 設定', 'keyword', 3, 10)
+        assert make_cache_key(1, 'flask', 'keyword', 3, 10) != make_cache_key(1, 'flask', 'keyword', 4, 10)
+    
+    def test_write_invalidates_cached_results(self, app, authenticated_client, test_knowledge_base):
+        """書き込みで世代が進みキャッシュが無効になるテスト"""
+        kb_id = test_knowledge_base.id
+        search = lambda: authenticated_client.post(f'/api/v1/knowledge/{kb_id}/search', json={'query': 'redis'})
+        
+        assert search().json['results'] == []
+        assert search().json['results'] == []
+        with app.app_context():
+            from app.search import get_query_cache
+            assert get_query_cache().hits == 1
+        
+        authenticated_client.post('/api/v1/knowledge', json={
+            'title': 'Redis 設定',
+            'content': 'maxmemoryの設定',
+            'project_id': test_knowledge_base.project_id
+        })
+        assert [result['title'] for result in search().json['results']] == ['Redis 設定']
+
+    def test_other_worker_write_invalidates_cached_results(self, app, authenticated_client, test_knowledge_base):
+        """他のワーカーの書き込み（DB上の世代番号が進む）でもキャッシュが無効になるテスト"""
+        from app.models import db, KnowledgeBase
+        from app.search.generations import bump_generation
+        
+        kb_id = test_knowledge_base.id
+        search = lambda: authenticated_client.post(f'/api/v1/knowledge/{kb_id}/search', json={'query': 'redis'})
+        assert search().json['results'] == []
+        assert search().json['results'] == []
+        
+        with app.app_context():
+            db.session.add(KnowledgeBase(
+                title='Redis 設定',
+                content='maxmemoryの設定',
+                project_id=test_knowledge_base.project_id,
+                created_by_id=test_knowledge_base.created_by_id
+            ))
+            db.session.commit()
+            bump_generation(test_knowledge_base.project_id)
+        
+        assert [result['title'] for result in search().json['results']] == ['Redis 設定']
+        response = authenticated_client.get(f'/api/v1/projects/{test_knowledge_base.project_id}/search/status')
+        assert response.json['status']['cache']['generation'] == 1
+
+
+class TestSuggest:
+    """入力補完のテスト"""
+    
+    def test_prefix_trie(self):
+        """重み順の前方一致と差分更新のテスト"""
+        from app.search import PrefixTrie
+        
+        trie = PrefixTrie(top_k=3)
+        for key, weight in [('docker', 2), ('docker compose', 5), ('django', 3), ('dns', 1)]:
+            trie.add(key, weight)
+        
+        assert trie.complete('d') == [('docker compose', 5), ('django', 3), ('docker', 2)]
+        assert trie.complete('doc') == [('docker compose', 5), ('docker', 2)]
+        assert trie.complete('x') == []
+        
+        trie.add('docker compose', -5)
+        assert trie.complete('d') == [('django', 3), ('docker', 2), ('dns', 1)]
+        assert 'docker compose' not in trie
+    
+    def test_suggest_endpoint(self, app, authenticated_client, test_knowledge_base):
+        """タイトル・タグ・検索履歴からの補完テスト"""
+        project_id = test_knowledge_base.project_id
+        for title, tags in [('デプロイ手順', ['デプロイ']), ('デプロイの注意点', ['デプロイ', '運用'])]:
+            authenticated_client.post('/api/v1/knowledge', json={
+                'title': title,
+                'content': '本文',
+                'project_id': project_id,
+                'tags': tags
+            })
+        
+        response = authenticated_client.get(f'/api/v1/projects/{project_id}/suggest?q=デプ')
+        assert response.status_code == 200
+        suggestions = response.json['suggestions']
+        assert suggestions[0] == {'text': 'デプロイ', 'score': 2.0}
+        assert {s['text'] for s in suggestions} == {'デプロイ', 'デプロイ手順', 'デプロイの注意点'}
+        
+        # 結果のあった検索は以降の補完候補になる（カタカナ・ひらがなの違いは吸収される）
+        authenticated_client.post(f'/api/v1/knowledge/{test_knowledge_base.id}/search', json={'query': 'デプロイ 手順'})
+        response = authenticated_client.get(f'/api/v1/projects/{project_id}/suggest?q=でぷろい ')
+        assert 'デプロイ 手順' in [s['text'] for s in response.json['suggestions']]
+        
+        # 削除したナレッジのタイトルは候補から消える
+        kb_id = [kb['id'] for kb in authenticated_client.get(
+            f'/api/v1/knowledge?project_id={project_id}'
+        ).json['knowledge_bases'] if kb['title'] == 'デプロイ手順'][0]
+        authenticated_client.delete(f'/api/v1/knowledge/{kb_id}')
+        response = authenticated_client.get(f'/api/v1/projects/{project_id}/suggest?q=デプ')
+        assert 'デプロイ手順' not in [s['text'] for s in response.json['suggestions']]
+    
+    def test_failed_build_is_not_published(self, app, test_knowledge_base, monkeypatch):
+        """構築に失敗したトライが公開されず、次回に構築し直されるテスト"""
+        from app.search import get_suggest_index
+        
+        project_id = test_knowledge_base.project_id
+        
+        def fail(title, tags):
+            raise RuntimeError('build failure')
+        
+        with app.app_context():
+            index = get_suggest_index()
+            with monkeypatch.context() as m:
+                m.setattr(index, '_document_entries', fail)
+                with pytest.raises(RuntimeError):
+                    index.get_trie(project_id)
+            assert project_id not in index._tries
+            assert [s['text'] for s in index.suggest(project_id, 'test')] == ['Test Knowledge Base']
+
+
+class TestFuzzySearch:
+    """あいまい検索のテスト"""
+    
+    def test_edit_distance(self):
+        """編集距離（入れ替えを1操作）のテスト"""
+        from app.search import edit_distance
+        
+        assert edit_distance('kubernetes', 'kubernetes', 2) == 0
+        assert edit_distance('kuberentes', 'kubernetes', 2) == 1
+        assert edit_distance('docker', 'dokcer', 1) == 1
+        assert edit_distance('redis', 'mysql', 2) == 3
+    
+    def test_symspell_lookup(self):
+        """削除索引による近似語の検索テスト"""
+        from app.search import SymSpellIndex
+        
+        index = SymSpellIndex(max_distance=2)
+        for term, count in [('kubernetes', 5), ('kubectl', 2), ('こんてな', 3)]:
+            index.add(term, count)
+        
+        assert index.lookup('kubernetis') == [('kubernetes', 1, 5)]
+        assert index.lookup('こんていな', 1) == [('こんてな', 1, 3)]
+        
+        index.add('kubernetes', -5)
+        assert index.lookup('kubernetis') == []
+    
+    def test_fuzzy_search_and_did_you_mean(self, authenticated_client, test_knowledge_base):
+        """綴り間違いでもヒットし、修正候補が返るテスト"""
+        authenticated_client.post('/api/v1/knowledge', json={
+            'title': 'Kubernetes入門',
+            'content': 'コンテナのオーケストレーション',
+            'project_id': test_knowledge_base.project_id
+        })
+        url = f'/api/v1/knowledge/{test_knowledge_base.id}/search'
+        
+        response = authenticated_client.post(url, json={'query': 'kubernetis', 'fuzzy': False})
+        assert response.json['results'] == []
+        assert response.json['did_you_mean'] == 'Kubernetes'
+        
+        response = authenticated_client.post(url, json={'query': 'kubernetis'})
+        assert [r['title'] for r in response.json['results']] == ['Kubernetes入門']
+        
+        response = authenticated_client.post(url, json={'query': 'オーケストレーショソ 設定'})
+        assert response.json['did_you_mean'] == 'オーケストレーション 設定'
+        
+        # 結果のあった過去のクエリが優先される
+        authenticated_client.post(url, json={'query': 'kubernetes 入門'})
+        response = authenticated_client.post(url, json={'query': 'kubernetes 入問'})
+        assert response.json['did_you_mean'] == 'kubernetes 入門'
+
+
+class TestHighlight:
+    """ハイライトとスニペットのテスト"""
+    
+    def test_find_matches_with_offsets(self):
+        """正規化の前後で文字位置がずれないテスト"""
+        from app.search import find_matches, highlight_terms
+        
+        text = 'ｶﾞｲﾄﾞ: Docker と docker compose の使い方'
+        matches = find_matches(text, highlight_terms('DOCKER ガイド'))
+        assert [text[start:end] for start, end in matches] == ['ｶﾞｲﾄﾞ', 'Docker', 'docker']
+    
+    def test_densest_window(self):
+        """一致が最も密な範囲を選ぶテスト"""
+        from app.search import densest_window
+        
+        matches = [(5, 8), (300, 305), (310, 315), (320, 322)]
+        start, end = densest_window(matches, 1000, 60)
+        assert start <= 300 and 322 <= end and end - start == 60
+    
+    def test_search_returns_highlights(self, authenticated_client, test_knowledge_base):
+        """検索結果にスニペットと本文中のオフセットが付くテスト"""
+        content = '前置き。' * 100 + 'ここでgunicornのワーカー数を設定します。' + '後書き。' * 100
+        authenticated_client.post('/api/v1/knowledge', json={
+            'title': 'サーバー設定',
+            'content': content,
+            'project_id': test_knowledge_base.project_id
+        })
+        
+        response = authenticated_client.post(f'/api/v1/knowledge/{test_knowledge_base.id}/search', json={
+            'query': 'gunicorn'
+        })
+        top = response.json['results'][0]
+        snippet = top['snippet']
+        assert content[snippet['start_offset']:snippet['end_offset']] == snippet['text']
+        assert len(snippet['text']) <= 160
+        assert [content[h['start']:h['end']] for h in top['highlights']] == ['gunicorn']
+
+
+class TestFacets:
+    """ファセット（絞り込みと件数）のテスト"""
+    
+    def _create(self, client, project_id, title, category, tags):
+        response = client.post('/api/v1/knowledge', json={
+            'title': title,
+            'content': 'redisのキャッシュ設定',
+            'project_id': project_id,
+            'category': category,
+            'tags': tags
+        })
+        return response.json['knowledge_base']['id']
+    
+    def test_filters_and_counts(self, authenticated_client, test_knowledge_base):
+        """絞り込みが検索中に適用され、件数がビット集合から数えられるテスト"""
+        project_id = test_knowledge_base.project_id
+        ops_id = self._create(authenticated_client, project_id, 'Redis 運用', 'ops', ['redis', 'cache'])
+        dev_id = self._create(authenticated_client, project_id, 'Redis 開発', 'dev', ['redis'])
+        url = f'/api/v1/knowledge/{test_knowledge_base.id}/search'
+        
+        response = authenticated_client.post(url, json={'query': 'redis', 'fuzzy': False})
+        facets = response.json['facets']
+        assert {'value': 'redis', 'count': 2} in facets['tag']
+        assert {'value': 'cache', 'count': 1} in facets['tag']
+        assert facets['author'][0]['label'] == 'testuser'
+        
+        response = authenticated_client.post(url, json={'query': 'redis', 'filters': {'category': 'ops'}})
+        assert [r['id'] for r in response.json['results']] == [ops_id]
+        assert response.json['facets']['category'] == [{'value': 'ops', 'count': 1}]
+        
+        response = authenticated_client.post(url, json={
+            'query': 'redis', 'mode': 'semantic', 'filters': {'tag': ['cache', 'missing']}
+        })
+        assert [r['id'] for r in response.json['results']] == [ops_id]
+        
+        # 更新はファセットにも差分で反映される
+        authenticated_client.put(f'/api/v1/knowledge/{dev_id}', json={'category': 'ops'})
+        response = authenticated_client.post(url, json={
+            'query': 'redis', 'mode': 'passage', 'filters': {'category': ['ops'], 'created_to': '2999-12-31'}
+        })
+        assert sorted(r['id'] for r in response.json['results']) == sorted([ops_id, dev_id])
+        
+        response = authenticated_client.post(url, json={'query': 'redis', 'filters': {'created_from': '2999-01-01'}})
+        assert response.json['results'] == []
+    
+    def test_tags_ignore_case(self, authenticated_client, test_knowledge_base):
+        """タグの件数と絞り込みが大文字・小文字を区別しないテスト"""
+        project_id = test_knowledge_base.project_id
+        upper_id = self._create(authenticated_client, project_id, 'Redis 運用', 'ops', ['Redis'])
+        lower_id = self._create(authenticated_client, project_id, 'Redis 開発', 'dev', ['redis'])
+        url = f'/api/v1/knowledge/{test_knowledge_base.id}/search'
+        
+        response = authenticated_client.post(url, json={'query': 'redis', 'fuzzy': False})
+        assert response.json['facets']['tag'] == [{'value': 'Redis', 'count': 2}]
+        
+        response = authenticated_client.post(url, json={'query': 'redis', 'filters': {'tag': 'REDIS'}})
+        assert sorted(r['id'] for r in response.json['results']) == sorted([upper_id, lower_id])
+    
+    def test_facets_do_not_widen_search(self, app, authenticated_client, test_knowledge_base, monkeypatch):
+        """件数のために検索の取得件数を増やさず、呼び出し側のlimit・depthのまま検索するテスト"""
+        project_id = test_knowledge_base.project_id
+        self._create(authenticated_client, project_id, 'Redis 運用', 'ops', ['redis'])
+        self._create(authenticated_client, project_id, 'Redis 開発', 'dev', ['redis'])
+        url = f'/api/v1/knowledge/{test_knowledge_base.id}/search'
+        
+        limits = []
+        for name in ('search_backend', 'vector_search'):
+            engine = app.extensions[name]
+            
+            def search(project_id, query, limit=10, *args, _search=engine.search, **kwargs):
+                limits.append(limit)
+                return _search(project_id, query, limit, *args, **kwargs)
+            monkeypatch.setattr(engine, 'search', search)
+        
+        response = authenticated_client.post(url, json={'query': 'redis', 'limit': 1, 'fuzzy': False})
+        assert len(response.json['results']) == 1
+        assert {'value': 'redis', 'count': 2} in response.json['facets']['tag']
+        
+        response = authenticated_client.post(url, json={'query': 'redis', 'limit': 1, 'mode': 'semantic'})
+        assert len(response.json['results']) == 1
+        assert {'value': 'dev', 'count': 1} in response.json['facets']['category']
+        
+        response = authenticated_client.post(url, json={
+            'query': 'redis', 'limit': 1, 'mode': 'hybrid', 'depth': 5, 'filters': {'category': 'ops'}
+        })
+        assert response.json['facets']['category'] == [{'value': 'ops', 'count': 1}]
+        assert limits == [1, 1, 5, 5]
+    
+    def test_popcount(self):
+        """ビット集合の要素数がint.bit_count()のないPython 3.8/3.9でも数えられるテスト"""
+        from app.search.facets import DocumentFilter, popcount
+        
+        assert popcount(0) == 0
+        assert popcount(0b1011) == 3
+        assert popcount((1 << 200) | 1) == 2
+        assert len(DocumentFilter(type('Facets', (), {'ordinals': {}})(), 0b110)) == 2
+    
+    def test_invalid_filters(self, authenticated_client, test_knowledge_base):
+        """不正な絞り込み条件のテスト"""
+        url = f'/api/v1/knowledge/{test_knowledge_base.id}/search'
+        response = authenticated_client.post(url, json={'query': 'redis', 'filters': {'author': 'alice'}})
+        assert response.status_code == 400
+        response = authenticated_client.post(url, json={'query': 'redis', 'filters': {'created_from': 'yesterday'}})
+        assert response.status_code == 400
+        
+        # 真偽値は整数として受け付けない
+        response = authenticated_client.post(url, json={'query': 'redis', 'limit': True})
+        assert response.status_code == 400
+        response = authenticated_client.post(url, json={'query': 'redis', 'mode': 'hybrid', 'depth': True})
+        assert response.status_code == 400
+        response = authenticated_client.post('/api/v1/search', json={'query': 'redis', 'limit': True})
+        assert response.status_code == 400
+
+
+class TestCrossProjectSearch:
+    """プロジェクト横断検索のテスト"""
+    
+    def test_searches_only_member_projects(self, app, authenticated_client, test_project):
+        """参加プロジェクトだけを1つの順位で返すテスト"""
+        from app.knowledge.services import create_knowledge_base
+        from app.models import User, db
+        from app.projects.services import ProjectService
+        
+        response = authenticated_client.post('/api/v1/projects', json={'name': 'Second'})
+        second_id = response.json['project']['id']
+        with app.app_context():
+            other = User(email='other@example.com', username='other', email_verified=True)
+            other.set_password('password123')
+            db.session.add(other)
+            db.session.commit()
+            private_id = ProjectService.create_project('Private', '', other.id).id
+            create_knowledge_base('Redis 非公開', 'redis', private_id, created_by_id=other.id)
+        
+        for project_id, title in [(test_project.id, 'Redis 入門'), (second_id, 'Redis 運用 redis')]:
+            authenticated_client.post('/api/v1/knowledge', json={
+                'title': title, 'content': 'redis', 'project_id': project_id
+            })
+        
+        response = authenticated_client.post('/api/v1/search', json={'query': 'redis'})
+        assert response.status_code == 200
+        results = response.json['results']
+        assert [r['title'] for r in results] == ['Redis 運用 redis', 'Redis 入門']
+        
+        response = authenticated_client.post('/api/v1/search', json={
+            'query': 'redis', 'project_ids': [test_project.id, private_id]
+        })
+        assert [r['project_id'] for r in response.json['results']] == [test_project.id]
+        
+        # プロジェクト削除は横断索引にも反映される
+        authenticated_client.delete(f'/projects/{second_id}')
+        response = authenticated_client.post('/api/v1/search', json={'query': 'redis'})
+        assert [r['title'] for r in response.json['results']] == ['Redis 入門']
+    
+    def test_project_keys_survive_reopen(self, app, tmp_path):
+        """永続化した横断索引を開き直した後や別ワーカーの書き込みでもプロジェクトで絞り込めるテスト"""
+        from types import SimpleNamespace
+        from app.search.crossproject import CrossProjectSearchEngine
+        
+        def knowledge(kb_id, project_id, title):
+            return SimpleNamespace(id=kb_id, project_id=project_id, title=title, content='redis', tags=None)
+        
+        writer = CrossProjectSearchEngine(index_dir=str(tmp_path))
+        with app.app_context():
+            writer.get_index('all')
+            writer.index_documents([knowledge(1, 10, 'Redis A'), knowledge(2, 20, 'Redis B')])
+            
+            # 再起動相当：別インスタンスが既存セグメントを開き、さらに書き込む
+            restarted = CrossProjectSearchEngine(index_dir=str(tmp_path))
+            restarted.index_document(knowledge(3, 10, 'Redis C'))
+            assert sorted(hit.doc_id for hit in restarted.search_projects({10}, 'redis')) == [1, 3]
+            
+            # 書き込んだワーカー側からも他のワーカーの文書が見える
+            assert sorted(hit.doc_id for hit in writer.search_projects({10, 20}, 'redis')) == [1, 2, 3]
+            
+            restarted.drop_project(10)
+            assert [hit.doc_id for hit in writer.search_projects({10, 20}, 'redis')] == [2]